@@ -20,7 +20,7 @@ except ImportError:
 
 from tempfile import NamedTemporaryFile, mkdtemp
 from osc.fetch import *
-from osc.core import get_buildinfo, store_read_apiurl, store_read_project, store_read_package, meta_exists, quote_plus, get_buildconfig, is_package_dir, dgst
+from osc.core import get_buildinfo, store_read_apiurl, store_read_project, store_read_package, meta_exists, quote_plus, get_buildconfig, is_package_dir
 from osc.core import get_binarylist, get_binary_file, run_external, raw_input
 from osc.util import rpmquery, debquery, archquery
 import osc.conf
@@ -878,7 +878,8 @@ def main(apiurl, opts, argv):
                       offline = opts.noinit or opts.offline,
                       http_debug = config['http_debug'],
                       enable_cpio = not opts.disable_cpio_bulk_download,
-                      cookiejar=cookiejar)
+                      cookiejar=cookiejar,
+                      verify_cache = opts.verify_cache)
 
     if not opts.trust_all_projects:
         # implicitly trust the project we are building for
@@ -1098,11 +1099,7 @@ def main(apiurl, opts, argv):
 
     for i in bi.deps:
         if i.hdrmd5:
-            from .util import packagequery
-            if i.name.startswith('container:'):
-                hdrmd5 = dgst(i.fullfilename)
-            else:
-                hdrmd5 = packagequery.PackageQuery.queryhdrmd5(i.fullfilename)
+            hdrmd5 = fetcher.index.hdrmd5(i.fullfilename, i.name.startswith('container:'))
             if not hdrmd5:
                 print("Error: cannot get hdrmd5 for %s" % i.fullfilename)
                 sys.exit(1)
@@ -8,6 +8,8 @@ from __future__ import print_function
 from . import cmdln
 from . import conf
 from . import oscerr
+from . import pkgcache
+from . import statusd
 import sys
 import signal
 import time
@@ -104,6 +106,10 @@ class Osc(cmdln.Cmdln):
                       help='debug HTTP traffic (filters some headers)')
         optparser.add_option('--http-full-debug', action='store_true',
                       help='debug HTTP traffic (filters no headers)')
+        optparser.add_option('--http-stats', action='store_true',
+                      help='print latency and transfer statistics of the HTTP requests per api endpoint at exit')
+        optparser.add_option('--http-stats-file', metavar='FILE',
+                      help='write a record of each HTTP request as JSON line to FILE at exit')
         optparser.add_option('-d', '--debug', action='store_true',
                       help='print info useful for debugging')
         optparser.add_option('-A', '--apiurl', dest='apiurl',
@@ -163,6 +169,15 @@ class Osc(cmdln.Cmdln):
             if try_again:
                 self.postoptparse(try_again = False)
 
+        if self.options.http_stats or self.options.http_stats_file:
+            import atexit
+            from . import httpstats
+            stats = httpstats.enable()
+            if self.options.http_stats:
+                atexit.register(stats.print_summary)
+            if self.options.http_stats_file:
+                atexit.register(stats.dump, self.options.http_stats_file)
+
         self.options.verbose = conf.config['verbose']
         self.download_progress = None
         if conf.config.get('show_download_progress', False):
@@ -4351,42 +4366,63 @@ Please submit there instead, or use --nodevelproject to force direct submission.
             Project.init_project(apiurl, prj_dir, project, conf.config['do_package_tracking'])
             print(statfrmt('A', prj_dir))
 
-            # all packages
-            for package in meta_get_packagelist(apiurl, project):
-                if opts.output_dir is not None:
-                    outputdir = os.path.join(opts.output_dir, package)
-                    if not os.path.exists(opts.output_dir):
-                        os.mkdir(os.path.join(opts.output_dir))
-                else:
-                    outputdir=None
+            packages = meta_get_packagelist(apiurl, project)
+            # don't check out local links by default
+            local_links = get_local_links(apiurl, project)
+            if local_links is None:
+                local_links = {}
+                for package in packages:
+                    try:
+                        m = show_files_meta(apiurl, project, package)
+                        li = Linkinfo()
+                        li.read(ET.fromstring(''.join(m)).find('linkinfo'))
+                        if not li.haserror() and li.project == project:
+                            local_links[package] = li.package
+                    except:
+                        pass
+
+            # the files of the following packages are downloaded while
+            # a package is checked out
+            prefetcher = checkout_prefetcher(apiurl, project, prj_dir, packages, local_links,
+                                             expand_link=expand_link,
+                                             server_service_files=opts.server_side_source_service_files,
+                                             size_limit=opts.limit_size, meta=opts.meta)
+            try:
+                for index, package in enumerate(packages):
+                    if opts.output_dir is not None:
+                        outputdir = os.path.join(opts.output_dir, package)
+                        if not os.path.exists(opts.output_dir):
+                            os.mkdir(os.path.join(opts.output_dir))
+                    else:
+                        outputdir=None
 
-                # don't check out local links by default
-                try:
-                    m = show_files_meta(apiurl, project, package)
-                    li = Linkinfo()
-                    li.read(ET.fromstring(''.join(m)).find('linkinfo'))
-                    if not li.haserror():
-                        if li.project == project:
-                            print(statfrmt('S', package + " link to package " + li.package))
-                            continue
-                except:
-                    pass
+                    if package in local_links:
+                        print(statfrmt('S', package + " link to package " + local_links[package]))
+                        continue
 
-                try:
-                    checkout_package(apiurl, project, package, expand_link = expand_link, \
-                                     prj_dir = prj_dir, service_files = opts.source_service_files, \
-                                     server_service_files = opts.server_side_source_service_files, \
-                                     progress_obj=self.download_progress, size_limit=opts.limit_size, \
-                                     meta=opts.meta)
-                except oscerr.LinkExpandError as e:
-                    print('Link cannot be expanded:\n', e, file=sys.stderr)
-                    print('Use "osc repairlink" for fixing merge conflicts:\n', file=sys.stderr)
-                    # check out in unexpanded form at least
-                    checkout_package(apiurl, project, package, expand_link = False, \
-                                     prj_dir = prj_dir, service_files = opts.source_service_files, \
-                                     server_service_files = opts.server_side_source_service_files, \
-                                     progress_obj=self.download_progress, size_limit=opts.limit_size, \
-                                     meta=opts.meta)
+                    if prefetcher is not None:
+                        prefetcher.claim_package(index)
+                    try:
+                        checkout_package(apiurl, project, package, expand_link = expand_link, \
+                                         prj_dir = prj_dir, service_files = opts.source_service_files, \
+                                         server_service_files = opts.server_side_source_service_files, \
+                                         progress_obj=self.download_progress, size_limit=opts.limit_size, \
+                                         meta=opts.meta, prefetcher=prefetcher)
+                    except oscerr.LinkExpandError as e:
+                        print('Link cannot be expanded:\n', e, file=sys.stderr)
+                        print('Use "osc repairlink" for fixing merge conflicts:\n', file=sys.stderr)
+                        # check out in unexpanded form at least
+                        checkout_package(apiurl, project, package, expand_link = False, \
+                                         prj_dir = prj_dir, service_files = opts.source_service_files, \
+                                         server_service_files = opts.server_side_source_service_files, \
+                                         progress_obj=self.download_progress, size_limit=opts.limit_size, \
+                                         meta=opts.meta)
+                    finally:
+                        if prefetcher is not None:
+                            prefetcher.release_package(index)
+            finally:
+                if prefetcher is not None:
+                    prefetcher.close()
             print_request_list(apiurl, project)
 
         else:
@@ -4401,6 +4437,9 @@ Please submit there instead, or use --nodevelproject to force direct submission.
     @cmdln.option('-e', '--show-excluded', action='store_true',
                         help='also show files which are excluded by the ' \
                              '"exclude_glob" config option')
+    @cmdln.option('--watch', action='store_true',
+                        help='run a status daemon for the given working copies ' \
+                             '(see the "status_socket" config option)')
     @cmdln.alias('st')
     def do_status(self, subcmd, opts, *args):
         """${cmd_name}: Show status of files in working copy
@@ -4425,6 +4464,11 @@ Please submit there instead, or use --nodevelproject to force direct submission.
           osc st <directory>
           osc st file1 file2 ...
 
+        With --watch, osc keeps running and watches the given package and
+        project working copies (via inotify). Other osc status calls get
+        the status of these working copies from it instead of scanning
+        them, until it is stopped (Ctrl-C).
+
         usage:
             osc status [OPTS] [PATH...]
         ${cmd_option_list}
@@ -4434,6 +4478,21 @@ Please submit there instead, or use --nodevelproject to force direct submission.
             raise oscerr.WrongOptions('\'--quiet\' and \'--verbose\' are mutually exclusive')
 
         args = parseargs(args)
+        socket_path = os.path.expanduser(conf.config['status_socket'])
+        if opts.watch:
+            if not conf.config['status_socket']:
+                raise oscerr.WrongOptions('\'--watch\' needs the "status_socket" config option')
+            try:
+                daemon = statusd.StatusDaemon(socket_path, args)
+            except EnvironmentError as e:
+                raise oscerr.OscIOError(e, 'cannot watch the working copies: %s' % e)
+            print('Watching %d packages, listening on %s' % (len(daemon.packages), socket_path))
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+
         lines = []
         excl_states = (' ',)
         if opts.quiet:
@@ -4456,12 +4515,13 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                         lines.append(statfrmt('F', os.path.normpath(os.path.join(prj.dir, pac))))
                     elif st == ' ' and opts.verbose or st != ' ':
                         lines.append(statfrmt(st, os.path.normpath(os.path.join(prj.dir, pac))))
-                    states = p.get_status(opts.show_excluded, *excl_states)
+                    states = statusd.get_status(socket_path, p, opts.show_excluded, *excl_states)
                     for st, filename in sorted(states, lambda x, y: cmp(x[1], y[1])):
                         lines.append(statfrmt(st, os.path.normpath(os.path.join(p.dir, filename))))
             else:
                 p = findpacs([arg])[0]
-                for st, filename in sorted(p.get_status(opts.show_excluded, *excl_states), lambda x, y: cmp(x[1], y[1])):
+                states = statusd.get_status(socket_path, p, opts.show_excluded, *excl_states)
+                for st, filename in sorted(states, lambda x, y: cmp(x[1], y[1])):
                     lines.append(statfrmt(st, os.path.normpath(os.path.join(p.dir, filename))))
         if lines:
             print('\n'.join(lines))
@@ -4637,7 +4697,7 @@ Please submit there instead, or use --nodevelproject to force direct submission.
         arg_list = args[:]
         for arg in arg_list:
             if conf.config['do_package_tracking'] and is_project_dir(arg):
-                prj = Project(arg)
+                prj = Project(arg, progress_obj=self.download_progress)
                 if not msg and not opts.no_message:
                     msg = edit_message()
 
@@ -4654,7 +4714,7 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                 prj.commit(msg=msg, skip_local_service_run=skip_local_service_run, verbose=opts.verbose, can_branch=can_branch)
                 args.remove(arg)
 
-        pacs, no_pacs = findpacs(args, fatal=False)
+        pacs, no_pacs = findpacs(args, progress_obj=self.download_progress, fatal=False)
 
         if conf.config['do_package_tracking'] and (pacs or no_pacs):
             prj_paths = {}
@@ -4695,7 +4755,7 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                     # fail with an appropriate error message
                     store_read_apiurl(pac, defaulturl=False)
             for prj_path, packages in prj_paths.items():
-                prj = Project(prj_path)
+                prj = Project(prj_path, progress_obj=self.download_progress)
                 if not msg and not opts.no_message:
                     msg = get_commit_msg(prj.absdir, pac_objs[prj_path])
 
@@ -4711,7 +4771,7 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                 prj.commit(packages, msg=msg, files=prj_files, skip_local_service_run=skip_local_service_run, verbose=opts.verbose, can_branch=can_branch, force=opts.force)
                 store_unlink_file(prj.absdir, '_commit_msg')
             for pac in single_paths:
-                p = Package(pac)
+                p = Package(pac, progress_obj=self.download_progress)
                 if not msg and not opts.no_message:
                     msg = get_commit_msg(p.absdir, [p])
                 p.commit(msg, skip_local_service_run=skip_local_service_run, verbose=opts.verbose, force=opts.force)
@@ -6056,6 +6116,8 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                   dest='disable_cpio_bulk_download', help=SUPPRESS_HELP)
     @cmdln.option('--download-api-only', action='store_true',
                   help='only fetch packages from the api')
+    @cmdln.option('--verify-cache', action='store_true',
+                  help='verify the hdrmd5 of all cached packages again')
     @cmdln.option('--oldpackages', metavar='DIR',
             help='take previous build from DIR (special values: _self, _link)')
     @cmdln.option('--shell', action='store_true',
@@ -8884,6 +8946,81 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                 if not opts.dry_run:
                     os.unlink(os.path.join(p.absdir, filename))
 
+    @cmdln.option('-n', '--dry-run', action='store_true',
+                  help='print the results without actually removing a file')
+    def do_gc(self, subcmd, opts):
+        """${cmd_name}: removes unused files from the shared object store
+
+        The pristine copies of the source files in the working copies are
+        kept in the directory which is configured by the object_store_dir
+        option. This command removes the files which are not used by any
+        working copy anymore (because it was removed or updated).
+
+        ${cmd_usage}
+        ${cmd_option_list}
+        """
+        objects = conf.get_object_store()
+        if objects is None:
+            raise oscerr.WrongArgs('the shared object store is disabled (see the object_store_dir option)')
+        removed = objects.gc(opts.dry_run)
+        for filename, size in removed:
+            print('Removing: %s' % filename)
+        print('%d files, %d bytes' % (len(removed), sum(size for _, size in removed)))
+
+    @cmdln.option('-s', '--max-size', metavar='MIB',
+                  help='maximum size of the package cache in MiB '
+                       '(default: the packagecache_max_size option, 0: no limit)')
+    @cmdln.option('-a', '--max-age', metavar='DAYS',
+                  help='evict packages which were not used for DAYS days '
+                       '(default: the packagecache_max_age option, 0: no limit)')
+    @cmdln.option('-n', '--dry-run', action='store_true',
+                  help='print the results without actually removing a file')
+    def do_cache(self, subcmd, opts, *args):
+        """${cmd_name}: show the usage of the package cache or evict packages from it
+
+        The build dependencies which are downloaded by "osc build" are kept
+        in the packagecachedir. "stats" shows the hit rate of the cache, its
+        size per project and repository and the space which "prune"
+        reclaims: "prune" evicts the least recently used packages until
+        the cache fits into the maximum size and the packages which were
+        not used within the maximum age. Packages which were used within
+        the last hour (e.g. by a running build) are not evicted.
+
+        usage:
+            osc cache stats [--max-size MIB] [--max-age DAYS]
+            osc cache prune [-n] [--max-size MIB] [--max-age DAYS]
+        ${cmd_option_list}
+        """
+        if len(args) != 1 or not args[0] in ('stats', 'prune'):
+            raise oscerr.WrongArgs('Please specify either "stats" or "prune"')
+        apihost = urlsplit(self.get_api_url())[1]
+        cachedir = conf.config['packagecachedir'] % {'apihost': apihost}
+        try:
+            cache = pkgcache.get_package_cache(cachedir, opts.max_size, opts.max_age)
+        except ValueError:
+            raise oscerr.WrongOptions('--max-size and --max-age must be numbers')
+        mib = 1024.0 * 1024
+        if args[0] == 'prune':
+            evicted = cache.prune(opts.dry_run)
+            for path, _, _ in evicted:
+                print('Removing: %s' % os.path.join(cachedir, path))
+            print('%d files, %.1f MiB' % (len(evicted), sum(size for _, size, _ in evicted) / mib))
+            return
+        stats = cache.stats()
+        requests = stats['hits'] + stats['misses']
+        print('package cache: %s' % cachedir)
+        if requests:
+            print('hit rate: %.1f%% (%d hits, %d misses)'
+                  % (100.0 * stats['hits'] / requests, stats['hits'], stats['misses']))
+        print('size: %.1f MiB in %d files' % (stats['size'] / mib, stats['files']))
+        print('reclaimable: %.1f MiB in %d files'
+              % (sum(size for _, size, _ in stats['evict']) / mib, len(stats['evict'])))
+        if stats['repos']:
+            print()
+            print('%10s %7s  %s' % ('MiB', 'files', 'project/repository'))
+            for key, (size, count) in sorted(stats['repos'].items()):
+                print('%10.1f %7d  %s' % (size / mib, count, '/'.join(key)))
+
     @cmdln.option('-c', '--comment',
             help='comment text', metavar='COMMENT')
     @cmdln.option('-p', '--parent',
@@ -37,6 +37,7 @@ The configuration dictionary could look like this:
 """
 
 import bz2
+import atexit
 import base64
 import os
 import re
@@ -45,7 +46,7 @@ import ssl
 import warnings
 
 try:
-    from http.cookiejar import LWPCookieJar, CookieJar
+    from http.cookiejar import CookieJar
     from http.client import HTTPConnection, HTTPResponse
     from io import StringIO
     from urllib.parse import urlsplit
@@ -54,7 +55,7 @@ try:
     from urllib.request import AbstractHTTPHandler, build_opener, proxy_bypass, HTTPSHandler
 except ImportError:
     #python 2.x
-    from cookielib import LWPCookieJar, CookieJar
+    from cookielib import CookieJar
     from httplib import HTTPConnection, HTTPResponse
     from StringIO import StringIO
     from urlparse import urlsplit
@@ -62,6 +63,9 @@ except ImportError:
     from urllib2 import AbstractHTTPHandler, build_opener, proxy_bypass, HTTPSHandler
 
 from . import OscConfigParser
+from . import httpcache
+from . import objectstore
+from . import oschttp
 from osc import oscerr
 from .oscsslexcp import NoSecureSSLError
 
@@ -128,6 +132,22 @@ DEFAULTS = {'apiurl': 'https://api.opensuse.org',
             'http_debug': '0',
             'http_full_debug': '0',
             'http_retries': '3',
+            # initial and maximum delay (in seconds) between retries
+            'http_retry_delay': '1',
+            'http_retry_max_delay': '30',
+            # consecutive server failures after which requests fail fast
+            # for http_breaker_timeout seconds (0 disables the circuit breaker)
+            'http_breaker_threshold': '5',
+            'http_breaker_timeout': '60',
+            # number of idle keep-alive connections kept per api host (0 disables keep-alive)
+            'http_pool_size': '4',
+            # seconds after which an idle keep-alive connection is not reused anymore
+            'http_pool_timeout': '30',
+            # directory and size (in MiB) of the on-disk cache for api responses (0 disables it)
+            'http_cache_dir': '~/.cache/osc/http',
+            'http_cache_size': '50',
+            # keep meta and source listings in memory while osc runs
+            'http_memoize': '1',
             'verbose': '1',
             'no_preinstallimage': '0',
             'traceback': '0',
@@ -183,7 +203,25 @@ DEFAULTS = {'apiurl': 'https://api.opensuse.org',
             'vc-cmd': '/usr/lib/build/vc',
 
             # heuristic to speedup Package.status
-            'status_mtime_heuristic': '0'
+            'status_mtime_heuristic': '0',
+            # number of threads which hash working copy and cached files
+            'hash_workers': '4',
+            # number of source files which are downloaded concurrently
+            'download_workers': '4',
+            # number of files which are uploaded concurrently by a commit
+            'upload_workers': '4',
+            # number of build dependencies which are downloaded concurrently
+            'fetch_workers': '8',
+            # maximum number of concurrent downloads from one mirror host
+            'fetch_host_connections': '4',
+            # shared store of the pristine copies of source files (empty disables it)
+            'object_store_dir': '',
+            # unix socket of the status daemon (osc status --watch)
+            'status_socket': '~/.cache/osc/status.sock',
+            # maximum size (in MiB) of the package cache and number of days after
+            # which an unused package is evicted from it (0: no limit)
+            'packagecache_max_size': '0',
+            'packagecache_max_age': '0',
 }
 
 # some distros like Debian rename and move build to obs-build
@@ -200,7 +238,7 @@ boolean_opts = ['debug', 'do_package_tracking', 'http_debug', 'post_mortem', 'tr
     'checkout_no_colon', 'checkout_rooted', 'check_for_request_on_action', 'linkcontrol', 'show_download_progress', 'request_show_interactive',
     'request_show_source_buildstatus', 'review_inherit_group', 'use_keyring', 'gnome_keyring', 'no_verify', 'builtin_signature_check',
     'http_full_debug', 'include_request_from_project', 'local_service_run', 'buildlog_strip_time', 'no_preinstallimage',
-    'status_mtime_heuristic']
+    'status_mtime_heuristic', 'http_memoize']
 
 api_host_options = ['user', 'pass', 'passx', 'aliases', 'http_headers', 'email', 'sslcertck', 'cafile', 'capath', 'trusted_prj']
 
@@ -317,6 +355,70 @@ apiurl = %(apiurl)s
 # number of retries on HTTP transfer
 #http_retries = 3
 
+# the delay between retries starts at http_retry_delay seconds and is
+# doubled for each retry (up to http_retry_max_delay seconds)
+#http_retry_delay = 1
+#http_retry_max_delay = 30
+
+# after this many consecutive server failures, requests to the api host
+# fail immediately for http_breaker_timeout seconds (0 disables this)
+#http_breaker_threshold = 5
+#http_breaker_timeout = 60
+
+# number of idle keep-alive connections which are kept open per api host
+# (0 disables keep-alive connections)
+#http_pool_size = 4
+
+# idle keep-alive connections are not reused after this many seconds
+#http_pool_timeout = 30
+
+# metadata responses (meta, source listings, build results) are cached
+# here and revalidated with conditional requests
+#http_cache_dir = %(http_cache_dir)s
+
+# maximum size of the response cache in MiB (0 disables the cache)
+#http_cache_size = %(http_cache_size)s
+
+# meta and source listings are requested only once per osc invocation
+# (changes made by osc itself are taken into account)
+#http_memoize = %(http_memoize)s
+
+# number of threads which calculate the md5 of working copy files (status,
+# commit) and of cached build dependencies (1 hashes them one by one)
+#hash_workers = %(hash_workers)s
+
+# number of source files which are downloaded concurrently while the
+# packages of a project working copy are updated (1 downloads them one
+# after the other)
+#download_workers = %(download_workers)s
+
+# number of files of a package which are uploaded concurrently when it is
+# committed (1 uploads them one after the other)
+#upload_workers = %(upload_workers)s
+
+# number of build dependencies which are downloaded concurrently from the
+# mirrors (1 downloads them one after the other) and the maximum number of
+# concurrent downloads from a single host
+#fetch_workers = %(fetch_workers)s
+#fetch_host_connections = %(fetch_host_connections)s
+
+# the pristine copies of the source files in the .osc directories of
+# working copies are hardlinked to the files in this directory, so each
+# file is stored (and downloaded) only once ("osc gc" removes the files
+# which are not used by any working copy anymore)
+#object_store_dir = ~/.cache/osc/objects
+
+# "osc status --watch" answers the status queries of other osc
+# invocations on this unix socket (empty disables the status daemon)
+#status_socket = %(status_socket)s
+
+# after each build the least recently used packages are evicted from the
+# packagecachedir if it is larger than packagecache_max_size MiB, as are
+# packages which were not used for packagecache_max_age days (0 disables
+# the limit, "osc cache stats" shows the usage of the cache)
+#packagecache_max_size = %(packagecache_max_size)s
+#packagecache_max_age = %(packagecache_max_age)s
+
 # Skip signature verification of packages used for build.
 #no_verify = 1
 
@@ -394,6 +496,88 @@ your credentials for this apiurl.
 
 cookiejar = None
 
+# keep-alive connection pools, keyed by apiurl
+connection_pools = {}
+
+# on-disk cache for api responses
+response_cache = None
+
+# circuit breakers, keyed by apiurl
+circuit_breakers = {}
+
+# in-memory cache for api responses
+memo_cache = None
+
+
+def get_connection_pool(apiurl):
+    """
+    Returns the keep-alive connection pool for the given apiurl or None
+    if keep-alive connections are disabled.
+    """
+    if int(config['http_pool_size']) <= 0:
+        return None
+    if apiurl not in connection_pools:
+        connection_pools[apiurl] = oschttp.ConnectionPool(int(config['http_pool_size']),
+                                                          float(config['http_pool_timeout']))
+    return connection_pools[apiurl]
+
+
+def get_response_cache():
+    """
+    Returns the on-disk api response cache or None if it is disabled.
+    """
+    global response_cache
+    if int(config['http_cache_size']) <= 0:
+        return None
+    if response_cache is None:
+        response_cache = httpcache.ResponseCache(os.path.expanduser(config['http_cache_dir']),
+                                                 int(config['http_cache_size']) * 1024 * 1024)
+    return response_cache
+
+
+def get_memo_cache():
+    """
+    Returns the in-memory api response cache or None if it is disabled.
+    """
+    global memo_cache
+    if not config['http_memoize']:
+        return None
+    if memo_cache is None:
+        memo_cache = httpcache.MemoCache()
+    return memo_cache
+
+
+def get_object_store():
+    """
+    Returns the shared store of the pristine copies of source files or
+    None if it is disabled.
+    """
+    if not config['object_store_dir']:
+        return None
+    return objectstore.ObjectStore(os.path.expanduser(config['object_store_dir']))
+
+
+def get_retry_policy():
+    """
+    Returns the retry policy for failed http requests.
+    """
+    return oschttp.RetryPolicy(int(config['http_retries']),
+                               float(config['http_retry_delay']),
+                               float(config['http_retry_max_delay']))
+
+
+def get_circuit_breaker(apiurl):
+    """
+    Returns the circuit breaker for the given apiurl or None if it is
+    disabled.
+    """
+    if int(config['http_breaker_threshold']) <= 0:
+        return None
+    if apiurl not in circuit_breakers:
+        circuit_breakers[apiurl] = oschttp.CircuitBreaker(int(config['http_breaker_threshold']),
+                                                          float(config['http_breaker_timeout']))
+    return circuit_breakers[apiurl]
+
 
 def parse_apisrv_url(scheme, apisrv):
     if apisrv.startswith('http://') or apisrv.startswith('https://'):
@@ -520,12 +704,19 @@ def _build_opener(apiurl):
 
         authhandler_class = OscHTTPBasicAuthHandler
 
+    pool = get_connection_pool(apiurl)
+
+    # send the credentials right away instead of waiting for a 401 challenge
+    class OscPreemptiveBasicAuthHandler(oschttp.PreemptiveBasicAuthMixin, authhandler_class):
+        pass
+
     options = config['api_host_options'][apiurl]
     # with None as first argument, it will always use this username/password
     # combination for urls for which arg2 (apisrv) is a super-url
-    authhandler = authhandler_class( \
+    authhandler = OscPreemptiveBasicAuthHandler( \
         HTTPPasswordMgrWithDefaultRealm())
     authhandler.add_password(None, apiurl, options['user'], options['pass'])
+    authhandler.debug = config['http_debug']
 
     if options['sslcertck']:
         try:
@@ -550,15 +741,21 @@ def _build_opener(apiurl):
         ctx = oscssl.mySSLContext()
         if ctx.load_verify_locations(capath=capath, cafile=cafile) != 1:
             raise oscerr.OscIOError(None, 'No CA certificates found')
-        opener = m2urllib2.build_opener(ctx, oscssl.myHTTPSHandler(ssl_context=ctx, appname='osc'), HTTPCookieProcessor(cookiejar), authhandler, proxyhandler)
+        opener = m2urllib2.build_opener(ctx, oscssl.myHTTPSHandler(ssl_context=ctx, appname='osc', pool=pool), HTTPCookieProcessor(cookiejar), authhandler, proxyhandler, oschttp.ContentDecodingProcessor())
     else:
-        handlers = [HTTPCookieProcessor(cookiejar), authhandler, proxyhandler]
+        handlers = [HTTPCookieProcessor(cookiejar), authhandler, proxyhandler, oschttp.ContentDecodingProcessor()]
+        if pool is not None:
+            handlers.append(oschttp.KeepAliveHTTPHandler(pool))
         try:
             # disable ssl cert check in python >= 2.7.9
             ctx = ssl._create_unverified_context()
-            handlers.append(HTTPSHandler(context=ctx))
+            if pool is not None:
+                handlers.append(oschttp.KeepAliveHTTPSHandler(pool, context=ctx))
+            else:
+                handlers.append(HTTPSHandler(context=ctx))
         except AttributeError:
-            pass
+            if pool is not None:
+                handlers.append(oschttp.KeepAliveHTTPSHandler(pool))
         print("WARNING: SSL certificate checks disabled. Connection is insecure!\n", file=sys.stderr)
         opener = build_opener(*handlers)
     opener.addheaders = [('User-agent', 'osc/%s' % __version__)]
@@ -616,12 +813,14 @@ def init_basicauth(config, config_mtime):
 
     cookie_file = os.path.expanduser(config['cookiejar'])
     global cookiejar
-    cookiejar = LWPCookieJar(cookie_file)
+    if cookiejar is None:
+        atexit.register(_flush_cookiejar)
+    cookiejar = oschttp.PersistentCookieJar(cookie_file)
     try:
         cookiejar.load(ignore_discard=True)
         if int(round(config_mtime)) > int(os.stat(cookie_file).st_mtime):
             cookiejar.clear()
-            cookiejar.save()
+            cookiejar.flush(force=True)
     except IOError:
         try:
             fd = os.open(cookie_file, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
@@ -632,6 +831,11 @@ def init_basicauth(config, config_mtime):
             cookiejar = CookieJar()
 
 
+def _flush_cookiejar():
+    if hasattr(cookiejar, 'flush'):
+        cookiejar.flush(force=True)
+
+
 def get_configParser(conffile=None, force_read=False):
     """
     Returns an ConfigParser() object. After its first invocation the
@@ -816,7 +1020,7 @@ def get_config(override_conffile=None,
                override_no_gnome_keyring=None,
                override_verbose=None):
     """do the actual work (see module documentation)"""
-    global config
+    global config, memo_cache
 
     conffile = override_conffile or os.environ.get('OSC_CONFIG', '~/.oscrc')
     conffile = os.path.expanduser(conffile)
@@ -840,6 +1044,8 @@ def get_config(override_conffile=None,
 
     config = dict(cp.items('general', raw=1))
     config['conffile'] = conffile
+    # responses of a previous configuration must not be reused
+    memo_cache = None
 
     for i in boolean_opts:
         try:
@@ -22,20 +22,23 @@ import re
 import socket
 import errno
 import shlex
+import time
 
 try:
     from urllib.parse import urlsplit, urlunsplit, urlparse, quote_plus, urlencode, unquote
-    from urllib.error import HTTPError
+    from urllib.error import HTTPError, URLError
     from urllib.request import pathname2url, install_opener, urlopen
     from urllib.request import Request as URLRequest
     from io import StringIO
+    from http.client import HTTPException
 except ImportError:
     #python 2.x
     from urlparse import urlsplit, urlunsplit, urlparse
     from urllib import pathname2url, quote_plus, urlencode, unquote
-    from urllib2 import HTTPError, install_opener, urlopen
+    from urllib2 import HTTPError, URLError, install_opener, urlopen
     from urllib2 import Request as URLRequest
     from cStringIO import StringIO
+    from httplib import HTTPException
 
 
 try:
@@ -45,6 +48,11 @@ except ImportError:
 
 from . import oscerr
 from . import conf
+from . import oschttp
+from . import httpstats
+from . import statcache
+from . import objectstore
+from . import wcindex
 
 try:
     # python 2.6 and python 2.7
@@ -614,6 +622,8 @@ class Project:
     """
 
     REQ_STOREFILES = ('_project', '_apiurl')
+    # store files which are read via the working copy index (see wcindex)
+    INDEX_STOREFILES = ('_project', '_apiurl', '_packages')
 
     def __init__(self, dir, getPackageList=True, progress_obj=None, wc_check=True):
         """
@@ -634,8 +644,11 @@ class Project:
         self.absdir = os.path.abspath(dir)
         self.progress_obj = progress_obj
 
-        self.name = store_read_project(self.dir)
-        self.apiurl = store_read_apiurl(self.dir, defaulturl=not wc_check)
+        store_files, packages = wcindex.read(os.path.join(self.absdir, store),
+                                             Project.INDEX_STOREFILES, _parse_packages)
+        self.name = _store_first_line(store_files['_project']) or store_read_project(self.dir)
+        self.apiurl = _store_apiurl(store_files['_apiurl']) \
+            or store_read_apiurl(self.dir, defaulturl=not wc_check)
 
         dirty_files = []
         if wc_check:
@@ -652,7 +665,12 @@ class Project:
             self.pacs_available = []
 
         if conf.config['do_package_tracking']:
-            self.pac_root = self.read_packages().getroot()
+            if packages is not None:
+                self.pac_root = ET.Element('project', packages[0])
+                for tag, attrs in packages[1]:
+                    ET.SubElement(self.pac_root, tag, attrs)
+            else:
+                self.pac_root = self.read_packages().getroot()
             self.pacs_have = [ pac.get('name') for pac in self.pac_root.findall('package') ]
             self.pacs_excluded = [ i for i in os.listdir(self.dir)
                                    for j in conf.config['exclude_glob']
@@ -750,7 +768,7 @@ class Project:
             st = self.status(pac)
             if st in ('?', '!') or st == 'D' and not os.path.exists(os.path.join(self.dir, pac)):
                 return None
-            return Package(os.path.join(self.dir, pac), *pac_args, **pac_kwargs)
+            return LazyPackage(os.path.join(self.dir, pac), *pac_args, **pac_kwargs)
         except oscerr.OscIOError:
             return None
 
@@ -806,7 +824,7 @@ class Project:
                 # we cannot use self.pacs_available because we cannot guarantee that the package list
                 # was fetched from the server
                 if data in meta_get_packagelist(self.apiurl, self.name) and is_package_dir(pac_dir) \
-                   and Package(pac_dir).name == data:
+                   and store_read_package(pac_dir) == data:
                     cur_pacs.append(ET.Element('package', name=data, state=' '))
             store_write_initial_packages(self.absdir, self.name, cur_pacs)
             return ET.parse(os.path.join(self.absdir, store, '_packages'))
@@ -872,8 +890,18 @@ class Project:
 
     def update(self, pacs = (), expand_link=False, unexpand_link=False, service_files=False):
         if len(pacs):
+            plans = {}
             for pac in pacs:
-                Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj).update()
+                # the packages are read when they are prefetched or updated
+                plans[pac] = (LazyPackage(os.path.join(self.dir, pac), progress_obj=self.progress_obj),
+                              None, True, None, False)
+            prefetcher = self.__start_prefetch(pacs, plans)
+            try:
+                for index, pac in enumerate(pacs):
+                    self.__update_package(prefetcher, index, *plans[pac])
+            finally:
+                if prefetcher is not None:
+                    prefetcher.close()
         else:
             # we need to make sure that the _packages file will be written (even if an exception
             # occurs)
@@ -897,69 +925,129 @@ class Project:
                     self.pac_root.remove(self.get_package_node(pac))
                     self.pacs_have.remove(pac)
 
+                # decide which packages have to be updated before updating
+                # them, so that their files can be downloaded concurrently
+                plans = {}
                 for pac in self.pacs_have:
                     state = self.get_state(pac)
                     if pac in self.pacs_broken:
-                        if self.get_state(pac) != 'A':
-                            checkout_package(self.apiurl, self.name, pac,
-                                             pathname=getTransActPath(os.path.join(self.dir, pac)), prj_obj=self,
-                                             prj_dir=self.dir, expand_link=not unexpand_link, progress_obj=self.progress_obj)
+                        continue
                     elif state == ' ':
-                        # do a simple update
-                        p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
-                        rev = None
-                        needs_update = True
-                        if expand_link and p.islink() and not p.isexpanded():
-                            if p.haslinkerror():
-                                try:
-                                    rev = show_upstream_xsrcmd5(p.apiurl, p.prjname, p.name, revision=p.rev)
-                                except:
-                                    rev = show_upstream_xsrcmd5(p.apiurl, p.prjname, p.name, revision=p.rev, linkrev="base")
-                                    p.mark_frozen()
-                            else:
-                                rev = p.linkinfo.xsrcmd5
-                            print('Expanding to rev', rev)
-                        elif unexpand_link and p.islink() and p.isexpanded():
-                            rev = p.linkinfo.lsrcmd5
-                            print('Unexpanding to rev', rev)
-                        elif p.islink() and p.isexpanded():
-                            needs_update = p.update_needed(sinfos[p.name])
-                            if needs_update:
-                                rev = p.latest_rev()
-                        elif p.hasserviceinfo() and p.serviceinfo.isexpanded() and not service_files:
-                            # FIXME: currently, do_update does not propagate the --server-side-source-service-files
-                            # option to this method. Consequence: an expanded service is always unexpanded during
-                            # an update (TODO: discuss if this is a reasonable behavior (at least this the default
-                            # behavior for a while))
-                            needs_update = True
-                        else:
-                            needs_update = p.update_needed(sinfos[p.name])
-                        print('Updating %s' % p.name)
-                        if needs_update:
-                            p.update(rev, service_files)
-                        else:
-                            print('At revision %s.' % p.rev)
-                        if unexpand_link:
-                            p.unmark_frozen()
+                        plans[pac] = self.__plan_update(pac, sinfos, expand_link, unexpand_link, service_files)
                     elif state == 'D':
                         # pac exists (the non-existent pac case was handled in the first if block)
                         p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
-                        if p.update_needed(sinfos[p.name]):
-                            p.update()
-                    elif state == 'A' and pac in self.pacs_available:
-                        # file/dir called pac already exists and is under version control
-                        msg = 'can\'t add package \'%s\': Object already exists' % pac
-                        raise oscerr.PackageExists(self.name, pac, msg)
-                    elif state == 'A':
-                        # do nothing
-                        pass
-                    else:
-                        print('unexpected state.. package \'%s\'' % pac)
+                        plans[pac] = (p, None, p.update_needed(sinfos[p.name]), None, False)
+
+                prefetcher = self.__start_prefetch(self.pacs_have, plans)
+                try:
+                    for index, pac in enumerate(self.pacs_have):
+                        state = self.get_state(pac)
+                        if pac in self.pacs_broken:
+                            if self.get_state(pac) != 'A':
+                                checkout_package(self.apiurl, self.name, pac,
+                                                 pathname=getTransActPath(os.path.join(self.dir, pac)), prj_obj=self,
+                                                 prj_dir=self.dir, expand_link=not unexpand_link, progress_obj=self.progress_obj)
+                        elif state == ' ':
+                            p = plans[pac][0]
+                            msg = plans[pac][3]
+                            if msg:
+                                print(msg)
+                            print('Updating %s' % p.name)
+                            if not self.__update_package(prefetcher, index, *plans[pac]):
+                                print('At revision %s.' % p.rev)
+                            if unexpand_link:
+                                p.unmark_frozen()
+                        elif state == 'D':
+                            self.__update_package(prefetcher, index, *plans[pac])
+                        elif state == 'A' and pac in self.pacs_available:
+                            # file/dir called pac already exists and is under version control
+                            msg = 'can\'t add package \'%s\': Object already exists' % pac
+                            raise oscerr.PackageExists(self.name, pac, msg)
+                        elif state == 'A':
+                            # do nothing
+                            pass
+                        else:
+                            print('unexpected state.. package \'%s\'' % pac)
+                finally:
+                    if prefetcher is not None:
+                        prefetcher.close()
 
                 self.checkout_missing_pacs(sinfos, expand_link, unexpand_link)
             finally:
                 self.write_packages()
 
+    def __plan_update(self, pac, sinfos, expand_link, unexpand_link, service_files):
+        """
+        Returns a (package, rev, needs_update, msg, service_files) tuple for
+        the unmodified package pac (see update).
+        """
+        p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
+        rev = None
+        msg = None
+        needs_update = True
+        if expand_link and p.islink() and not p.isexpanded():
+            if p.haslinkerror():
+                try:
+                    rev = show_upstream_xsrcmd5(p.apiurl, p.prjname, p.name, revision=p.rev)
+                except:
+                    rev = show_upstream_xsrcmd5(p.apiurl, p.prjname, p.name, revision=p.rev, linkrev="base")
+                    p.mark_frozen()
+            else:
+                rev = p.linkinfo.xsrcmd5
+            msg = 'Expanding to rev %s' % rev
+        elif unexpand_link and p.islink() and p.isexpanded():
+            rev = p.linkinfo.lsrcmd5
+            msg = 'Unexpanding to rev %s' % rev
+        elif p.islink() and p.isexpanded():
+            needs_update = p.update_needed(sinfos[p.name])
+            if needs_update:
+                rev = p.latest_rev()
+        elif p.hasserviceinfo() and p.serviceinfo.isexpanded() and not service_files:
+            # FIXME: currently, do_update does not propagate the --server-side-source-service-files
+            # option to this method. Consequence: an expanded service is always unexpanded during
+            # an update (TODO: discuss if this is a reasonable behavior (at least this the default
+            # behavior for a while))
+            needs_update = True
+        else:
+            needs_update = p.update_needed(sinfos[p.name])
+        return (p, rev, needs_update, msg, service_files)
+
+    def __start_prefetch(self, pacs, plans):
+        """
+        Returns a SourcePrefetcher which downloads the files of the packages
+        which are going to be updated or None if files are downloaded
+        one after the other.
+        """
+        import tempfile
+        workers = int(conf.config['download_workers'])
+        todo = [pac for pac in pacs if pac in plans and plans[pac][2]]
+        if workers <= 1 or not todo:
+            return None
+        tmpdir = tempfile.mkdtemp(prefix='_prefetch.', dir=os.path.join(self.absdir, store))
+        prefetcher = SourcePrefetcher(tmpdir, workers)
+        for index, pac in enumerate(pacs):
+            p, rev, needs_update, msg, service_files = plans.get(pac, (None, None, False, None, False))
+            if needs_update:
+                prefetcher.add_package(index, p.prefetch_update, rev, service_files)
+        return prefetcher
+
+    def __update_package(self, prefetcher, index, p, rev, needs_update, msg, service_files):
+        """update p (the files may be downloaded by prefetcher already)"""
+        if not needs_update:
+            return False
+        if prefetcher is None:
+            p.update(rev, service_files)
+            return True
+        prefetcher.claim_package(index)
+        p.prefetcher = prefetcher
+        try:
+            p.update(rev, service_files)
+        finally:
+            p.prefetcher = None
+            prefetcher.release_package(index)
+        return True
+
     def commit(self, pacs = (), msg = '', files = {}, verbose = False, skip_local_service_run = False, can_branch=False, force=False):
         if len(pacs):
             try:
@@ -975,9 +1063,9 @@ class Project:
                     elif state == ' ':
                         # display the correct dir when sending the changes
                         if os_path_samefile(os.path.join(self.dir, pac), os.getcwd()):
-                            p = Package('.')
+                            p = Package('.', progress_obj=self.progress_obj)
                         else:
-                            p = Package(os.path.join(self.dir, pac))
+                            p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
                         p.todo = todo
                         p.commit(msg, verbose=verbose, skip_local_service_run=skip_local_service_run, can_branch=can_branch, force=force)
                     elif pac in self.pacs_unvers and not is_package_dir(os.path.join(self.dir, pac)):
@@ -999,7 +1087,7 @@ class Project:
                     state = self.get_state(pac)
                     if state == ' ':
                         # do a simple commit
-                        Package(os.path.join(self.dir, pac)).commit(msg, verbose=verbose, skip_local_service_run=skip_local_service_run)
+                        Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj).commit(msg, verbose=verbose, skip_local_service_run=skip_local_service_run)
                     elif state == 'D':
                         self.commitDelPackage(pac)
                     elif state == 'A':
@@ -1023,9 +1111,9 @@ class Project:
             olddir = os.getcwd()
             if os_path_samefile(os.path.join(self.dir, pac), os.curdir):
                 os.chdir(os.pardir)
-                p = Package(pac)
+                p = Package(pac, progress_obj=self.progress_obj)
             else:
-                p = Package(os.path.join(self.dir, pac))
+                p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
             p.todo = files
             print(statfrmt('Sending', os.path.normpath(p.dir)))
             p.commit(msg=msg, verbose=verbose, skip_local_service_run=skip_local_service_run)
@@ -1040,7 +1128,7 @@ class Project:
                 pac_dir = pac
             else:
                 pac_dir = os.path.join(self.dir, pac)
-            p = Package(os.path.join(self.dir, pac))
+            p = Package(os.path.join(self.dir, pac), progress_obj=self.progress_obj)
             #print statfrmt('Deleting', os.path.normpath(os.path.join(p.dir, os.pardir, pac)))
             delete_storedir(p.storedir)
             try:
@@ -1073,7 +1161,7 @@ class Project:
             edit_meta(metatype='pkg',
                       path_args=(quote_plus(project), quote_plus(package)),
                       template_args=({'name': pac, 'user': user}), apiurl=apiurl)
-        p = Package(pac_path)
+        p = Package(pac_path, progress_obj=self.progress_obj)
         p.todo = files
         p.commit(msg=msg, verbose=verbose, skip_local_service_run=skip_local_service_run)
 
@@ -1114,7 +1202,11 @@ class Package:
     REQ_STOREFILES = ('_project', '_package', '_apiurl', '_files', '_osclib_version')
     OPT_STOREFILES = ('_to_be_added', '_to_be_deleted', '_in_conflict', '_in_update',
         '_in_commit', '_meta', '_meta_mode', '_frozenlink', '_pulled', '_linkrepair',
-        '_size_limit', '_commit_msg')
+        '_size_limit', '_commit_msg', statcache.STORE_FILE, wcindex.INDEX_FILE)
+    # store files which are read via the working copy index (see wcindex)
+    INDEX_STOREFILES = ('_osclib_version', '_project', '_package', '_apiurl', '_files',
+        '_to_be_added', '_to_be_deleted', '_in_conflict', '_meta_mode', '_size_limit',
+        '_linkrepair')
 
     def __init__(self, workingdir, progress_obj=None, size_limit=None, wc_check=True):
         global store
@@ -1126,14 +1218,21 @@ class Package:
         self.size_limit = size_limit
         if size_limit and size_limit == 0:
             self.size_limit = None
+        self.stat_cache = statcache.StatCache(self.storedir, self.absdir, dgst_files)
+        # SourcePrefetcher which may have downloaded the files for update()
+        self.prefetcher = None
+        # shared store of the pristine copies (see conf.get_object_store)
+        self.objects = conf.get_object_store()
 
-        check_store_version(self.dir)
+        store_files, filemeta = self.__read_store()
+        check_store_version(self.dir, store_files['_osclib_version'])
 
-        self.prjname = store_read_project(self.dir)
-        self.name = store_read_package(self.dir)
-        self.apiurl = store_read_apiurl(self.dir, defaulturl=not wc_check)
+        self.prjname = _store_first_line(store_files['_project']) or store_read_project(self.dir)
+        self.name = _store_first_line(store_files['_package']) or store_read_package(self.dir)
+        self.apiurl = _store_apiurl(store_files['_apiurl']) \
+            or store_read_apiurl(self.dir, defaulturl=not wc_check)
 
-        self.update_datastructs()
+        self.__update_datastructs(store_files, filemeta)
         dirty_files = []
         if wc_check:
             dirty_files = self.wc_check()
@@ -1186,9 +1285,7 @@ class Package:
             # XXX: should we also check the md5?
             if not os.path.exists(os.path.join(self.storedir, f.name)) and not f.name in self.skipped:
                 # if get_source_file fails we're screwed up...
-                get_source_file(self.apiurl, self.prjname, self.name, f.name,
-                    targetfilename=os.path.join(self.storedir, f.name), revision=self.rev,
-                    mtime=f.mtime)
+                self.__get_store_file(f.name, self.rev, f.mtime, f.md5)
         for fname in os.listdir(self.storedir):
             if fname in Package.REQ_STOREFILES or fname in Package.OPT_STOREFILES or \
                 fname.startswith('_build'):
@@ -1341,18 +1438,89 @@ class Package:
         u = makeurl(self.apiurl, ['source', self.prjname, self.name, pathname2url(n)], query=query)
         http_DELETE(u)
 
-    def put_source_file(self, n, tdir, copy_only=False):
+    def put_source_file(self, n, tdir, copy_only=False, md5=None, progress_obj=None):
         query = 'rev=repository'
         tfilename = os.path.join(tdir, n)
         shutil.copyfile(os.path.join(self.dir, n), tfilename)
+        if self.objects is not None and md5:
+            self.objects.adopt(tfilename, md5)
         # escaping '+' in the URL path (note: not in the URL query string) is
         # only a workaround for ruby on rails, which swallows it otherwise
         if not copy_only:
             u = makeurl(self.apiurl, ['source', self.prjname, self.name, pathname2url(n)], query=query)
-            http_PUT(u, file = tfilename)
+            http_PUT(u, file = tfilename, progress_obj=progress_obj or self.progress_obj)
         if n in self.to_be_added:
             self.to_be_added.remove(n)
 
+    def put_source_files(self, filenames, tdir, md5s):
+        """
+        Uploads the files with put_source_file, upload_workers of them
+        concurrently (their progress is reported as a single transfer).
+        Returns a tuple: the list of the uploaded files and the last
+        error of the uploads which were interrupted because the
+        connection dropped (None if there was no such error). Other
+        errors are raised after the running uploads finished.
+        """
+        import threading
+        workers = min(int(conf.config['upload_workers']), len(filenames))
+        sizes = dict((n, os.path.getsize(os.path.join(self.dir, n))) for n in filenames)
+        progress = None
+        if workers > 1 and self.progress_obj:
+            progress = oschttp.TransferProgress(self.progress_obj, sum(sizes.values()),
+                                              '%d files' % len(filenames))
+        todo = iter(filenames)
+        lock = threading.Lock()
+        uploaded = []
+        dropped = []
+        errors = []
+        def worker():
+            while True:
+                with lock:
+                    if errors:
+                        return
+                    n = next(todo, None)
+                    if n is None:
+                        return
+                    sys.stdout.write('.')
+                    sys.stdout.flush()
+                meter = progress.file() if progress is not None else None
+                try:
+                    self.put_source_file(n, tdir, md5=md5s[n], progress_obj=meter)
+                except HTTPError as e:
+                    with lock:
+                        errors.append(e)
+                    return
+                except (URLError, HTTPException, socket.error) as e:
+                    # the connection dropped: the server still has the
+                    # files which were uploaded so far, so only this one
+                    # has to be sent again
+                    with lock:
+                        dropped.append(e)
+                    continue
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    return
+                if meter is not None:
+                    meter.end(sizes[n])
+                with lock:
+                    uploaded.append(n)
+
+        if workers <= 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for i in range(workers)]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join()
+        if progress is not None:
+            progress.end()
+        if errors:
+            raise errors[0]
+        return uploaded, dropped[-1] if dropped else None
+
     def __commit_update_store(self, tdir):
         """move files from transaction directory into the store"""
         for filename in os.listdir(tdir):
@@ -1444,6 +1612,7 @@ class Package:
         todo_send = {}
         todo_delete = []
         real_send = []
+        self.__prefetch_digests(self.todo)
         for filename in self.filenamelist + [i for i in self.to_be_added if not i in self.filenamelist]:
             if filename.startswith('_service:') or filename.startswith('_service_'):
                 continue
@@ -1453,7 +1622,7 @@ class Package:
                 return 1
             elif filename in self.todo:
                 if st in ('A', 'R', 'M'):
-                    todo_send[filename] = dgst(os.path.join(self.absdir, filename))
+                    todo_send[filename] = self.stat_cache.dgst(filename)
                     real_send.append(filename)
                     print(statfrmt('Sending', os.path.join(pathn, filename)))
                 elif st in (' ', '!', 'S'):
@@ -1484,11 +1653,26 @@ class Package:
             print('nothing to do for package %s' % self.name)
             return 1
 
-        print('Transmitting file data', end=' ')
+        # the first commitfilelist is the pre-flight: the server only
+        # reports the files as missing which are not in the source
+        # repository of the package yet, all other files are committed
+        # by reference (without an upload).
+        # The source repository of the server is keyed by the package
+        # name (and a file by its name and md5), so this covers the
+        # files of the link target and of all other packages with the
+        # same name in any project. A file of a package with a different
+        # name (e.g. a sibling or a renamed link target) cannot be
+        # referenced by a commit; skipping its upload would only make
+        # the server reject the file list, so there is no client side
+        # md5 lookup in other packages.
         filelist = self.__generate_commitlist(todo_send)
         sfilelist = self.__send_commitlog(msg, filelist)
         send = self.commit_get_missing(sfilelist)
         real_send = [i for i in real_send if not i in send]
+        if verbose:
+            for filename in real_send:
+                print(statfrmt('Reusing', os.path.join(pathn, filename)))
+        print('Transmitting file data', end=' ')
         # abort after 3 tries
         tries = 3
         tdir = None
@@ -1497,22 +1681,25 @@ class Package:
             if os.path.isdir(tdir):
                 shutil.rmtree(tdir)
             os.mkdir(tdir)
+            upload_error = None
             while len(send) and tries:
-                for filename in send[:]:
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
-                    self.put_source_file(filename, tdir)
-                    send.remove(filename)
+                # the files whose upload was interrupted are sent again
+                # in the next round
+                error = self.put_source_files(send, tdir, todo_send)[1]
+                if error is not None:
+                    upload_error = error
                 tries -= 1
                 sfilelist = self.__send_commitlog(msg, filelist)
                 send = self.commit_get_missing(sfilelist)
+            if len(send) and upload_error is not None:
+                raise upload_error
             if len(send):
                 raise oscerr.PackageInternalError(self.prjname, self.name,
                     'server does not accept filelist:\n%s\nmissing:\n%s\n' \
                     % (ET.tostring(filelist, encoding=ET_ENCODING), ET.tostring(sfilelist, encoding=ET_ENCODING)))
             # these files already exist on the server
             for filename in real_send:
-                self.put_source_file(filename, tdir, copy_only=True)
+                self.put_source_file(filename, tdir, copy_only=True, md5=todo_send[filename])
             # update store with the committed files
             self.__commit_update_store(tdir)
         finally:
@@ -1581,7 +1768,7 @@ class Package:
     def write_conflictlist(self):
         self.__write_storelist('_in_conflict', self.in_conflict)
 
-    def updatefile(self, n, revision, mtime=None):
+    def updatefile(self, n, revision, mtime=None, md5=None):
         filename = os.path.join(self.dir, n)
         storefilename = os.path.join(self.storedir, n)
         origfile_tmp = os.path.join(self.storedir, '_in_update', '%s.copy' % n)
@@ -1592,8 +1779,7 @@ class Package:
         else:
             origfile = None
 
-        get_source_file(self.apiurl, self.prjname, self.name, n, targetfilename=storefilename,
-                revision=revision, progress_obj=self.progress_obj, mtime=mtime, meta=self.meta)
+        self.__get_store_file(n, revision, mtime, md5)
 
         shutil.copyfile(storefilename, filename)
         if mtime:
@@ -1601,7 +1787,41 @@ class Package:
         if not origfile is None:
             os.unlink(origfile)
 
-    def mergefile(self, n, revision, mtime=None):
+    def __get_source_file(self, n, targetfilename, revision, mtime):
+        key = (self.apiurl, self.prjname, self.name, n, revision, self.meta)
+        if self.prefetcher is not None and self.prefetcher.take(key, targetfilename):
+            if mtime:
+                utime(targetfilename, (-1, mtime))
+            return
+        get_source_file(self.apiurl, self.prjname, self.name, n, targetfilename=targetfilename,
+                        revision=revision, progress_obj=self.progress_obj, mtime=mtime, meta=self.meta)
+
+    def __get_store_file(self, n, revision, mtime, md5):
+        """
+        Fetches the pristine copy of n into the store. If the object store
+        is used, it is linked to the object md5, which is only downloaded
+        if it is not in the object store yet.
+        """
+        storefilename = os.path.join(self.storedir, n)
+        if self.objects is not None and self.objects.link(md5, storefilename):
+            return
+        self.__get_source_file(n, storefilename, revision, mtime)
+        if self.objects is not None:
+            self.objects.adopt(storefilename, md5)
+
+    def __put_store_file(self, n, filename, md5):
+        """copies filename into the store (see __get_store_file)"""
+        storefilename = os.path.join(self.storedir, n)
+        if self.objects is not None and self.objects.link(md5, storefilename):
+            return
+        # never write into a store file, it might be linked to an object
+        if os.path.exists(storefilename):
+            os.unlink(storefilename)
+        shutil.copyfile(filename, storefilename)
+        if self.objects is not None:
+            self.objects.adopt(storefilename, md5)
+
+    def mergefile(self, n, revision, mtime=None, md5=None):
         filename = os.path.join(self.dir, n)
         storefilename = os.path.join(self.storedir, n)
         myfilename = os.path.join(self.dir, n + '.mine')
@@ -1612,14 +1832,17 @@ class Package:
         os.rename(origfile_tmp, origfile)
         os.rename(filename, myfilename)
 
-        get_source_file(self.apiurl, self.prjname, self.name, n,
-                        revision=revision, targetfilename=upfilename,
-                        progress_obj=self.progress_obj, mtime=mtime, meta=self.meta)
+        if self.objects is not None and self.objects.has(md5):
+            shutil.copyfile(self.objects.path(md5), upfilename)
+            if mtime:
+                utime(upfilename, (-1, mtime))
+        else:
+            self.__get_source_file(n, upfilename, revision, mtime)
 
         if binary_file(myfilename) or binary_file(upfilename):
             # don't try merging
             shutil.copyfile(upfilename, filename)
-            shutil.copyfile(upfilename, storefilename)
+            self.__put_store_file(n, upfilename, md5)
             os.unlink(origfile)
             self.in_conflict.append(n)
             self.write_conflictlist()
@@ -1634,14 +1857,14 @@ class Package:
             #   conflicts were found, and 2 means trouble."
             if ret == 0:
                 # merge was successful... clean up
-                shutil.copyfile(upfilename, storefilename)
+                self.__put_store_file(n, upfilename, md5)
                 os.unlink(upfilename)
                 os.unlink(myfilename)
                 os.unlink(origfile)
                 return 'G'
             elif ret == 1:
                 # unsuccessful merge
-                shutil.copyfile(upfilename, storefilename)
+                self.__put_store_file(n, upfilename, md5)
                 os.unlink(origfile)
                 self.in_conflict.append(n)
                 self.write_conflictlist()
@@ -1691,57 +1914,69 @@ class Package:
         orgprj = self.get_local_origin_project()
         return self.prjname != orgprj
 
+    def __read_store(self):
+        """
+        Returns the contents of the INDEX_STOREFILES and the parsed _files
+        (see _parse_filemeta), both read from the working copy index.
+        """
+        return wcindex.read(self.storedir, Package.INDEX_STOREFILES, _parse_filemeta)
+
     def update_datastructs(self):
         """
         Update the internal data structures if the local _files
         file has changed (e.g. update_local_filesmeta() has been
         called).
         """
+        self.__update_datastructs(*self.__read_store())
+
+    def __update_datastructs(self, store_files, filemeta):
         import fnmatch
-        files_tree = read_filemeta(self.dir)
-        files_tree_root = files_tree.getroot()
+        if filemeta is None:
+            # missing or broken _files (read_filemeta raises the appropriate error)
+            files_tree = read_filemeta(self.dir)
+            filemeta = _parse_filemeta({'_files': ET.tostring(files_tree.getroot(), encoding=ET_ENCODING)})
 
-        self.rev = files_tree_root.get('rev')
-        self.srcmd5 = files_tree_root.get('srcmd5')
+        self.rev = filemeta['rev']
+        self.srcmd5 = filemeta['srcmd5']
 
         self.linkinfo = Linkinfo()
-        self.linkinfo.read(files_tree_root.find('linkinfo'))
+        if filemeta['linkinfo'] is not None:
+            self.linkinfo.read(ET.Element('linkinfo', filemeta['linkinfo']))
         self.serviceinfo = DirectoryServiceinfo()
-        self.serviceinfo.read(files_tree_root.find('serviceinfo'))
+        if filemeta['serviceinfo'] is not None:
+            self.serviceinfo.read(ET.fromstring(filemeta['serviceinfo']))
 
         self.filenamelist = []
         self.filelist = []
         self.skipped = []
-        for node in files_tree_root.findall('entry'):
+        for name, md5, size, mtime, skipped in filemeta['entries']:
             try:
-                f = File(node.get('name'),
-                         node.get('md5'),
-                         int(node.get('size')),
-                         int(node.get('mtime')))
-                if node.get('skipped'):
+                f = File(name, md5, int(size), int(mtime))
+                if skipped:
                     self.skipped.append(f.name)
                     f.skipped = True
             except:
                 # okay, a very old version of _files, which didn't contain any metadata yet...
-                f = File(node.get('name'), '', 0, 0)
+                f = File(name, '', 0, 0)
             self.filelist.append(f)
             self.filenamelist.append(f.name)
 
-        self.to_be_added = read_tobeadded(self.absdir)
-        self.to_be_deleted = read_tobedeleted(self.absdir)
-        self.in_conflict = read_inconflict(self.absdir)
-        self.linkrepair = os.path.isfile(os.path.join(self.storedir, '_linkrepair'))
-        self.size_limit = read_sizelimit(self.dir)
-        self.meta = self.ismetamode()
+        self.to_be_added = _store_lines(store_files['_to_be_added'])
+        self.to_be_deleted = _store_lines(store_files['_to_be_deleted'])
+        self.in_conflict = _store_lines(store_files['_in_conflict'])
+        self.linkrepair = store_files['_linkrepair'] is not None
+        self.size_limit = _store_sizelimit(store_files['_size_limit'])
+        self.meta = store_files['_meta_mode'] is not None
 
         # gather unversioned files, but ignore some stuff
         self.excluded = []
-        for i in os.listdir(self.dir):
+        wcfiles = os.listdir(self.dir)
+        for i in wcfiles:
             for j in conf.config['exclude_glob']:
                 if fnmatch.fnmatch(i, j):
                     self.excluded.append(i)
                     break
-        self.filenamelist_unvers = [ i for i in os.listdir(self.dir)
+        self.filenamelist_unvers = [ i for i in wcfiles
                                      if i not in self.excluded
                                      if i not in self.filenamelist ]
 
@@ -1824,12 +2059,30 @@ class Package:
                 todo.extend([i for i in self.excluded if i != store])
             todo = set(todo)
         res = []
+        self.__prefetch_digests(todo)
         for fname in sorted(todo):
             st = self.status(fname)
             if not st in exclude_states:
                 res.append((st, fname))
+        self.stat_cache.save()
         return res
 
+    def __prefetch_digests(self, names):
+        """hash all files whose status depends on their md5 in one batch"""
+        todo = []
+        for n in names:
+            if n in self.to_be_deleted or n in self.in_conflict or n in self.skipped \
+                or n in self.to_be_added or not n in self.filenamelist:
+                continue
+            localfile = os.path.join(self.absdir, n)
+            if not os.path.isfile(localfile) or not os.path.exists(os.path.join(self.storedir, n)):
+                continue
+            if conf.config['status_mtime_heuristic'] and \
+                os.path.getmtime(localfile) == self.findfilebyname(n).mtime:
+                continue
+            todo.append(n)
+        self.stat_cache.dgst_many(todo)
+
     def status(self, n):
         """
         status can be:
@@ -1877,9 +2130,9 @@ class Package:
             filemeta = self.findfilebyname(n)
             state = ' '
             if conf.config['status_mtime_heuristic']:
-                if os.path.getmtime(localfile) != filemeta.mtime and dgst(localfile) != filemeta.md5:
+                if os.path.getmtime(localfile) != filemeta.mtime and self.stat_cache.dgst(n) != filemeta.md5:
                     state = 'M'
-            elif dgst(localfile) != filemeta.md5:
+            elif self.stat_cache.dgst(n) != filemeta.md5:
                 state = 'M'
         elif n in self.to_be_added and not exists:
             state = '!'
@@ -1987,6 +2240,7 @@ class Package:
                     added.remove(f)
                     deleted.remove(f)
 #        print kept, added, deleted
+        self.__prefetch_digests([f.name for f in kept])
         for f in kept:
             state = self.status(f.name)
             if state in ('S', '?', '!'):
@@ -2259,9 +2513,11 @@ rev: %s
             elif len(broken_file) > 1:
                 raise oscerr.PackageInternalError(self.prjname, self.name, 'too many files in \'_in_update\' dir')
             tmp = rfiles[:]
+            storefiles = [os.path.join(self.storedir, f.name) for f in tmp]
+            digests = dgst_files([i for i in storefiles if os.path.exists(i)])
             for f in tmp:
-                if os.path.exists(os.path.join(self.storedir, f.name)):
-                    if dgst(os.path.join(self.storedir, f.name)) == f.md5:
+                if os.path.join(self.storedir, f.name) in digests:
+                    if digests[os.path.join(self.storedir, f.name)] == f.md5:
                         if f in kept:
                             kept.remove(f)
                         elif f in added:
@@ -2288,6 +2544,22 @@ rev: %s
             os.rmdir(os.path.join(self.storedir, '_in_update'))
         self.size_limit = old_size_limit
 
+    def prefetch_update(self, prefetcher, index, rev=None, service_files=False):
+        """
+        Queues the downloads of the files which update(rev, service_files)
+        is going to need (see SourcePrefetcher).
+        """
+        root = ET.fromstring(self.get_files_meta(revision=rev))
+        kept, added, deleted, services = self.__get_rev_changes(self.__get_files(root))
+        todo = added + [f for f in kept if self.findfilebyname(f.name).md5 != f.md5]
+        if self.objects is not None:
+            todo = [f for f in todo if not self.objects.has(f.md5)]
+        if service_files:
+            todo.extend(services)
+        for f in todo:
+            prefetcher.add_file(index, self.apiurl, self.prjname, self.name, f.name,
+                                root.get('rev'), self.meta)
+
     def __update(self, kept, added, deleted, services, fm, rev):
         pathn = getTransActPath(self.dir)
         # check for conflicts with existing files
@@ -2297,7 +2569,7 @@ rev: %s
                     'failed to add file \'%s\' file/dir with the same name already exists' % f.name)
         # ok, the update can't fail due to existing files
         for f in added:
-            self.updatefile(f.name, rev, f.mtime)
+            self.updatefile(f.name, rev, f.mtime, f.md5)
             print(statfrmt('A', os.path.join(pathn, f.name)))
         for f in deleted:
             # if the storefile doesn't exist we're resuming an aborted update:
@@ -2323,21 +2595,19 @@ rev: %s
                 pass
             elif state == 'M':
                 # try to merge changes
-                merge_status = self.mergefile(f.name, rev, f.mtime)
+                merge_status = self.mergefile(f.name, rev, f.mtime, f.md5)
                 print(statfrmt(merge_status, os.path.join(pathn, f.name)))
             elif state == '!':
-                self.updatefile(f.name, rev, f.mtime)
+                self.updatefile(f.name, rev, f.mtime, f.md5)
                 print('Restored \'%s\'' % os.path.join(pathn, f.name))
             elif state == 'C':
-                get_source_file(self.apiurl, self.prjname, self.name, f.name,
-                    targetfilename=os.path.join(self.storedir, f.name), revision=rev,
-                    progress_obj=self.progress_obj, mtime=f.mtime, meta=self.meta)
+                self.__get_store_file(f.name, rev, f.mtime, f.md5)
                 print('skipping \'%s\' (this is due to conflicts)' % f.name)
             elif state == 'D' and self.findfilebyname(f.name).md5 != f.md5:
                 # XXX: in the worst case we might end up with f.name being
                 # in _to_be_deleted and in _in_conflict... this needs to be checked
                 if os.path.exists(os.path.join(self.absdir, f.name)):
-                    merge_status = self.mergefile(f.name, rev, f.mtime)
+                    merge_status = self.mergefile(f.name, rev, f.mtime, f.md5)
                     print(statfrmt(merge_status, os.path.join(pathn, f.name)))
                     if merge_status == 'C':
                         # state changes from delete to conflict
@@ -2346,17 +2616,15 @@ rev: %s
                 else:
                     # XXX: we cannot recover this case because we've no file
                     # to backup
-                    self.updatefile(f.name, rev, f.mtime)
+                    self.updatefile(f.name, rev, f.mtime, f.md5)
                     print(statfrmt('U', os.path.join(pathn, f.name)))
             elif state == ' ' and self.findfilebyname(f.name).md5 != f.md5:
-                self.updatefile(f.name, rev, f.mtime)
+                self.updatefile(f.name, rev, f.mtime, f.md5)
                 print(statfrmt('U', os.path.join(pathn, f.name)))
 
         # checkout service files
         for f in services:
-            get_source_file(self.apiurl, self.prjname, self.name, f.name,
-                targetfilename=os.path.join(self.absdir, f.name), revision=rev,
-                progress_obj=self.progress_obj, mtime=f.mtime, meta=self.meta)
+            self.__get_source_file(f.name, os.path.join(self.absdir, f.name), rev, f.mtime)
             print(statfrmt('A', os.path.join(pathn, f.name)))
         store_write_string(self.absdir, '_files', fm + '\n')
         if not self.meta:
@@ -2428,6 +2696,47 @@ rev: %s
         return Package(dir, progress_obj=progress_obj, size_limit=size_limit)
 
 
+class LazyPackage(Package):
+    """
+    A Package whose store is read when one of its attributes is
+    accessed for the first time (the arguments are the same). Thus the
+    errors of Package.__init__ are raised at this point, too.
+    """
+
+    def __init__(self, workingdir, *args, **kwargs):
+        import threading
+        self.__dict__['_LazyPackage__args'] = (workingdir, args, kwargs)
+        self.__dict__['_LazyPackage__state'] = None
+        self.__dict__['_LazyPackage__lock'] = threading.RLock()
+
+    def __load(self):
+        with self.__lock:
+            if self.__state is not None:
+                # loaded or Package.__init__ is running in this thread
+                return
+            self.__dict__['_LazyPackage__state'] = 'loading'
+            workingdir, args, kwargs = self.__args
+            try:
+                Package.__init__(self, workingdir, *args, **kwargs)
+            except:
+                self.__dict__['_LazyPackage__state'] = None
+                raise
+            self.__dict__['_LazyPackage__state'] = 'loaded'
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        self.__load()
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self.__load()
+        self.__dict__[name] = value
+
+
 class AbstractState:
     """
     Base class which represents state-like objects (<review />, <state />).
@@ -3197,6 +3506,76 @@ def read_sizelimit(dir):
 def read_inconflict(dir):
     return store_readlist(dir, '_in_conflict')
 
+def _store_lines(content):
+    """the lines of a store file (like store_readlist)"""
+    if content is None:
+        return []
+    lines = content.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+def _store_first_line(content):
+    """the first line of a store file or None if it is empty or does not exist"""
+    if not content:
+        return None
+    return content.split('\n', 1)[0].strip()
+
+def _store_apiurl(content):
+    """the apiurl of an _apiurl store file or None (like store_read_apiurl)"""
+    url = _store_first_line(content)
+    if url is None:
+        return None
+    try:
+        return conf.urljoin(*conf.parse_apisrv_url(None, url))
+    except:
+        return None
+
+def _store_sizelimit(content):
+    """the size limit of a _size_limit store file (like read_sizelimit)"""
+    if content is None:
+        return None
+    r = content.split('\n', 1)[0].strip()
+    if not r.isdigit():
+        return None
+    return int(r)
+
+def _parse_filemeta(store_files):
+    """
+    Returns the data of the _files store file which Package needs (see
+    wcindex.read) or None if it does not exist or cannot be parsed.
+    """
+    if store_files['_files'] is None:
+        return None
+    try:
+        root = ET.fromstring(store_files['_files'])
+    except SyntaxError:
+        return None
+    linkinfo = root.find('linkinfo')
+    if linkinfo is not None:
+        linkinfo = dict(linkinfo.items())
+    serviceinfo = root.find('serviceinfo')
+    if serviceinfo is not None:
+        serviceinfo = ET.tostring(serviceinfo, encoding=ET_ENCODING)
+    entries = [(node.get('name'), node.get('md5'), node.get('size'), node.get('mtime'), node.get('skipped'))
+               for node in root.findall('entry')]
+    return {'rev': root.get('rev'), 'srcmd5': root.get('srcmd5'), 'linkinfo': linkinfo,
+            'serviceinfo': serviceinfo, 'entries': entries}
+
+def _parse_packages(store_files):
+    """
+    Returns the attributes of the root and the children of the _packages
+    store file (see wcindex.read) or None if it is empty, does not exist
+    or cannot be parsed.
+    """
+    if not store_files['_packages']:
+        return None
+    try:
+        root = ET.fromstring(store_files['_packages'])
+    except SyntaxError:
+        return None
+    return dict(root.items()), [(node.tag, dict(node.items())) for node in root]
+
 def parseargs(list_of_args):
     """Convenience method osc's commandline argument parsing.
 
@@ -3241,17 +3620,11 @@ def makeurl(baseurl, l, query=[]):
     return urlunsplit((scheme, netloc, '/'.join([path] + list(l)), query, ''))
 
 
-def http_request(method, url, headers={}, data=None, file=None):
+def http_request(method, url, headers={}, data=None, file=None, progress_obj=None):
     """wrapper around urllib2.urlopen for error handling,
-    and to support additional (PUT, DELETE) methods"""
-    def create_memoryview(obj):
-        if sys.version_info < (2, 7, 99):
-            # obj might be a mmap and python 2.7's mmap does not
-            # behave like a bytearray (a bytearray in turn can be used
-            # to create the memoryview). For now simply return a buffer
-            return buffer(obj)
-        return memoryview(obj)
-
+    and to support additional (PUT, DELETE) methods.
+    Large files are streamed, the upload progress is reported
+    to progress_obj."""
     filefd = None
 
     if conf.config['http_debug']:
@@ -3263,6 +3636,10 @@ def http_request(method, url, headers={}, data=None, file=None):
 
     req = URLRequest(url)
     api_host_options = {}
+    cache = None
+    memo = None
+    memo_key = None
+    breaker = None
     apiurl = conf.extract_known_apiurl(url)
     if apiurl is not None:
         # ok no external request
@@ -3270,6 +3647,33 @@ def http_request(method, url, headers={}, data=None, file=None):
         api_host_options = conf.get_apiurl_api_host_options(apiurl)
         for header, value in api_host_options['http_headers']:
             req.add_header(header, value)
+        cache = conf.get_response_cache()
+        memo = conf.get_memo_cache()
+        breaker = conf.get_circuit_breaker(apiurl)
+        cache_path = urlsplit(url)[2][len(urlsplit(apiurl)[2]):]
+        cache_user = api_host_options['user']
+
+    if memo is not None:
+        if method != 'GET':
+            memo.invalidate(cache_path)
+        elif memo.is_memoizable(cache_path, urlsplit(url)[3]) and not headers and not file and not data:
+            memo_key = (cache_user, url)
+            fd = memo.begin(memo_key)
+            if fd is not None:
+                if conf.config['http_debug']:
+                    print('memo: %d requests avoided' % memo.hits, file=sys.stderr)
+                return fd
+
+    if cache is not None:
+        if method != 'GET':
+            # osc changes something on the server
+            cache.invalidate(cache_path)
+            cache = None
+        elif cache.is_cacheable(cache_path):
+            for header, value in cache.lookup(cache_user, url).items():
+                req.add_header(header, value)
+        else:
+            cache = None
 
     req.get_method = lambda: method
 
@@ -3288,36 +3692,79 @@ def http_request(method, url, headers={}, data=None, file=None):
         if size < 1024*512:
             data = open(file, 'rb').read()
         else:
-            import mmap
-            filefd = open(file, 'rb')
-            try:
-                if sys.platform[:3] != 'win':
-                    data = mmap.mmap(filefd.fileno(), os.path.getsize(file), mmap.MAP_SHARED, mmap.PROT_READ)
-                else:
-                    data = mmap.mmap(filefd.fileno(), os.path.getsize(file))
-                data = create_memoryview(data)
-            except EnvironmentError as e:
-                if e.errno == 19:
-                    sys.exit('\n\n%s\nThe file \'%s\' could not be memory mapped. It is ' \
-                             '\non a filesystem which does not support this.' % (e, file))
-                elif hasattr(e, 'winerror') and e.winerror == 5:
-                    # falling back to the default io
-                    data = open(file, 'rb').read()
-                else:
-                    raise
+            filefd = data = oschttp.UploadFile(file, progress_obj)
+            # set the data before the header (python 3 drops the
+            # Content-Length header if the data is changed)
+            req.data = data
+            req.add_header('Content-Length', str(size))
 
     if conf.config['debug']: print(method, url, file=sys.stderr)
 
+    retry_policy = conf.get_retry_policy()
+    attempt = 0
     try:
         if isinstance(data, str):
             data = bytes(data, "utf-8")
-        fd = urlopen(req, data=data)
+        while True:
+            if breaker is not None:
+                breaker.check(url)
+            if filefd is not None:
+                # (re)send the file from the start
+                filefd.seek(0)
+            error = None
+            stats = httpstats.collector
+            if stats is not None:
+                rec = stats.start(method, url, apiurl, len(data) if data else 0)
+            try:
+                fd = urlopen(req, data=data)
+            except (URLError, HTTPException, socket.error) as e:
+                error = e
+            if stats is not None:
+                if error is None:
+                    fd = stats.response(rec, fd)
+                else:
+                    stats.error(rec, error)
+            if breaker is not None:
+                if error is not None and retry_policy.is_server_failure(error):
+                    breaker.failure()
+                else:
+                    breaker.success()
+            if isinstance(error, HTTPError) and error.code == 304 and cache is not None:
+                error.close()
+                fd = cache.response(cache_user, url)
+                if fd is not None:
+                    if conf.config['http_debug']:
+                        print('response cache: not modified (%d hits)' % cache.hits, file=sys.stderr)
+                    break
+                # the cache entry vanished in the meantime
+                for header in ('If-none-match', 'If-modified-since'):
+                    req.headers.pop(header, None)
+                continue
+            if error is None:
+                break
+            attempt += 1
+            delay = None
+            if retry_policy.is_retryable(method, error):
+                delay = retry_policy.get_delay(attempt, error)
+            if delay is None:
+                raise error
+            if isinstance(error, HTTPError):
+                error.close()
+            if conf.config['http_debug']:
+                print('\n\nRetry %d in %.1fs (%s) --' % (attempt, delay, error), method, url, file=sys.stderr)
+            time.sleep(delay)
+        if cache is not None and fd.code == 200:
+            fd = cache.store(cache_user, url, cache_path, fd)
+        if memo_key is not None and fd.code == 200:
+            fd = memo.store(memo_key, cache_path, fd)
 
     finally:
-        if hasattr(conf.cookiejar, 'save'):
-            conf.cookiejar.save(ignore_discard=True)
-
-    if filefd: filefd.close()
+        if memo_key is not None:
+            # wake up waiting requests if nothing was memoized
+            memo.abort(memo_key)
+        if hasattr(conf.cookiejar, 'flush'):
+            conf.cookiejar.flush()
+        if filefd: filefd.close()
 
     return fd
 
@@ -3328,14 +3775,44 @@ def http_PUT(*args, **kwargs):    return http_request('PUT', *args, **kwargs)
 def http_DELETE(*args, **kwargs): return http_request('DELETE', *args, **kwargs)
 
 
-def check_store_version(dir):
+def iter_xml_elements(f, depth=1):
+    """
+    Incrementally parses the xml document which is read from the
+    file-like object f (e.g. a http response) and yields a
+    (parents, elem) tuple for each element up to the given depth (the
+    children of the root element have depth 1) as soon as the element
+    is complete. parents is the list of the ancestors of elem (starting
+    with the root element), their attributes are available but not
+    their children. An element is removed from its parent after it was
+    yielded, so the memory usage does not depend on the size of the
+    document (as long as the caller does not keep the elements).
+    """
+    parents = []
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if parents and len(parents) <= depth:
+            yield parents, elem
+            parents[-1].remove(elem)
+
+
+def check_store_version(dir, version=None):
+    """
+    Checks (and migrates) the store of the working copy dir. version is
+    the content of its _osclib_version file, if it was read already.
+    """
     global store
 
     versionfile = os.path.join(dir, store, '_osclib_version')
-    try:
-        v = open(versionfile).read().strip()
-    except:
-        v = ''
+    if version is not None:
+        v = version.strip()
+    else:
+        try:
+            v = open(versionfile).read().strip()
+        except:
+            v = ''
 
     if v == '':
         msg = 'Error: "%s" is not an osc package working copy.' % os.path.abspath(dir)
@@ -3814,19 +4291,23 @@ def show_upstream_xsrcmd5(apiurl, prj, pac, revision=None, linkrev=None, linkrep
     return li.xsrcmd5
 
 
-def show_project_sourceinfo(apiurl, project, nofilename, *packages):
+def _http_GET_project_sourceinfo(apiurl, project, nofilename, *packages):
     query = ['view=info']
     if packages:
         query.extend(['package=%s' % quote_plus(p) for p in packages])
     if nofilename:
         query.append('nofilename=1')
-    f = http_GET(makeurl(apiurl, ['source', project], query=query))
+    return http_GET(makeurl(apiurl, ['source', project], query=query))
+
+
+def show_project_sourceinfo(apiurl, project, nofilename, *packages):
+    f = _http_GET_project_sourceinfo(apiurl, project, nofilename, *packages)
     return f.read()
 
 
 def get_project_sourceinfo(apiurl, project, nofilename, *packages):
     try:
-        si = show_project_sourceinfo(apiurl, project, nofilename, *packages)
+        f = _http_GET_project_sourceinfo(apiurl, project, nofilename, *packages)
     except HTTPError as e:
         # old API servers (e.g. 2.3.5) do not know the 'nofilename' parameter, so retry without
         if e.code == 400 and nofilename:
@@ -3843,10 +4324,10 @@ def get_project_sourceinfo(apiurl, project, nofilename, *packages):
         pkgs = packages[n:]
         res.update(get_project_sourceinfo(apiurl, project, nofilename, *pkgs))
         return res
-    root = ET.fromstring(si)
     res = {}
-    for sinfo in root.findall('sourceinfo'):
-        res[sinfo.get('package')] = sinfo
+    for _, sinfo in iter_xml_elements(f):
+        if sinfo.tag == 'sourceinfo':
+            res[sinfo.get('package')] = sinfo
     return res
 
 
@@ -4275,14 +4756,8 @@ def get_review_list(apiurl, project='', package='', byuser='', bygroup='', bypro
 
     if conf.config['verbose'] > 1:
         print('[ %s ]' % xpath)
-    res = search(apiurl, request=xpath)
-    collection = res['request']
-    requests = []
-    for root in collection.findall('request'):
-        r = Request()
-        r.read(root)
-        requests.append(r)
-    return requests
+    f = search_stream(apiurl, 'request', xpath)
+    return _read_requests(f)
 
 # this function uses the logic in the api which is faster and more exact then the xpath search
 def get_request_collection(apiurl, role=None, req_who=None, req_states=('new', 'review', 'declined')):
@@ -4297,13 +4772,16 @@ def get_request_collection(apiurl, role=None, req_who=None, req_states=('new', '
 
     u = makeurl(apiurl, ['request'], query)
     f = http_GET(u)
-    res = ET.parse(f).getroot()
+    return _read_requests(f)
 
+def _read_requests(f):
+    """read the <request /> elements of a collection from the http response f"""
     requests = []
-    for root in res.findall('request'):
-        r = Request()
-        r.read(root)
-        requests.append(r)
+    for _, root in iter_xml_elements(f):
+        if root.tag == 'request':
+            r = Request()
+            r.read(root)
+            requests.append(r)
     return requests
 
 def get_exact_request_list(apiurl, src_project, dst_project, src_package=None, dst_package=None, req_who=None, req_state=('new', 'review', 'declined'), req_type=None):
@@ -4328,14 +4806,8 @@ def get_exact_request_list(apiurl, src_project, dst_project, src_package=None, d
     if conf.config['verbose'] > 1:
         print('[ %s ]' % xpath)
 
-    res = search(apiurl, request=xpath)
-    collection = res['request']
-    requests = []
-    for root in collection.findall('request'):
-        r = Request()
-        r.read(root)
-        requests.append(r)
-    return requests
+    f = search_stream(apiurl, 'request', xpath)
+    return _read_requests(f)
 
 def get_request_list(apiurl, project='', package='', req_who='', req_state=('new', 'review', 'declined'), req_type=None, exclude_target_projects=[],
                      withfullhistory=False):
@@ -4373,14 +4845,8 @@ def get_request_list(apiurl, project='', package='', req_who='', req_state=('new
     queries = {}
     if withfullhistory:
         queries['request'] = {'withfullhistory': '1'}
-    res = search(apiurl, queries=queries, request=xpath)
-    collection = res['request']
-    requests = []
-    for root in collection.findall('request'):
-        r = Request()
-        r.read(root)
-        requests.append(r)
-    return requests
+    f = search_stream(apiurl, 'request', xpath, queries.get('request'))
+    return _read_requests(f)
 
 # old style search, this is to be removed
 def get_user_projpkgs_request_list(apiurl, user, req_state=('new', 'review', ), req_type=None, exclude_projects=[], projpkgs={}):
@@ -4556,6 +5022,159 @@ def get_source_file(apiurl, prj, package, filename, targetfilename=None, revisio
     u = makeurl(apiurl, ['source', prj, package, pathname2url(filename.encode(locale.getpreferredencoding(), 'replace'))], query=query)
     download(u, targetfilename, progress_obj, mtime)
 
+
+class SourcePrefetcher:
+    """
+    Downloads source files in the background before they are needed.
+
+    Project.update (and the checkout of a project) queues the packages
+    which it is going to update. A pool of worker threads fetches the
+    file list of each package and downloads the files which changed into
+    tmpdir, in the order of the packages. Package.update takes the
+    downloaded files instead of downloading them itself, so the packages
+    are still updated one after the other and the _in_update transaction
+    and the output of each package are unchanged. At most max_ahead
+    downloaded files are waiting in tmpdir.
+    """
+
+    class Job:
+        def __init__(self, index, key, func, filename=None):
+            self.index = index
+            self.key = key
+            self.func = func
+            self.filename = filename
+            self.state = 'queued'
+            self.error = None
+            self.discarded = False
+
+    def __init__(self, tmpdir, workers, max_ahead=None):
+        import threading
+        self.tmpdir = tmpdir
+        self.max_ahead = max_ahead or 4 * workers
+        self._cond = threading.Condition()
+        self._queue = []
+        self._jobs = {}
+        self._seq = 0
+        self._staged = 0
+        self._closed = False
+        for i in range(workers):
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+
+    def _add(self, job, prio):
+        import heapq
+        with self._cond:
+            self._seq += 1
+            self._jobs[job.key] = job
+            heapq.heappush(self._queue, (job.index, prio, self._seq, job))
+            self._cond.notify()
+
+    def add_package(self, index, prefetch, *args):
+        """
+        Queues prefetch(prefetcher, index, *args), which fetches the file
+        list of a package and queues its files with add_file.
+        """
+        self._add(SourcePrefetcher.Job(index, ('package', index),
+                                       lambda: prefetch(self, index, *args)), 0)
+
+    def add_file(self, index, apiurl, prj, package, filename, revision, meta=False):
+        key = (apiurl, prj, package, filename, revision, meta)
+        tmpfile = os.path.join(self.tmpdir, '%d-%s' % (index, filename))
+        self._add(SourcePrefetcher.Job(index, key,
+                                       lambda: get_source_file(apiurl, prj, package, filename, tmpfile,
+                                                               revision=revision, meta=meta),
+                                       tmpfile), 1)
+
+    def _next_job(self):
+        import heapq
+        while not self._closed:
+            while self._queue and self._queue[0][-1].state != 'queued':
+                heapq.heappop(self._queue)
+            if self._queue and (self._queue[0][-1].filename is None or self._staged < self.max_ahead):
+                job = heapq.heappop(self._queue)[-1]
+                job.state = 'running'
+                if job.filename is not None:
+                    self._staged += 1
+                return job
+            self._cond.wait()
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+            if job is None:
+                return
+            try:
+                job.func()
+            except Exception as e:
+                # the error is raised again when the file is needed
+                job.error = e
+            with self._cond:
+                job.state = 'done'
+                if job.discarded:
+                    self._discard(job)
+                self._cond.notify_all()
+
+    def _discard(self, job):
+        if job.state == 'queued':
+            job.state = 'cancelled'
+        elif job.state == 'running':
+            job.discarded = True
+        elif job.state == 'done' and job.filename is not None:
+            self._staged -= 1
+            if os.path.exists(job.filename):
+                os.unlink(job.filename)
+
+    def claim_package(self, index):
+        """wait until the file list of the package index was processed"""
+        with self._cond:
+            job = self._jobs.pop(('package', index), None)
+            if job is None:
+                return
+            if job.state == 'queued':
+                job.state = 'cancelled'
+            while job.state == 'running':
+                self._cond.wait()
+
+    def release_package(self, index):
+        """drop the downloaded files of the package index which were not needed"""
+        with self._cond:
+            for key, job in list(self._jobs.items()):
+                if job.index == index:
+                    del self._jobs[key]
+                    self._discard(job)
+            self._cond.notify_all()
+
+    def take(self, key, targetfilename):
+        """
+        Moves the downloaded file for key (see add_file) to targetfilename.
+        Returns False if the file was not downloaded (yet).
+        """
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job is None:
+                return False
+            if job.state == 'queued':
+                job.state = 'cancelled'
+                return False
+            while job.state == 'running':
+                self._cond.wait()
+            self._staged -= 1
+            self._cond.notify_all()
+        if job.error is not None or not os.path.exists(job.filename):
+            return False
+        shutil.move(job.filename, targetfilename)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
 def get_binary_file(apiurl, prj, repo, arch,
                     filename,
                     package = None,
@@ -4601,13 +5220,59 @@ def dgst(file):
         import md5
         md5 = md5
     s = md5.md5()
-    f = open(file, 'rb')
-    while True:
-        buf = f.read(BUFSIZE)
-        if not buf: break
-        s.update(buf)
+    with open(file, 'rb') as f:
+        while True:
+            buf = f.read(BUFSIZE)
+            if not buf: break
+            s.update(buf)
     return s.hexdigest()
-    f.close()
+
+
+def dgst_files(files, hashfunc=None, workers=None):
+    """
+    Returns a dict which maps each of the files to its md5 (or the result
+    of hashfunc). The files are hashed by workers threads (default:
+    the hash_workers config option); hashlib releases the GIL while it
+    hashes the large buffers read by dgst.
+    """
+    import threading
+    hashfunc = hashfunc or dgst
+    if workers is None:
+        workers = int(conf.config['hash_workers'])
+    files = list(files)
+    result = {}
+    if workers <= 1 or len(files) <= 1:
+        for f in files:
+            result[f] = hashfunc(f)
+        return result
+
+    todo = iter(files)
+    lock = threading.Lock()
+    errors = []
+    def worker():
+        while True:
+            with lock:
+                if errors:
+                    return
+                f = next(todo, None)
+            if f is None:
+                return
+            try:
+                result[f] = hashfunc(f)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                return
+
+    threads = [threading.Thread(target=worker) for i in range(min(workers, len(files)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return result
 
 
 def binary(s):
@@ -4832,7 +5497,8 @@ def make_dir(apiurl, project, package, pathname=None, prj_dir=None, package_trac
 
 def checkout_package(apiurl, project, package,
                      revision=None, pathname=None, prj_obj=None,
-                     expand_link=False, prj_dir=None, server_service_files = None, service_files=None, progress_obj=None, size_limit=None, meta=False, outdir=None):
+                     expand_link=False, prj_dir=None, server_service_files = None, service_files=None, progress_obj=None, size_limit=None, meta=False, outdir=None,
+                     prefetcher=None):
     try:
         # the project we're in might be deleted.
         # that'll throw an error then.
@@ -4918,11 +5584,83 @@ def checkout_package(apiurl, project, package,
             prj_obj = Project(prj_dir)
         prj_obj.set_state(p.name, ' ')
         prj_obj.write_packages()
-    p.update(revision, server_service_files, size_limit)
+    p.prefetcher = prefetcher
+    try:
+        p.update(revision, server_service_files, size_limit)
+    finally:
+        p.prefetcher = None
     if service_files:
         print('Running all source services local')
         p.run_source_services()
 
+
+def get_local_links(apiurl, project):
+    """
+    Returns a dict which maps the packages of project which link to
+    another package of the same project to the name of the link target
+    (packages with a broken link are not included). The sourceinfo of the
+    whole project is requested just once. None is returned if the server
+    does not provide the sourceinfo.
+    """
+    try:
+        sinfos = get_project_sourceinfo(apiurl, project, True)
+    except (HTTPError, oscerr.APIError):
+        return None
+    links = {}
+    for package, sinfo in sinfos.items():
+        linked = sinfo.find('linked')
+        if linked is not None and linked.get('project') == project and sinfo.find('error') is None:
+            links[package] = linked.get('package')
+    return links
+
+
+def prefetch_checkout(prefetcher, index, apiurl, project, package, expand_link=False,
+                      server_service_files=None, size_limit=None, meta=False):
+    """
+    Requests the metadata which checkout_package needs (it is memoized
+    for the checkout, see conf.get_memo_cache) and queues the downloads
+    of the files of package (see SourcePrefetcher).
+    """
+    show_package_meta(apiurl, quote_plus(project), quote_plus(package), meta)
+    revision = None
+    if expand_link:
+        try:
+            revision = show_upstream_xsrcmd5(apiurl, project, package, meta=meta, include_service_files=server_service_files)
+        except:
+            revision = show_upstream_xsrcmd5(apiurl, project, package, meta=meta, linkrev='base', include_service_files=server_service_files)
+    root = ET.fromstring(show_files_meta(apiurl, project, package, revision=revision, meta=meta))
+    objects = conf.get_object_store()
+    for e in root.findall('entry'):
+        name = e.get('name')
+        if objects is not None and objects.has(e.get('md5')) and not name.startswith('_service:'):
+            # linked from the object store
+            continue
+        if name.startswith('_service_') or name.startswith('_service:') and not server_service_files:
+            continue
+        size = e.get('size')
+        if size and size_limit and int(size) > int(size_limit) and not name.startswith('_service:'):
+            continue
+        prefetcher.add_file(index, apiurl, project, package, name, root.get('rev'), meta)
+
+
+def checkout_prefetcher(apiurl, project, prj_dir, packages, skip=(), **kwargs):
+    """
+    Returns a SourcePrefetcher which downloads the files of the packages
+    (except the ones in skip) in the order in which they are checked out
+    into the project working copy prj_dir, or None if files are
+    downloaded one after the other. kwargs are passed to prefetch_checkout.
+    """
+    import tempfile
+    workers = int(conf.config['download_workers'])
+    if workers <= 1:
+        return None
+    tmpdir = tempfile.mkdtemp(prefix='_prefetch.', dir=os.path.join(prj_dir, store))
+    prefetcher = SourcePrefetcher(tmpdir, workers)
+    for index, package in enumerate(packages):
+        if not package in skip:
+            prefetcher.add_package(index, prefetch_checkout, apiurl, project, package, **kwargs)
+    return prefetcher
+
 def replace_pkg_meta(pkgmeta, new_name, new_prj, keep_maintainers = False,
                      dst_userid = None, keep_develproject = False):
     """
@@ -5653,16 +6391,27 @@ def get_package_results(apiurl, project, package, wait=False, *args, **kwargs):
         try:
             xml = ''.join(show_results_meta(apiurl, project, package, *args, **kwargs))
         except HTTPError as e:
-            # check for simple timeout error and fetch again
-            if e.code == 502 or e.code == 504:
-                # re-try result request
-                continue
-            root = ET.fromstring(e.read())
-            if e.code == 400 and kwargs.get('multibuild') and re.search('multibuild', getattr(root.find('summary'), 'text', '')):
-                kwargs['multibuild'] = None
-                kwargs['locallink'] = None
+            # http_request gives up on a 502 or 504 (proxy timeout) after
+            # a few retries, but a watch keeps polling
+            if wait and e.code in (502, 504):
                 continue
+            if e.code == 400 and kwargs.get('multibuild'):
+                try:
+                    root = ET.fromstring(e.read())
+                except ET.ParseError:
+                    raise e
+                if re.search('multibuild', getattr(root.find('summary'), 'text', '')):
+                    kwargs['multibuild'] = None
+                    kwargs['locallink'] = None
+                    continue
             raise
+        except oschttp.CircuitOpenError:
+            if not wait:
+                raise
+            # the server failed too often, poll again after the breaker
+            # timeout
+            time.sleep(float(conf.config['http_breaker_timeout']))
+            continue
         root = ET.fromstring(xml)
         kwargs['oldstate'] = root.get('state')
         for result in root.findall('result'):
@@ -5691,37 +6440,46 @@ def get_prj_results(apiurl, prj, hide_legend=False, csv=False, status_filter=Non
 
     r = []
 
-    f = show_prj_results_meta(apiurl, prj)
-    root = ET.fromstring(''.join(f))
-
-    pacs = []
-    # sequence of (repo,arch) tuples
-    targets = []
-    # {package: {(repo,arch): status}}
-    status = {}
-    if root.find('result') == None:
-        return []
-    for results in root.findall('result'):
-        for node in results:
-            pacs.append(node.get('package'))
-    pacs = sorted(list(set(pacs)))
-    for node in root.findall('result'):
+    def target(node):
+        """returns the (repo, arch, state) tuple of a result or None if it is filtered"""
         # filter architecture and repository
         if arch != None and node.get('arch') not in arch:
-            continue
+            return None
         if repo != None and node.get('repository') not in repo:
-            continue
+            return None
         if node.get('dirty') == "true":
             state = "outdated"
         else:
             state = node.get('state')
-        tg = (node.get('repository'), node.get('arch'), state)
-        targets.append(tg)
-        for pacnode in node.findall('status'):
-            pac = pacnode.get('package')
-            if pac not in status:
-                status[pac] = {}
-            status[pac][tg] = pacnode.get('code')
+        return (node.get('repository'), node.get('arch'), state)
+
+    # the result list of a big project is huge, so it is processed
+    # while it is read instead of parsing the whole document
+    f = http_GET(makeurl(apiurl, ['build', prj, '_result']))
+
+    pacs = set()
+    # sequence of (repo,arch) tuples
+    targets = []
+    # {package: {(repo,arch): status}}
+    status = {}
+    have_results = False
+    for parents, node in iter_xml_elements(f, depth=2):
+        if len(parents) == 2:
+            # a child of a result node
+            if parents[1].tag != 'result':
+                continue
+            pacs.add(node.get('package'))
+            tg = target(parents[1])
+            if tg is not None and node.tag == 'status':
+                status.setdefault(node.get('package'), {})[tg] = node.get('code')
+        elif node.tag == 'result':
+            have_results = True
+            tg = target(node)
+            if tg is not None:
+                targets.append(tg)
+    if not have_results:
+        return []
+    pacs = sorted(pacs)
     targets.sort()
 
     # filter option
@@ -5877,19 +6635,26 @@ def streamfile(url, http_meth = http_GET, bufsize=8192, data=None, progress_obj=
     performs http_meth on url and read bufsize bytes from the response
     until EOF is reached. After each read bufsize bytes are yielded to the
     caller. A spezial usage is bufsize="line" to read line by line (text).
+    gzip/deflate encoded responses are decompressed transparently, in this
+    case Content-Length and the progress refer to the compressed size.
     """
-    cl = ''
+    retry_policy = conf.get_retry_policy()
     retries = 0
     # Repeat requests until we get reasonable Content-Length header
     # Server (or iChain) is corrupting data at some point, see bnc#656281
-    while cl == '':
-        if retries >= int(conf.config['http_retries']):
-            raise oscerr.OscIOError(None, 'Content-Length is empty for %s, protocol violation' % url)
-        retries = retries + 1
-        if retries > 1 and conf.config['http_debug']:
-            print('\n\nRetry %d --' % (retries - 1), url, file=sys.stderr)
+    while True:
         f = http_meth.__call__(url, data = data)
         cl = f.info().get('Content-Length')
+        if cl != '':
+            break
+        f.close()
+        retries = retries + 1
+        delay = retry_policy.get_delay(retries)
+        if delay is None:
+            raise oscerr.OscIOError(None, 'Content-Length is empty for %s, protocol violation' % url)
+        if conf.config['http_debug']:
+            print('\n\nRetry %d in %.1fs --' % (retries, delay), url, file=sys.stderr)
+        time.sleep(delay)
 
     if cl is not None:
         # sometimes the proxy adds the same header again
@@ -5909,15 +6674,25 @@ def streamfile(url, http_meth = http_GET, bufsize=8192, data=None, progress_obj=
         xread = f.read
 
     read = 0
+    decompressed = 0
+    encoded = oschttp.raw_bytes_read(f) is not None
     while True:
         data = xread(bufsize)
         if not len(data):
             break
-        read += len(data)
+        if encoded:
+            decompressed += len(data)
+            read = oschttp.raw_bytes_read(f)
+        else:
+            read += len(data)
         if progress_obj:
+            if encoded and hasattr(progress_obj, 'set_decompressed'):
+                progress_obj.set_decompressed(decompressed)
             progress_obj.update(read)
         yield data
 
+    if encoded:
+        read = oschttp.raw_bytes_read(f)
     if progress_obj:
         progress_obj.end(read)
     f.close()
@@ -6543,15 +7318,24 @@ def search(apiurl, queries=None, **kwargs):
         queries = {}
     res = {}
     for urlpath, xpath in kwargs.items():
-        path = [ 'search' ]
-        path += urlpath.split('_') # FIXME: take underscores as path seperators. I see no other way atm to fix OBS api calls and not breaking osc api
-        query = queries.get(urlpath, {})
-        query['match'] = xpath
-        u = makeurl(apiurl, path, query)
-        f = http_GET(u)
+        f = search_stream(apiurl, urlpath, xpath, queries.get(urlpath))
         res[urlpath] = ET.parse(f).getroot()
     return res
 
+def search_stream(apiurl, urlpath, xpath, query=None):
+    """
+    Perform a single search request (see search()) and return the http
+    response, so that a large collection can be processed incrementally
+    with iter_xml_elements.
+    """
+    path = [ 'search' ]
+    path += urlpath.split('_') # FIXME: take underscores as path seperators. I see no other way atm to fix OBS api calls and not breaking osc api
+    if query is None:
+        query = {}
+    query['match'] = xpath
+    u = makeurl(apiurl, path, query)
+    return http_GET(u)
+
 def owner(apiurl, binary, mode="binary", attribute=None, project=None, usefilter=None, devel=None, limit=None):
     """
     Perform a binary package owner search. This is supported since OBS 2.4.
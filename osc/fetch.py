@@ -6,21 +6,25 @@
 from __future__ import print_function
 
 import sys, os
+import threading
 
 try:
-    from urllib.parse import quote_plus
+    from urllib.parse import quote_plus, urlsplit
     from urllib.request import HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, HTTPError
 except ImportError:
     #python 2.x
     from urllib import quote_plus
+    from urlparse import urlsplit
     from urllib2 import HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, HTTPError
 
 from urlgrabber.grabber import URLGrabber, URLGrabError
 from urlgrabber.mirror import MirrorGroup
-from .core import makeurl, streamfile, dgst
+from .core import makeurl, streamfile, dgst_files
 from .util import packagequery, cpio
 from . import conf
 from . import oscerr
+from . import oschttp
+from . import pkgcache
 import tempfile
 import re
 try:
@@ -28,6 +32,10 @@ try:
 except:
     TextMeter = None
 
+# cpio archives are requested in batches whose url is at most this long
+# (most http servers reject longer request lines with 414)
+MAX_CPIO_URL_LENGTH = 8000
+
 
 def join_url(self, base_url, rel_url):
     """to override _join_url of MirrorGroup, because we want to
@@ -37,12 +45,30 @@ def join_url(self, base_url, rel_url):
     return base_url
 
 
+class HostConnections:
+    """limits the number of concurrent downloads from each host"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def slot(self, url):
+        """returns the semaphore which guards a download from url"""
+        host = urlsplit(url)[1]
+        with self._lock:
+            if not host in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.limit)
+            return self._slots[host]
+
+
 class OscFileGrabber(URLGrabber):
-    def __init__(self, progress_obj=None):
+    def __init__(self, progress_obj=None, connections=None):
         # we cannot use super because we still have to support
         # older urlgrabber versions where URLGrabber is an old-style class
         URLGrabber.__init__(self)
         self.progress_obj = progress_obj
+        self.connections = connections
 
     def urlgrab(self, url, filename, text=None, **kwargs):
         if url.startswith('file://'):
@@ -51,25 +77,56 @@ class OscFileGrabber(URLGrabber):
                 return f
             else:
                 raise URLGrabError(2, 'Local file \'%s\' does not exist' % f)
-        with file(filename, 'wb') as f:
+        if self.connections is not None:
+            with self.connections.slot(url):
+                return self.__urlgrab(url, filename, text)
+        return self.__urlgrab(url, filename, text)
+
+    def __urlgrab(self, url, filename, text):
+        with open(filename, 'wb') as f:
             try:
                 for i in streamfile(url, progress_obj=self.progress_obj,
                                     text=text):
                     f.write(i)
             except HTTPError as e:
-                exc = URLGrabError(14, str(e))
-                exc.url = url
-                exc.exception = e
-                exc.code = e.code
-                raise exc
+                raise self.__http_error(url, e)
             except IOError as e:
                 raise URLGrabError(4, str(e))
         return filename
 
+    def urlread(self, url, text=None):
+        """
+        yields the data of url while it is downloaded (errors are raised
+        as URLGrabError, like urlgrab does)
+        """
+        slot = None
+        if self.connections is not None:
+            slot = self.connections.slot(url)
+            slot.acquire()
+        try:
+            for i in streamfile(url, progress_obj=self.progress_obj, text=text):
+                yield i
+        except HTTPError as e:
+            raise self.__http_error(url, e)
+        except IOError as e:
+            raise URLGrabError(4, str(e))
+        finally:
+            if slot is not None:
+                slot.release()
+
+    @staticmethod
+    def __http_error(url, e):
+        exc = URLGrabError(14, str(e))
+        exc.url = url
+        exc.exception = e
+        exc.code = e.code
+        return exc
+
 
 class Fetcher:
     def __init__(self, cachedir='/tmp', api_host_options={}, urllist=[],
-            http_debug=False, cookiejar=None, offline=False, enable_cpio=True):
+            http_debug=False, cookiejar=None, offline=False, enable_cpio=True,
+            verify_cache=False):
         # set up progress bar callback
         if sys.stdout.isatty() and TextMeter:
             self.progress_obj = TextMeter(fo=sys.stdout)
@@ -82,6 +139,17 @@ class Fetcher:
         self.offline = offline
         self.cpio = {}
         self.enable_cpio = enable_cpio
+        # hdrmd5 of the cached packages (verify_cache: query each
+        # package again)
+        self.index = pkgcache.Hdrmd5Index(cachedir, verify=verify_cache)
+        # usage log and eviction (packagecache_max_size, packagecache_max_age)
+        self.cache = pkgcache.get_package_cache(cachedir)
+        # packages which are not fetched via cpio are downloaded by
+        # fetch_workers threads, at most fetch_host_connections of
+        # them download from the same host
+        self.workers = int(conf.config['fetch_workers'])
+        self.connections = HostConnections(int(conf.config['fetch_host_connections']))
+        self._lock = threading.Lock()
 
         passmgr = HTTPPasswordMgrWithDefaultRealm()
         for host in api_host_options:
@@ -92,70 +160,70 @@ class Fetcher:
             openers += (HTTPCookieProcessor(cookiejar), )
         self.gr = OscFileGrabber(progress_obj=self.progress_obj)
 
-    def failureReport(self, errobj):
+    def failureReport(self, errobj, pac=None):
         """failure output for failovers from urlgrabber"""
         if errobj.url.startswith('file://'):
             return {}
+        pac = pac or self.curpac
         print('%s/%s: attempting download from api, since not found at %s'
-              % (self.curpac.project, self.curpac, errobj.url.split('/')[2]))
+              % (pac.project, pac, errobj.url.split('/')[2]))
         return {}
 
     def __add_cpio(self, pac):
         prpap = '%s/%s/%s/%s' % (pac.project, pac.repository, pac.repoarch, pac.repopackage)
-        self.cpio.setdefault(prpap, {})[pac.repofilename] = pac
+        with self._lock:
+            self.cpio.setdefault(prpap, {})[pac.repofilename] = pac
 
-    def __download_cpio_archive(self, apiurl, project, repo, arch, package, **pkgs):
+    def __download_cpio_archive(self, apiurl, project, repo, arch, package, grabber=None, **pkgs):
         if not pkgs:
             return
+        grabber = grabber or self.gr
         query = ['binary=%s' % quote_plus(i) for i in pkgs]
         query.append('view=cpio')
         try:
             url = makeurl(apiurl, ['build', project, repo, arch, package], query=query)
-            sys.stdout.write("preparing download ...\r")
-            sys.stdout.flush()
-            with tempfile.NamedTemporaryFile(prefix='osc_build_cpio') as tmparchive:
-                self.gr.urlgrab(url, filename=tmparchive.name,
-                                text='fetching packages for \'%s\'' % project)
-                archive = cpio.CpioRead(tmparchive.name)
-                archive.read()
-                for hdr in archive:
-                    # XXX: we won't have an .errors file because we're using
-                    # getbinarylist instead of the public/... route
-                    # (which is routed to getbinaries)
-                    # getbinaries does not support kiwi builds
-                    if hdr.filename == '.errors':
-                        archive.copyin_file(hdr.filename)
-                        raise oscerr.APIError('CPIO archive is incomplete '
-                                              '(see .errors file)')
-                    if package == '_repository':
-                        n = re.sub(r'\.pkg\.tar\..z$', '.arch', hdr.filename)
-                        if n.startswith('container:'):
-                            n = re.sub(r'\.tar\..z$', '.tar', hdr.filename)
-                            pac = pkgs[n.rsplit('.', 1)[0]]
-                            pac.canonname = hdr.filename
-                        else:
-                            pac = pkgs[n.rsplit('.', 1)[0]]
+            # each member is written to its final location while the
+            # archive is downloaded
+            archive = cpio.CpioStreamRead(grabber.urlread(url, text='fetching packages for \'%s\'' % project),
+                                          url)
+            for hdr in archive:
+                # XXX: we won't have an .errors file because we're using
+                # getbinarylist instead of the public/... route
+                # (which is routed to getbinaries)
+                # getbinaries does not support kiwi builds
+                if hdr.filename == '.errors':
+                    archive.copyin_file(hdr)
+                    raise oscerr.APIError('CPIO archive is incomplete '
+                                          '(see .errors file)')
+                if package == '_repository':
+                    n = re.sub(r'\.pkg\.tar\..z$', '.arch', hdr.filename)
+                    if n.startswith('container:'):
+                        n = re.sub(r'\.tar\..z$', '.tar', hdr.filename)
+                        pac = pkgs[n.rsplit('.', 1)[0]]
+                        pac.canonname = hdr.filename
                     else:
-                        # this is a kiwi product
-                        pac = pkgs[hdr.filename]
-
-                    # Extract a single file from the cpio archive
-                    try:
-                        fd, tmpfile = tempfile.mkstemp(prefix='osc_build_file')
-                        archive.copyin_file(hdr.filename,
-                                            os.path.dirname(tmpfile),
-                                            os.path.basename(tmpfile))
-                        self.move_package(tmpfile, pac.localdir, pac)
-                    finally:
-                        os.close(fd)
-                        if os.path.exists(tmpfile):
-                            os.unlink(tmpfile)
-
-                for pac in pkgs.values():
-                    if not os.path.isfile(pac.fullfilename):
-                        raise oscerr.APIError('failed to fetch file \'%s\': '
-                                              'missing in CPIO archive' %
-                                              pac.repofilename)
+                        pac = pkgs[n.rsplit('.', 1)[0]]
+                else:
+                    # this is a kiwi product
+                    pac = pkgs[hdr.filename]
+
+                # Extract a single file into the cache directory of the
+                # package, move_package renames it
+                fd, tmpfile = tempfile.mkstemp(prefix='.osc_build_file', dir=pac.localdir)
+                try:
+                    os.close(fd)
+                    archive.copyin_file(hdr, os.path.dirname(tmpfile),
+                                        os.path.basename(tmpfile))
+                    self.move_package(tmpfile, pac.localdir, pac)
+                finally:
+                    if os.path.exists(tmpfile):
+                        os.unlink(tmpfile)
+
+            for pac in pkgs.values():
+                if not os.path.isfile(pac.fullfilename):
+                    raise oscerr.APIError('failed to fetch file \'%s\': '
+                                          'missing in CPIO archive' %
+                                          pac.repofilename)
         except URLGrabError as e:
             if e.errno != 14 or e.code != 414:
                 raise
@@ -164,30 +232,93 @@ class Fetcher:
             if len(keys) == 1:
                 raise oscerr.APIError('unable to fetch cpio archive: '
                                       'server always returns code 414')
-            n = len(pkgs) / 2
+            n = len(pkgs) // 2
             new_pkgs = dict([(k, pkgs[k]) for k in keys[:n]])
             self.__download_cpio_archive(apiurl, project, repo, arch,
-                                         package, **new_pkgs)
+                                         package, grabber, **new_pkgs)
             new_pkgs = dict([(k, pkgs[k]) for k in keys[n:]])
             self.__download_cpio_archive(apiurl, project, repo, arch,
-                                         package, **new_pkgs)
+                                         package, grabber, **new_pkgs)
+
+    @staticmethod
+    def cpio_batches(apiurl, project, repo, arch, package, pkgs, max_length=MAX_CPIO_URL_LENGTH):
+        """
+        Splits the dict pkgs (see __add_cpio) into dicts whose cpio
+        download url is at most max_length long (a single package whose
+        url is longer gets a batch of its own).
+        """
+        length = len(makeurl(apiurl, ['build', project, repo, arch, package], query=['view=cpio']))
+        batches = []
+        batch = {}
+        batch_length = length
+        for name in sorted(pkgs):
+            l = len('&binary=%s' % quote_plus(name))
+            if batch and batch_length + l > max_length:
+                batches.append(batch)
+                batch = {}
+                batch_length = length
+            batch[name] = pkgs[name]
+            batch_length += l
+        if batch:
+            batches.append(batch)
+        return batches
 
     def __fetch_cpio(self, apiurl):
-        for prpap, pkgs in self.cpio.items():
+        jobs = []
+        for prpap, pkgs in sorted(self.cpio.items()):
             project, repo, arch, package = prpap.split('/', 3)
-            self.__download_cpio_archive(apiurl, project, repo, arch, package, **pkgs)
+            for batch in self.cpio_batches(apiurl, project, repo, arch, package, pkgs):
+                jobs.append((project, repo, arch, package, batch))
+        if not jobs:
+            return
+        sys.stdout.write("preparing download ...\r")
+        sys.stdout.flush()
+        if self.workers <= 1 or len(jobs) == 1:
+            for project, repo, arch, package, batch in jobs:
+                self.__download_cpio_archive(apiurl, project, repo, arch, package, **batch)
+            return
+
+        # the archives are downloaded concurrently, at most
+        # fetch_host_connections of them from the api server
+        progress = None
+        if self.progress_obj:
+            progress = oschttp.TransferProgress(self.progress_obj, None,
+                                                'fetching packages (%d archives)' % len(jobs))
+        def download(job):
+            project, repo, arch, package, batch = job
+            grabber = OscFileGrabber(progress.file() if progress is not None else None,
+                                     self.connections)
+            self.__download_cpio_archive(apiurl, project, repo, arch, package, grabber, **batch)
+        try:
+            error = self.__run_workers(jobs, download)
+        finally:
+            if progress is not None:
+                progress.end()
+        if error is not None:
+            raise error[1]
 
     def fetch(self, pac, prefix=''):
         # for use by the failure callback
         self.curpac = pac
-
+        try:
+            self.__fetch(pac, self.gr, prefix)
+        except URLGrabError as e:
+            self.__fetch_failed(pac, e)
+
+    def __fetch(self, pac, grabber, prefix=''):
+        """
+        Downloads pac from its mirrors. If all mirrors fail, pac is
+        fetched with the cpio archives (if enabled), otherwise the
+        URLGrabError is raised.
+        """
         MirrorGroup._join_url = join_url
-        mg = MirrorGroup(self.gr, pac.urllist, failure_callback=(self.failureReport, (), {}))
+        mg = MirrorGroup(grabber, pac.urllist, failure_callback=(self.failureReport, (), {'pac': pac}))
 
         if self.http_debug:
-            print('\nURLs to try for package \'%s\':' % pac, file=sys.stderr)
-            print('\n'.join(pac.urllist), file=sys.stderr)
-            print(file=sys.stderr)
+            with self._lock:
+                print('\nURLs to try for package \'%s\':' % pac, file=sys.stderr)
+                print('\n'.join(pac.urllist), file=sys.stderr)
+                print(file=sys.stderr)
 
         try:
             with tempfile.NamedTemporaryFile(prefix='osc_build',
@@ -199,16 +330,85 @@ class Fetcher:
             if self.enable_cpio and e.errno == 256:
                 self.__add_cpio(pac)
                 return
-            print()
-            print('Error:', e.strerror, file=sys.stderr)
-            print('Failed to retrieve %s from the following locations '
-                  '(in order):' % pac.filename, file=sys.stderr)
-            print('\n'.join(pac.urllist), file=sys.stderr)
-            sys.exit(1)
+            raise
         finally:
             if os.path.exists(tmpfile.name):
                 os.unlink(tmpfile.name)
 
+    def __fetch_failed(self, pac, e):
+        print()
+        print('Error:', e.strerror, file=sys.stderr)
+        print('Failed to retrieve %s from the following locations '
+              '(in order):' % pac.filename, file=sys.stderr)
+        print('\n'.join(pac.urllist), file=sys.stderr)
+        sys.exit(1)
+
+    def __fetch_parallel(self, pacs, done, needed):
+        """
+        Downloads pacs with self.workers threads. The progress of all
+        downloads is shown as a single transfer.
+        """
+        progress = None
+        if self.progress_obj:
+            progress = oschttp.TransferProgress(self.progress_obj, None,
+                                                'fetching %d packages' % len(pacs))
+        state = {'done': done}
+
+        def fetch(pac):
+            with self._lock:
+                if progress is None:
+                    # if there isn't a progress bar, there is no output at all
+                    print('%d/%d (%s) %s' % (state['done'], needed, pac.project, pac.filename))
+                state['done'] += 1
+            grabber = OscFileGrabber(progress.file() if progress is not None else None,
+                                     self.connections)
+            self.__fetch(pac, grabber)
+
+        try:
+            error = self.__run_workers(pacs, fetch)
+        finally:
+            if progress is not None:
+                progress.end()
+        if error is not None:
+            pac, e = error
+            if isinstance(e, URLGrabError):
+                self.__fetch_failed(pac, e)
+            raise e
+
+    def __run_workers(self, jobs, func):
+        """
+        Calls func(job) for each of the jobs in self.workers threads.
+        No job is started after a func call raised an exception. Returns
+        the first (job, exception) tuple or None if there was no error.
+        """
+        todo = iter(jobs)
+        errors = []
+
+        def worker():
+            while True:
+                with self._lock:
+                    if errors:
+                        return
+                    job = next(todo, None)
+                if job is None:
+                    return
+                try:
+                    func(job)
+                except Exception as e:
+                    with self._lock:
+                        errors.append((job, e))
+                    return
+
+        threads = [threading.Thread(target=worker) for i in range(min(self.workers, len(jobs)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            # join with a timeout, so that a ctrl-c is not blocked
+            while t.is_alive():
+                t.join(0.5)
+        return errors[0] if errors else None
+
     def move_package(self, tmpfile, destdir, pac_obj=None):
         import shutil
         canonname = None
@@ -230,6 +430,8 @@ class Fetcher:
             pac_obj.fullfilename = fullfilename
         shutil.move(tmpfile, fullfilename)
         os.chmod(fullfilename, 0o644)
+        if pac_obj is not None and pac_obj.hdrmd5:
+            self.index.record(fullfilename, pac_obj.name.startswith('container:'))
 
     def dirSetup(self, pac):
         dir = os.path.join(self.cachedir, pac.localdir)
@@ -244,6 +446,7 @@ class Fetcher:
     def run(self, buildinfo):
         cached = 0
         all = len(buildinfo.deps)
+        verify = []
         for i in buildinfo.deps:
             i.makeurls(self.cachedir, self.urllist)
             # find container extension by looking in the cache
@@ -256,20 +459,29 @@ class Fetcher:
             if os.path.exists(i.fullfilename):
                 cached += 1
                 if i.hdrmd5:
-                    from .util import packagequery
-                    if i.name.startswith('container:'):
-                        hdrmd5 = dgst(i.fullfilename)
-                    else:
-                        hdrmd5 = packagequery.PackageQuery.queryhdrmd5(i.fullfilename)
-                    if not hdrmd5 or hdrmd5 != i.hdrmd5:
-                        os.unlink(i.fullfilename)
-                        cached -= 1
+                    verify.append(i)
+        # verify the cached files in one batch (the packages which are
+        # unchanged since they were verified are not queried again)
+        containers = set(i.fullfilename for i in verify if i.name.startswith('container:'))
+        def hdrmd5(fullfilename):
+            return self.index.hdrmd5(fullfilename, fullfilename in containers)
+        digests = dgst_files([i.fullfilename for i in verify], hdrmd5)
+        for i in verify:
+            if not digests[i.fullfilename] or digests[i.fullfilename] != i.hdrmd5:
+                if os.path.exists(i.fullfilename):
+                    os.unlink(i.fullfilename)
+                self.index.forget(i.fullfilename)
+                cached -= 1
+        # mark the cached packages as used before the downloads start,
+        # so that a concurrent osc build does not evict them meanwhile
+        self.cache.record_use([i.fullfilename for i in buildinfo.deps if os.path.exists(i.fullfilename)])
         miss = 0
         needed = all - cached
         if all:
             miss = 100.0 * needed / all
         print("%.1f%% cache miss. %d/%d dependencies cached.\n" % (miss, cached, all))
         done = 1
+        parallel = []
         for i in buildinfo.deps:
             i.makeurls(self.cachedir, self.urllist)
             if not os.path.exists(i.fullfilename):
@@ -283,6 +495,9 @@ class Fetcher:
                     self.__add_cpio(i)
                     done += 1
                     continue
+                if self.workers > 1:
+                    parallel.append(i)
+                    continue
                 try:
                     # if there isn't a progress bar, there is no output at all
                     if not self.progress_obj:
@@ -298,7 +513,22 @@ class Fetcher:
                     sys.exit(0)
                 done += 1
 
+        if parallel:
+            try:
+                self.__fetch_parallel(parallel, done, needed)
+            except KeyboardInterrupt:
+                print('Cancelled by user (ctrl-c)')
+                print('Exiting.')
+                sys.exit(0)
+
         self.__fetch_cpio(buildinfo.apiurl)
+        self.index.save()
+        # the packages of this build (including the downloaded ones) were
+        # just used, so they are not evicted (see pkgcache.MIN_EVICT_SECONDS)
+        self.cache.record_use([i.fullfilename for i in buildinfo.deps if os.path.exists(i.fullfilename)],
+                              hits=cached, misses=needed)
+        if self.cache.max_size or self.cache.max_age:
+            self.cache.prune()
 
         prjs = list(buildinfo.projects.keys())
         for i in prjs:
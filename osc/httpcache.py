@@ -0,0 +1,361 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+from __future__ import print_function
+
+"""Caches for api responses
+
+Responses of frequently requested metadata documents (project and package
+meta, source listings and build results) are stored together with their
+ETag and Last-Modified values. Subsequent requests are revalidated with
+If-None-Match/If-Modified-Since and, if the server answers with
+"304 Not Modified", the cached body is used instead of downloading it
+again.
+
+Within a single osc process, meta and source listings are additionally
+kept in memory (MemoCache), so repeated requests for the same document
+are not sent at all.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+try:
+    from http.client import parse_headers
+    from io import BytesIO
+    from urllib.parse import parse_qs, urlsplit
+    from urllib.request import addinfourl
+except ImportError:
+    #python 2.x
+    from httplib import HTTPMessage
+    from cStringIO import StringIO as BytesIO
+    from urlparse import parse_qs, urlsplit
+    from urllib import addinfourl
+
+    def parse_headers(fp):
+        return HTTPMessage(fp)
+
+
+# paths (relative to the apiurl) of the documents which are cached
+CACHEABLE_PATH_RE = re.compile(r'^/source/[^/]+(/[^/]+)?(/_meta)?$|^/build/[^/]+/_result$')
+
+# paths which are kept in memory for the lifetime of the process (build
+# results are not, because they are polled)
+MEMO_PATH_RE = re.compile(r'^/source/[^/]+(/[^/]+)?(/_meta)?$')
+
+# headers which are kept in the cache
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def make_response(body, headers, url, code=200):
+    """return an urllib2 style response object for the given body"""
+    hdrs = ''.join('%s: %s\r\n' % (k, v) for k, v in headers.items())
+    hdrs += 'Content-Length: %d\r\n\r\n' % len(body)
+    resp = addinfourl(BytesIO(body), parse_headers(BytesIO(hdrs.encode('iso-8859-1'))), url)
+    resp.code = code
+    resp.msg = 'OK'
+    return resp
+
+
+def paths_overlap(path1, path2):
+    """true if one path is equal to or below the other one"""
+    path1 = path1.rstrip('/') + '/'
+    path2 = path2.rstrip('/') + '/'
+    return path1.startswith(path2) or path2.startswith(path1)
+
+
+class ResponseCache:
+    """
+    Stores response bodies in dir. Each entry is a single file: a line
+    with the json encoded metadata (url, path, validators, headers)
+    followed by the body. The mtime of an entry is its last use, the
+    least recently used entries are evicted when the total size exceeds
+    maxsize bytes.
+    """
+
+    def __init__(self, dir, maxsize):
+        self.dir = dir
+        self.maxsize = maxsize
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, path):
+        return CACHEABLE_PATH_RE.match(path) is not None
+
+    def _filename(self, user, url):
+        key = hashlib.md5(('%s %s' % (user, url)).encode('utf-8')).hexdigest()
+        return os.path.join(self.dir, key)
+
+    def _read_meta(self, fname):
+        with open(fname, 'rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
+
+    def lookup(self, user, url):
+        """
+        Returns the conditional request headers for url or an empty dict
+        if url is not cached.
+        """
+        try:
+            meta = self._read_meta(self._filename(user, url))
+        except (IOError, OSError, ValueError):
+            return {}
+        if meta.get('url') != url:
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def response(self, user, url):
+        """
+        Returns the cached response for url (after the server answered
+        with 304) or None if the entry vanished in the meantime.
+        """
+        fname = self._filename(user, url)
+        try:
+            with open(fname, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+            # mark as recently used
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError):
+            return None
+        self.hits += 1
+        return make_response(body, meta['headers'], url)
+
+    def store(self, user, url, path, resp):
+        """
+        Returns a response object which writes the body of resp into the
+        cache while it is read. resp itself is returned if it has no
+        validators.
+        """
+        info = resp.info()
+        etag = info.get('ETag')
+        last_modified = info.get('Last-Modified')
+        if not etag and not last_modified:
+            return resp
+        headers = dict((k, info.get(k)) for k in CACHED_HEADERS if info.get(k))
+        meta = {'url': url, 'path': path, 'etag': etag,
+                'last_modified': last_modified, 'headers': headers}
+        try:
+            if not os.path.isdir(self.dir):
+                os.makedirs(self.dir, 0o700)
+            fd, tmpname = tempfile.mkstemp(prefix='.', dir=self.dir)
+        except (IOError, OSError):
+            return resp
+        f = os.fdopen(fd, 'wb')
+        f.write(json.dumps(meta).encode('utf-8') + b'\n')
+        cl = info.get('Content-Length')
+        cl = int(cl.split(',')[0]) if cl else None
+        if info.get('Content-Encoding'):
+            # Content-Length is the size of the encoded body
+            cl = None
+        fp = CachingResponseFile(resp, f, tmpname, self._filename(user, url), cl, self)
+        new_resp = addinfourl(fp, info, resp.geturl())
+        new_resp.code = resp.code
+        new_resp.msg = resp.msg
+        return new_resp
+
+    def invalidate(self, path):
+        """drop all entries whose path overlaps with path"""
+        for fname in self._entries():
+            try:
+                meta = self._read_meta(fname)
+                if paths_overlap(meta.get('path', ''), path):
+                    os.unlink(fname)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.dir)
+        except OSError:
+            return []
+        return [os.path.join(self.dir, n) for n in names if not n.startswith('.')]
+
+    def evict(self):
+        """remove the least recently used entries until the cache fits into maxsize"""
+        with self._lock:
+            entries = []
+            total = 0
+            for fname in self._entries():
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+                total += st.st_size
+            entries.sort()
+            while entries and total > self.maxsize:
+                _, size, fname = entries.pop(0)
+                try:
+                    os.unlink(fname)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                total -= size
+
+
+class CachingResponseFile:
+    """
+    File-like wrapper which copies everything read from fp into a
+    temporary cache file. Once EOF is reached, the file is renamed to
+    its final name; if fp is closed before EOF, it is discarded.
+    """
+
+    def __init__(self, fp, cachefile, tmpname, fname, length, cache):
+        self.fp = fp
+        self._cachefile = cachefile
+        self._tmpname = tmpname
+        self._fname = fname
+        self._length = length
+        self._written = 0
+        self._cache = cache
+
+    def _write(self, data, eof=False):
+        if self._cachefile is None:
+            return
+        if data:
+            self._cachefile.write(data)
+            self._written += len(data)
+        if eof or self._written == self._length:
+            self._cachefile.close()
+            self._cachefile = None
+            os.rename(self._tmpname, self._fname)
+            self._cache.evict()
+
+    def read(self, *args):
+        data = self.fp.read(*args)
+        # read() without size reads everything
+        self._write(data, not data or not args or args[0] is None or args[0] < 0)
+        return data
+
+    def readline(self, *args):
+        data = self.fp.readline(*args)
+        self._write(data, not data)
+        return data
+
+    def readlines(self, *args):
+        lines = self.fp.readlines(*args)
+        self._write(b''.join(lines), not args)
+        return lines
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def __getattr__(self, name):
+        if name == 'fp':
+            raise AttributeError(name)
+        return getattr(self.fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._cachefile is not None:
+            # incomplete body, do not cache it
+            self._cachefile.close()
+            self._cachefile = None
+            os.unlink(self._tmpname)
+        self.fp.close()
+
+
+class MemoCache:
+    """
+    Keeps the GET responses of metadata documents in memory. A second
+    request for a url which is in flight waits for the response of the
+    first one instead of sending a duplicate request. Entries are
+    dropped when osc changes an overlapping path (and a response which
+    was requested before such a change is not kept).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self._entries = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def is_memoizable(self, path, query=''):
+        if MEMO_PATH_RE.match(path) is None:
+            return False
+        # view=info etc. return (possibly huge) documents which are
+        # parsed while they are streamed
+        return not 'view' in parse_qs(query)
+
+    def begin(self, key):
+        """
+        Returns the memoized response for key (waiting for a concurrent
+        request of key to finish). If None is returned, the caller has to
+        send the request and has to call store() or abort() afterwards.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    path, code, headers, body = entry
+                    return make_response(body, headers, key[-1], code)
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    self._inflight[key] = (threading.Event(), self._generation)
+                    return None
+            inflight[0].wait()
+
+    def store(self, key, path, resp):
+        """
+        Reads the body of resp, memoizes it and returns a new response
+        object for it.
+        """
+        try:
+            body = resp.read()
+        finally:
+            resp.close()
+        info = resp.info()
+        headers = dict((k, info.get(k)) for k in CACHED_HEADERS if info.get(k))
+        with self._lock:
+            event, generation = self._inflight.pop(key, (None, None))
+            if generation == self._generation:
+                self._entries[key] = (path, resp.code, headers, body)
+        if event is not None:
+            event.set()
+        return make_response(body, headers, key[-1], resp.code)
+
+    def abort(self, key):
+        """the request of key failed (or was not memoized)"""
+        with self._lock:
+            event, _ = self._inflight.pop(key, (None, None))
+        if event is not None:
+            event.set()
+
+    def invalidate(self, path):
+        """drop all entries whose path overlaps with path"""
+        with self._lock:
+            self._generation += 1
+            for key, entry in list(self._entries.items()):
+                if paths_overlap(entry[0], path):
+                    del self._entries[key]
+
+
+# vim: sw=4 et
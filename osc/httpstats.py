@@ -0,0 +1,231 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+from __future__ import print_function
+
+"""Per-request statistics of the api traffic
+
+When enabled (osc --http-stats), http_request records the method, url
+template, status, time to first byte, total time and the number of bytes
+sent and received for every request. The records are summarized per
+endpoint at exit and can be dumped as JSON lines for offline analysis.
+"""
+
+import json
+import math
+import sys
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit, parse_qs
+    from urllib.request import addinfourl
+except ImportError:
+    #python 2.x
+    from urlparse import urlsplit, parse_qs
+    from urllib import addinfourl
+
+from . import oschttp
+
+# names of the path components of the api routes, components starting
+# with an underscore (_meta, _result, _history, ...) are kept as they are
+ROUTES = {
+    'source': ('prj', 'pkg', 'file'),
+    'build': ('prj', 'repo', 'arch', 'pkg', 'file'),
+    'published': ('prj', 'repo', 'arch', 'file'),
+    'request': ('id', ),
+    'person': ('user', ),
+    'group': ('group', ),
+    'comments': ('type', 'prj', 'pkg'),
+}
+
+# query parameters which select a different operation of an endpoint
+QUERY_KEYS = ('cmd', 'view')
+
+# the collector of the running osc process (None if disabled)
+collector = None
+
+
+def url_template(path, query=''):
+    """
+    Returns the route of path (relative to the apiurl) with all names
+    replaced by placeholders, e.g. /source/{prj}/{pkg}?cmd=commit.
+    """
+    parts = [p for p in path.split('/') if p]
+    if not parts:
+        return '/'
+    names = ROUTES.get(parts[0], ())
+    template = [parts[0]]
+    for i, part in enumerate(parts[1:]):
+        if part.startswith('_') or i >= len(names):
+            template.append(part)
+        else:
+            template.append('{%s}' % names[i])
+    template = '/' + '/'.join(template)
+    args = parse_qs(query)
+    ops = ['%s=%s' % (k, args[k][0]) for k in QUERY_KEYS if k in args]
+    if ops:
+        template += '?' + '&'.join(ops)
+    return template
+
+
+def percentile(values, p):
+    """nearest-rank percentile of the sorted list values"""
+    if not values:
+        return 0.0
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(k, len(values) - 1))]
+
+
+class RequestStats:
+    """Collects one record (a dict) per http request."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def start(self, method, url, apiurl=None, bytes_out=0):
+        """
+        Returns a new record for a request which is about to be sent.
+        The record is completed with response() and error().
+        """
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if apiurl is not None:
+            path = path[len(urlsplit(apiurl)[2]):]
+            endpoint = url_template(path, query)
+        else:
+            endpoint = '%s://%s%s' % (scheme, netloc, path)
+        rec = {'method': method, 'url': url, 'endpoint': endpoint, 'status': None,
+               'start': time.time(), 'ttfb': None, 'total': None,
+               'bytes_in': 0, 'bytes_out': bytes_out}
+        with self._lock:
+            self.records.append(rec)
+        return rec
+
+    def response(self, rec, resp):
+        """
+        Stores the status of resp in rec and returns a response object
+        which counts the bytes read from resp.
+        """
+        self._finish(rec, resp.code)
+        fp = StatsResponseFile(resp, rec)
+        new_resp = addinfourl(fp, resp.info(), resp.geturl())
+        new_resp.code = resp.code
+        new_resp.msg = resp.msg
+        return new_resp
+
+    def error(self, rec, e):
+        self._finish(rec, getattr(e, 'code', None) or 'error')
+
+    def _finish(self, rec, status):
+        rec['status'] = status
+        rec['ttfb'] = rec['total'] = time.time() - rec['start']
+
+    def summary(self):
+        """
+        Returns a list of (endpoint, count, p50, p95, max, bytes_in,
+        bytes_out) tuples, the endpoints with the highest total time first.
+        """
+        groups = {}
+        for rec in self.records:
+            if rec['total'] is None:
+                continue
+            groups.setdefault('%s %s' % (rec['method'], rec['endpoint']), []).append(rec)
+        rows = []
+        for endpoint, recs in groups.items():
+            times = sorted(rec['total'] for rec in recs)
+            rows.append((endpoint, len(recs), percentile(times, 50), percentile(times, 95), times[-1],
+                         sum(rec['bytes_in'] for rec in recs), sum(rec['bytes_out'] for rec in recs),
+                         sum(times)))
+        rows.sort(key=lambda row: row[-1], reverse=True)
+        return [row[:-1] for row in rows]
+
+    def print_summary(self, fo=None):
+        fo = fo or sys.stderr
+        rows = self.summary()
+        if not rows:
+            return
+        width = max(len('endpoint'), max(len(row[0]) for row in rows))
+        templ = '%%-%ds %%6s %%8s %%8s %%8s %%10s %%10s' % width
+        print(templ % ('endpoint', 'count', 'p50', 'p95', 'max', 'bytes in', 'bytes out'), file=fo)
+        for endpoint, count, p50, p95, tmax, bytes_in, bytes_out in rows:
+            print(templ % (endpoint, count, '%.3fs' % p50, '%.3fs' % p95, '%.3fs' % tmax,
+                           bytes_in, bytes_out), file=fo)
+
+    def dump(self, fname):
+        """write the raw records as JSON lines to fname"""
+        with open(fname, 'w') as f:
+            for rec in self.records:
+                f.write(json.dumps(rec, sort_keys=True) + '\n')
+
+
+class StatsResponseFile:
+    """
+    File-like wrapper which counts the bytes read from fp (the
+    compressed size for gzip/deflate encoded responses) and the time
+    until the body was read.
+    """
+
+    def __init__(self, fp, rec):
+        self.fp = fp
+        self._rec = rec
+
+    def _count(self, size):
+        raw_read = oschttp.raw_bytes_read(self.fp)
+        if raw_read is not None:
+            self._rec['bytes_in'] = raw_read
+        else:
+            self._rec['bytes_in'] += size
+        self._rec['total'] = time.time() - self._rec['start']
+
+    def read(self, *args):
+        data = self.fp.read(*args)
+        self._count(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.fp.readline(*args)
+        self._count(len(data))
+        return data
+
+    def readlines(self, *args):
+        lines = self.fp.readlines(*args)
+        self._count(sum(len(line) for line in lines))
+        return lines
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def __getattr__(self, name):
+        if name == 'fp':
+            raise AttributeError(name)
+        return getattr(self.fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+
+
+def enable():
+    """start collecting request statistics"""
+    global collector
+    if collector is None:
+        collector = RequestStats()
+    return collector
+
+# vim: sw=4 et
@@ -53,18 +53,32 @@ class TextMeter(BaseMeter):
 
 
     def _do_start(self, *args, **kwargs):
+        self.decompressed = None
         BaseMeter._do_start(self, *args, **kwargs)
         self._do_update(0)
 
+    def set_decompressed(self, amount):
+        """
+        amount of decompressed data of a compressed transfer (the
+        amount passed to update() and end() is the compressed size)
+        """
+        self.decompressed = amount
+
+    def _text(self):
+        if self.text is not None:
+            text = self.text
+        else:
+            text = self.basename
+        if getattr(self, 'decompressed', None) is not None:
+            text = '%s (%sB unpacked)' % (text, format_number(self.decompressed))
+        return text
+
     def _do_update(self, amount_read, now=None):
         etime = self.re.elapsed_time()
         fetime = format_time(etime)
         fread = format_number(amount_read)
         #self.size = None
-        if self.text is not None:
-            text = self.text
-        else:
-            text = self.basename
+        text = self._text()
         if self.size is None:
             out = self.unsized_templ % \
                   (text, fread, fetime)
@@ -83,10 +97,7 @@ class TextMeter(BaseMeter):
     def _do_end(self, amount_read, now=None):
         total_time = format_time(self.re.elapsed_time())
         total_size = format_number(amount_read)
-        if self.text is not None:
-            text = self.text
-        else:
-            text = self.basename
+        text = self._text()
         if self.size is None:
             out = self.unsized_templ % \
                   (text, total_size, total_time)
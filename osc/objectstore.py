@@ -0,0 +1,182 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+"""Shared store of the pristine copies of source files
+
+Each package working copy keeps a pristine copy of every file in its
+store directory (.osc). If the object_store_dir option is set, these
+copies are hardlinks (or reflinks, if the filesystem supports them) to
+the objects in this directory, which are named after their md5. Thus
+several working copies of the same package share a single copy of a
+file, and a file whose md5 is already in the object store does not
+have to be downloaded again.
+
+Objects are read-only: a store file is never modified in place, it is
+replaced (see ObjectStore.link). An object which is not hardlinked into
+any working copy is unreferenced and removed by ObjectStore.gc.
+"""
+
+import errno
+import os
+import re
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl which clones the extents of a file (linux, e.g. btrfs and xfs)
+FICLONE = 0x40049409
+
+# temporary files which are older than this many seconds are removed by gc
+STALE_TMP_SECONDS = 24 * 60 * 60
+
+MD5_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _reflink(src, dst):
+    """create dst as a reflink of src (raises IOError/OSError if this is not supported)"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported')
+    with open(src, 'rb') as s:
+        with open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class ObjectStore:
+    """
+    Files in dir, named after their md5 (dir/ab/cdef...).
+    """
+
+    def __init__(self, dir):
+        self.dir = dir
+
+    def path(self, md5):
+        """returns the filename of the object md5 (or None if md5 is no md5)"""
+        if not md5 or not MD5_RE.match(md5):
+            return None
+        return os.path.join(self.dir, md5[:2], md5[2:])
+
+    def has(self, md5):
+        path = self.path(md5)
+        return path is not None and os.path.isfile(path)
+
+    def link(self, md5, filename):
+        """
+        Replaces filename with a link to the object md5 (or a copy of it,
+        if the object store is on another filesystem). Returns False if
+        there is no such object.
+        """
+        path = self.path(md5)
+        if path is None:
+            return False
+        fd, tmpname = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.',
+                                       dir=os.path.dirname(filename))
+        os.close(fd)
+        os.unlink(tmpname)
+        try:
+            try:
+                os.link(path, tmpname)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return False
+                try:
+                    _reflink(path, tmpname)
+                except (IOError, OSError):
+                    shutil.copyfile(path, tmpname)
+            os.rename(tmpname, filename)
+        except (IOError, OSError) as e:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            if e.errno == errno.ENOENT:
+                # removed by a concurrent gc
+                return False
+            raise
+        return True
+
+    def adopt(self, filename, md5):
+        """
+        Adds filename, whose md5 is md5, to the object store. Afterwards
+        filename is a link to the object. filename must not be modified
+        in place anymore.
+        """
+        path = self.path(md5)
+        if path is None:
+            return
+        if os.path.isfile(path) and self.link(md5, filename):
+            return
+        objdir = os.path.dirname(path)
+        if not os.path.isdir(objdir):
+            try:
+                os.makedirs(objdir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        os.chmod(filename, 0o444)
+        try:
+            os.link(filename, path)
+            return
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # added by a concurrent osc process
+                self.link(md5, filename)
+                return
+        # the object store is on another filesystem: it only serves as a
+        # download cache
+        fd, tmpname = tempfile.mkstemp(prefix='.', dir=objdir)
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmpname)
+            os.chmod(tmpname, 0o444)
+            os.rename(tmpname, path)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def objects(self):
+        """yields the filename of each object (and of each temporary file)"""
+        try:
+            subdirs = sorted(os.listdir(self.dir))
+        except OSError:
+            return
+        for subdir in subdirs:
+            subdir = os.path.join(self.dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in sorted(os.listdir(subdir)):
+                yield os.path.join(subdir, name)
+
+    def gc(self, dry_run=False):
+        """
+        Removes the objects which are not linked into any working copy.
+        Returns a list of (filename, size) tuples of the removed objects.
+        """
+        removed = []
+        now = time.time()
+        for path in self.objects():
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if os.path.basename(path).startswith('.'):
+                # temporary file of a (maybe still running) adopt
+                if now - st.st_mtime < STALE_TMP_SECONDS:
+                    continue
+            elif st.st_nlink > 1:
+                continue
+            if not dry_run:
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+            removed.append((path, st.st_size))
+        return removed
+
+# vim: sw=4 et
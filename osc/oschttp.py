@@ -0,0 +1,827 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+from __future__ import print_function
+
+"""HTTP transport helpers for osc
+
+This module provides urllib2 handlers which keep HTTP/1.1 connections to
+the api server open and reuse them for subsequent requests instead of
+doing a new TCP (and SSL) handshake for every single API call, which
+send the Basic auth credentials without waiting for a 401 challenge and
+which transparently decompress gzip/deflate encoded responses. It also
+contains the retry policy, the circuit breaker, the streaming file
+uploads and the cookie jar used by core.http_request.
+"""
+
+import base64
+import email.utils
+import errno
+import io
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+try:
+    from http.cookiejar import LWPCookieJar
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine
+    from urllib.error import URLError
+    from urllib.request import AbstractBasicAuthHandler, BaseHandler, HTTPHandler, HTTPSHandler, addinfourl
+except ImportError:
+    #python 2.x
+    from cookielib import LWPCookieJar
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine
+    from urllib2 import URLError, AbstractBasicAuthHandler, BaseHandler, HTTPHandler, HTTPSHandler
+    from urllib import addinfourl
+
+# methods which can be resent safely if the server closed the connection
+# before sending a response
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+# content encodings which are decoded by ContentDecodingProcessor
+DECODED_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+# the server did not process the request, it can be retried with any method
+RETRY_ANY_CODES = (429, 503)
+# a proxy gave up waiting for the server, only idempotent requests are retried
+RETRY_IDEMPOTENT_CODES = (502, 504)
+# connection errors after which nothing was sent to the server
+RETRY_ANY_ERRNOS = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+# connection errors after which the request might have been processed
+RETRY_IDEMPOTENT_ERRNOS = (errno.ECONNRESET, errno.ETIMEDOUT, errno.EPIPE)
+
+
+class ConnectionPool:
+    """
+    Keeps idle persistent connections, grouped by a key which
+    identifies the remote end (connection class, host, tunnel host).
+    At most maxsize idle connections are kept per key and connections
+    which were idle for more than timeout seconds are discarded (most
+    likely the server has closed them already).
+    """
+
+    def __init__(self, maxsize=4, timeout=30):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return an idle connection for key or None"""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used > self.timeout:
+                    conn.close()
+                    continue
+                self.reused += 1
+                return conn
+        return None
+
+    def new(self, connect, host):
+        """create a new connection to host by calling connect(host)"""
+        conn = connect(host)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def put(self, key, conn):
+        """give a connection back to the pool"""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self.maxsize:
+                conn.close()
+                return
+            idle.append((conn, time.time()))
+
+    def close(self):
+        """close all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle = {}
+
+
+class PooledResponseFile:
+    """
+    File-like wrapper around a HTTP response. Once the response body
+    was completely read, the underlying connection is given back to
+    the pool. If the response is closed before EOF, the connection is
+    closed, because it still has unread data pending.
+    """
+
+    def __init__(self, fp, response, release, discard):
+        self.fp = fp
+        self._response = response
+        self._release = release
+        self._discard = discard
+        # responses without a body (or which nobody reads) should not
+        # keep the connection busy
+        self._check_eof()
+
+    def _check_eof(self):
+        if self._release is None:
+            return
+        r = self._response
+        if not r.isclosed() and not r.chunked and r.length == 0:
+            # readline does not close the response when the body
+            # is exhausted
+            r.close()
+        if r.isclosed():
+            release = self._release
+            self._release = self._discard = None
+            release()
+
+    def read(self, *args):
+        data = self.fp.read(*args)
+        self._check_eof()
+        return data
+
+    def readline(self, *args):
+        data = self.fp.readline(*args)
+        self._check_eof()
+        return data
+
+    def readlines(self, *args):
+        data = self.fp.readlines(*args)
+        self._check_eof()
+        return data
+
+    def readinto(self, b):
+        n = self.fp.readinto(b)
+        self._check_eof()
+        return n
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def __getattr__(self, name):
+        if name == 'fp':
+            raise AttributeError(name)
+        return getattr(self.fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def close(self):
+        self._check_eof()
+        if self._discard is not None:
+            discard = self._discard
+            self._release = self._discard = None
+            discard()
+        self.fp.close()
+
+
+class KeepAliveHandlerMixin:
+    """
+    Implements the actual request handling for the keep-alive handlers.
+    Subclasses have to set the pool attribute and call keepalive_open
+    with a callable which creates a new connection for a given host.
+    """
+
+    pool = None
+
+    def after_request(self, conn):
+        """called after the request was sent on conn"""
+        pass
+
+    def keepalive_open(self, req, connect):
+        host = req.host
+        if not host:
+            raise URLError('no host given')
+        selector = getattr(req, 'selector', None) or req.get_selector()
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (self.__class__.__name__, host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if tunnel_host:
+            proxy_auth_hdr = 'Proxy-Authorization'
+            if proxy_auth_hdr in headers:
+                tunnel_headers[proxy_auth_hdr] = headers.pop(proxy_auth_hdr)
+
+        method = req.get_method()
+        while True:
+            conn = self.pool.get(key)
+            reused = conn is not None
+            if conn is None:
+                conn = self.pool.new(connect, host)
+                conn.set_debuglevel(self._debuglevel)
+                if tunnel_host:
+                    conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            if self._debuglevel:
+                print('connection to %s %s (%d reused, %d new)'
+                      % (host, 'reused' if reused else 'opened',
+                         self.pool.reused, self.pool.created), file=sys.stderr)
+            try:
+                conn.request(method, selector, req.data, headers)
+            except socket.error as e:
+                conn.close()
+                if reused and e.errno in (errno.EPIPE, errno.ECONNRESET):
+                    # the server closed the idle connection before the request
+                    # was sent, so it can be resent on a fresh connection
+                    self._debug_reconnect(host, e)
+                    continue
+                raise URLError(e)
+            self.after_request(conn)
+            try:
+                r = conn.getresponse()
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                if reused and _no_response(e) and method in IDEMPOTENT_METHODS:
+                    # the server closed the connection without sending
+                    # a response, resending is only safe for idempotent
+                    # methods (a POST may have been processed already)
+                    self._debug_reconnect(host, e)
+                    continue
+                if isinstance(e, socket.error):
+                    raise URLError(e)
+                raise
+            break
+
+        def release():
+            if r.will_close:
+                conn.close()
+            else:
+                self.pool.put(key, conn)
+
+        if sys.version_info < (3, 0):
+            # httplib's HTTPResponse has no readline method
+            r.recv = r.read
+            fp = socket._fileobject(r, close=True)
+        else:
+            fp = r
+        fp = PooledResponseFile(fp, r, release, conn.close)
+        resp = addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+    def _debug_reconnect(self, host, e):
+        if self._debuglevel:
+            print('reused connection to %s failed (%s), reconnecting'
+                  % (host, e), file=sys.stderr)
+
+
+def _no_response(e):
+    """True if e signals that the server sent no response at all"""
+    if isinstance(e, socket.error) and e.errno == errno.ECONNRESET:
+        # reset while waiting for the status line
+        return True
+    # BadStatusLine stores repr('') if the status line was empty (python
+    # 2.7.16 and later use a descriptive message instead)
+    return isinstance(e, BadStatusLine) \
+        and (e.line in ('', repr('')) or e.line.startswith('No status line received'))
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, HTTPHandler):
+
+    def __init__(self, pool, debuglevel=0):
+        HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.keepalive_open(req, lambda host: HTTPConnection(host, timeout=req.timeout))
+
+
+class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, HTTPSHandler):
+
+    def __init__(self, pool, debuglevel=0, context=None):
+        if context is not None:
+            HTTPSHandler.__init__(self, debuglevel, context=context)
+        else:
+            HTTPSHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def https_open(self, req):
+        kwargs = {}
+        if getattr(self, '_context', None) is not None:
+            kwargs['context'] = self._context
+        return self.keepalive_open(req, lambda host: HTTPSConnection(host, timeout=req.timeout, **kwargs))
+
+class PreemptiveBasicAuthMixin:
+    """
+    Mixin for HTTPBasicAuthHandler classes which sends the credentials
+    with the first request instead of waiting for the server's 401
+    challenge (which costs an additional round-trip for every request).
+    If the request already carries a (session) cookie, no credentials
+    are sent: in case the session expired, the server's challenge is
+    answered as usual.
+    """
+
+    # run after the HTTPCookieProcessor added the cookies
+    handler_order = 600
+    debug = False
+    # number of authenticated requests (by preemptive credentials or by
+    # a session cookie) which were not answered with a 401 challenge
+    unchallenged_requests = 0
+    # the handler is shared by the threads of concurrent transfers
+    _stats_lock = threading.Lock()
+
+    def http_request(self, req):
+        base = getattr(AbstractBasicAuthHandler, 'http_request', None)
+        if base is not None:
+            req = base(self, req)
+        user, pw = self.passwd.find_user_password(None, req.get_full_url())
+        if pw is None:
+            return req
+        # known apiurl: without the session cookie or credentials the
+        # server would challenge this request
+        req.osc_authenticated = True
+        if req.has_header('Cookie') or req.has_header(self.auth_header):
+            return req
+        raw = '%s:%s' % (user, pw)
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8')
+        auth = 'Basic %s' % base64.b64encode(raw).decode('ascii').strip()
+        req.add_unredirected_header(self.auth_header, auth)
+        return req
+
+    def http_response(self, req, response):
+        base = getattr(AbstractBasicAuthHandler, 'http_response', None)
+        if base is not None:
+            response = base(self, req, response)
+        if getattr(req, 'osc_authenticated', False) and response.code != 401:
+            with self._stats_lock:
+                self.unchallenged_requests += 1
+                unchallenged = self.unchallenged_requests
+            if self.debug:
+                print('auth: %d requests needed no 401 challenge round-trip'
+                      % unchallenged, file=sys.stderr)
+        return response
+
+    https_request = http_request
+    https_response = http_response
+
+class _DecodedStream(io.RawIOBase):
+    """raw stream of the decompressed data of a DecodingResponseFile"""
+
+    def __init__(self, decoder):
+        io.RawIOBase.__init__(self)
+        self._decoder = decoder
+        # decompressed chunk which is not completely read yet
+        self._chunk = b''
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            self._chunk = self._decoder._next_chunk()
+            self._pos = 0
+            if self._chunk is None:
+                self._chunk = b''
+                return 0
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class DecodingResponseFile:
+    """
+    File-like wrapper which decompresses a gzip or deflate encoded
+    response while it is read. raw_read is the number of (compressed)
+    bytes read from the response so far.
+    """
+
+    def __init__(self, fp, encoding, bufsize=65536):
+        self.fp = fp
+        self.bufsize = bufsize
+        self.raw_read = 0
+        self._deflate = encoding == 'deflate'
+        if self._deflate:
+            self._decomp = zlib.decompressobj()
+        else:
+            self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._eof = False
+        # the buffered reader implements read and readline in linear time
+        self._reader = io.BufferedReader(_DecodedStream(self), bufsize)
+
+    def _decompress(self, raw):
+        try:
+            return self._decomp.decompress(raw)
+        except zlib.error:
+            if not self._deflate or self.raw_read != len(raw):
+                raise
+            # some servers send a raw deflate stream without zlib header
+            self._decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._deflate = False
+            return self._decomp.decompress(raw)
+
+    def _next_chunk(self):
+        """returns the next decompressed chunk (None at EOF)"""
+        while not self._eof:
+            raw = self.fp.read(self.bufsize)
+            if not raw:
+                self._eof = True
+                return self._decomp.flush() or None
+            self.raw_read += len(raw)
+            data = self._decompress(raw)
+            if data:
+                return data
+        return None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._reader.read()
+        return self._reader.read(size)
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        return self._reader.readline(size)
+
+    def readlines(self, hint=-1):
+        if hint is None:
+            hint = -1
+        return self._reader.readlines(hint)
+
+    def __iter__(self):
+        return iter(self._reader)
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def __getattr__(self, name):
+        if name == 'fp':
+            raise AttributeError(name)
+        return getattr(self.fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+
+
+class ContentDecodingProcessor(BaseHandler):
+    """
+    Asks the server for gzip/deflate compressed responses and decodes
+    them. The Content-Encoding and Content-Length headers of the
+    response are kept, so Content-Length refers to the compressed size
+    (see raw_bytes_read).
+    """
+
+    def http_request(self, req):
+        if not req.has_header('Accept-encoding'):
+            req.add_unredirected_header('Accept-Encoding', 'gzip, deflate')
+        return req
+
+    def http_response(self, req, resp):
+        encoding = (resp.info().get('Content-Encoding') or '').strip().lower()
+        if encoding not in DECODED_ENCODINGS:
+            return resp
+        new_resp = addinfourl(DecodingResponseFile(resp, encoding), resp.info(), resp.geturl())
+        new_resp.code = resp.code
+        new_resp.msg = resp.msg
+        return new_resp
+
+    https_request = http_request
+    https_response = http_response
+
+
+class UploadFile:
+    """
+    Request body which streams the file filename instead of reading it
+    into memory. httplib sends it in fixed-size blocks; the number of
+    bytes sent is reported to progress_obj (a meter.TextMeter). The
+    body is rewound with seek(0) if the request has to be resent.
+    """
+
+    def __init__(self, filename, progress_obj=None):
+        self.name = filename
+        self.size = os.path.getsize(filename)
+        self.progress_obj = progress_obj
+        self._f = open(filename, 'rb')
+        self._sent = 0
+        self._started = self._finished = False
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._sent += len(data)
+        if self.progress_obj and not self._finished:
+            if not self._started:
+                self.progress_obj.start(basename=os.path.basename(self.name), size=self.size)
+                self._started = True
+            if data and self._sent < self.size:
+                self.progress_obj.update(self._sent)
+            else:
+                self.progress_obj.end(self._sent)
+                self._finished = True
+        return data
+
+    def seek(self, offset, whence=0):
+        self._f.seek(offset, whence)
+        self._sent = self._f.tell()
+        self._started = self._finished = False
+
+    def close(self):
+        self._f.close()
+
+
+class TransferProgress:
+    """
+    Reports several concurrent transfers of size bytes in total (None if
+    the total is not known) as a single transfer to progress_obj (a
+    meter.TextMeter). file() returns the meter of one transfer, which can
+    be passed to an UploadFile or to core.streamfile.
+    """
+
+    class FileMeter:
+        def __init__(self, parent):
+            self.parent = parent
+            self.amount = 0
+
+        def start(self, *args, **kwargs):
+            # the file is (re)sent from the start
+            self.update(0)
+
+        def update(self, amount_read, now=None):
+            self.parent._add(amount_read - self.amount)
+            self.amount = amount_read
+
+        end = update
+
+    def __init__(self, progress_obj, size, text):
+        self.progress_obj = progress_obj
+        self.size = size
+        self.sent = 0
+        self._lock = threading.Lock()
+        self.progress_obj.start(text=text, size=size)
+
+    def file(self):
+        return TransferProgress.FileMeter(self)
+
+    def _add(self, amount):
+        with self._lock:
+            self.sent += amount
+            if amount and (self.size is None or self.sent < self.size):
+                self.progress_obj.update(self.sent)
+
+    def end(self):
+        with self._lock:
+            self.progress_obj.end(self.sent)
+
+
+def raw_bytes_read(f):
+    """
+    Returns the number of compressed bytes read from the decoded
+    response f (or None if f is not decoded).
+    """
+    while f is not None:
+        if isinstance(f, DecodingResponseFile):
+            return f.raw_read
+        f = getattr(f, 'fp', None)
+    return None
+
+class CircuitOpenError(URLError):
+    """
+    Raised instead of sending a request while the circuit breaker of the
+    api server is open.
+    """
+
+
+def parse_retry_after(value, now=None):
+    """
+    Returns the delay in seconds of a Retry-After header value (either
+    a number of seconds or a HTTP date) or None if it is invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, email.utils.mktime_tz(date) - now)
+
+
+class RetryPolicy:
+    """
+    Decides if a failed request is retried and how long to wait before
+    the next attempt. At most retries attempts are retried; the delay
+    grows exponentially from delay up to max_delay seconds and is
+    jittered so that parallel clients do not retry in lockstep. A delay
+    requested by the server with Retry-After is honoured unless it is
+    longer than max_delay, in which case the request is not retried.
+    """
+
+    def __init__(self, retries=3, delay=1.0, max_delay=30.0):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, method, e):
+        """true if the request can be retried after the exception e"""
+        if isinstance(e, CircuitOpenError):
+            return False
+        code = getattr(e, 'code', None)
+        if code is not None:
+            return code in RETRY_ANY_CODES or \
+                (code in RETRY_IDEMPOTENT_CODES and method in IDEMPOTENT_METHODS)
+        reason = getattr(e, 'reason', e)
+        if isinstance(reason, socket.timeout) or isinstance(e, HTTPException):
+            return method in IDEMPOTENT_METHODS
+        err = getattr(reason, 'errno', None)
+        return err in RETRY_ANY_ERRNOS or \
+            (err in RETRY_IDEMPOTENT_ERRNOS and method in IDEMPOTENT_METHODS)
+
+    def is_server_failure(self, e):
+        """true if e indicates that the server is down or overloaded"""
+        code = getattr(e, 'code', None)
+        if code is not None:
+            return code >= 500
+        return not isinstance(e, CircuitOpenError)
+
+    def get_delay(self, attempt, e=None):
+        """
+        Returns the number of seconds to wait before attempt (starting
+        with 1) or None if the request should not be retried.
+        """
+        if attempt > self.retries:
+            return None
+        headers = e.info() if hasattr(e, 'info') else None
+        if headers is not None:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is not None:
+                if retry_after > self.max_delay:
+                    return None
+                return retry_after
+        delay = min(self.max_delay, self.delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2.0, delay)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive server failures. After threshold failures the
+    circuit is opened and check() fails fast for timeout seconds. Then
+    a single request is let through: if it succeeds the circuit is
+    closed again, otherwise it stays open for another timeout seconds.
+    """
+
+    def __init__(self, threshold=5, timeout=60):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def check(self, url):
+        with self._lock:
+            if self.opened is None:
+                return
+            remaining = self.opened + self.timeout - time.time()
+            if remaining > 0:
+                raise CircuitOpenError('%d consecutive failures, not contacting the server for %d seconds (%s)'
+                                       % (self.failures, remaining, url))
+            # half open: let one request through
+            self.opened = time.time()
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+
+
+class PersistentCookieJar(LWPCookieJar):
+    """
+    LWPCookieJar which is written by flush() instead of after every
+    request: only if cookies were changed and at most every
+    flush_interval seconds (unless forced, e.g. at exit). The file is
+    replaced atomically and cookies which were saved by other osc
+    processes in the meantime are merged into it.
+    """
+
+    def __init__(self, filename, flush_interval=60):
+        LWPCookieJar.__init__(self, filename)
+        self.flush_interval = flush_interval
+        self.saves = 0
+        self._dirty = False
+        # cookies of other processes are dropped after a full clear()
+        self._replace = False
+        self._removed = set()
+        self._last_flush = time.time()
+        self._flush_lock = threading.Lock()
+
+    def load(self, *args, **kwargs):
+        LWPCookieJar.load(self, *args, **kwargs)
+        self._dirty = False
+
+    def set_cookie(self, cookie):
+        LWPCookieJar.set_cookie(self, cookie)
+        self._removed.discard((cookie.domain, cookie.path, cookie.name))
+        self._dirty = True
+
+    def clear(self, domain=None, path=None, name=None):
+        LWPCookieJar.clear(self, domain, path, name)
+        if name is None:
+            self._replace = True
+        else:
+            self._removed.add((domain, path, name))
+        self._dirty = True
+
+    def flush(self, force=False):
+        """write the changed cookies (see class documentation)"""
+        if not self._dirty:
+            return
+        if not force and time.time() - self._last_flush < self.flush_interval:
+            return
+        with self._flush_lock:
+            lockfd = None
+            if fcntl is not None:
+                lockfd = os.open(self.filename + '.lock', os.O_CREAT | os.O_WRONLY, 0o600)
+                fcntl.flock(lockfd, fcntl.LOCK_EX)
+            try:
+                self._dirty = False
+                self._write()
+            except:
+                self._dirty = True
+                raise
+            finally:
+                if lockfd is not None:
+                    os.close(lockfd)
+            self._replace = False
+            self._removed = set()
+            self._last_flush = time.time()
+            self.saves += 1
+
+    def _write(self):
+        jar = LWPCookieJar(self.filename)
+        if not self._replace:
+            try:
+                jar.load(ignore_discard=True)
+            except (IOError, OSError):
+                pass
+            for key in self._removed:
+                try:
+                    jar.clear(*key)
+                except KeyError:
+                    pass
+        with self._cookies_lock:
+            cookies = list(self)
+        for cookie in cookies:
+            jar.set_cookie(cookie)
+        fd, tmpname = tempfile.mkstemp(prefix='.', dir=os.path.dirname(self.filename) or '.')
+        os.close(fd)
+        try:
+            jar.save(tmpname, ignore_discard=True)
+            os.rename(tmpname, self.filename)
+        except:
+            os.unlink(tmpname)
+            raise
+
+# vim: sw=4 et
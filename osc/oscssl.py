@@ -24,6 +24,7 @@ except ImportError:
     from httplib import HTTPSConnection
 
 from .core import raw_input
+from .oschttp import KeepAliveHandlerMixin
 
 class TrustedCertStore:
     _tmptrusted = {}
@@ -172,14 +173,26 @@ class mySSLContext(SSL.Context):
         #self.set_info_callback() # debug
         self.set_verify(SSL.verify_peer | SSL.verify_fail_if_no_peer_cert, depth=9, callback=lambda ok, store: verify_cb(self, ok, store))
 
-class myHTTPSHandler(M2Crypto.m2urllib2.HTTPSHandler):
+class myHTTPSHandler(KeepAliveHandlerMixin, M2Crypto.m2urllib2.HTTPSHandler):
     handler_order = 499
     saved_session = None
 
     def __init__(self, *args, **kwargs):
         self.appname = kwargs.pop('appname', 'generic')
+        self.pool = kwargs.pop('pool', None)
         M2Crypto.m2urllib2.HTTPSHandler.__init__(self, *args, **kwargs)
 
+    def _connect(self, host):
+        h = myHTTPSConnection(host = host, appname = self.appname, ssl_context = self.ctx)
+        if self.saved_session:
+            h.set_session(self.saved_session)
+        return h
+
+    def after_request(self, conn):
+        s = conn.get_session()
+        if s:
+            self.saved_session = s
+
     # copied from M2Crypto.m2urllib2.HTTPSHandler
     # it's sole purpose is to use our myHTTPSHandler/myHTTPSProxyHandler class
     # ideally the m2urllib2.HTTPSHandler.https_open() method would be split into
@@ -195,6 +208,10 @@ class myHTTPSHandler(M2Crypto.m2urllib2.HTTPSHandler):
         full_url = req.get_full_url()
         target_host = urlparse(full_url)[1]
 
+        if target_host == host and self.pool is not None:
+            # direct connection: use a persistent connection from the pool
+            return self.keepalive_open(req, self._connect)
+
         if (target_host != host):
             h = myProxyHTTPSConnection(host = host, appname = self.appname, ssl_context = self.ctx)
             # M2Crypto.ProxyHTTPSConnection.putrequest expects a fullurl
@@ -0,0 +1,360 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+"""hdrmd5 index, usage log and eviction of the package cache
+
+Before a build, each cached dependency is verified against the hdrmd5
+of the buildinfo: the header of an rpm is parsed, a container is hashed
+completely. The index keeps the hdrmd5 of each file in the package
+cache together with its inode, size and mtime, so only files whose stat
+information changed are verified again.
+
+Files are only added to the package cache by Fetcher.move_package,
+which renames them into place (a replaced file has a new inode) and
+records their hdrmd5. The index is shared by all osc processes which use
+the cache: its entries are merged with the ones on disk when it is
+saved.
+
+Fetcher.run logs the last use of each build dependency (and the cache
+hits and misses) in the usage file. PackageCache evicts the least
+recently used packages if the cache exceeds packagecache_max_size or
+if they were not used for packagecache_max_age days. The index, the
+usage file and the eviction are serialized by a lock file, so several
+osc processes can share the cache.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import conf
+from .core import dgst
+from .statcache import _ns
+
+# name of the index in the package cache directory
+INDEX_FILE = '.hdrmd5_index'
+
+# last use of each cached package and the hit/miss counters
+USAGE_FILE = '.usage'
+
+LOCK_FILE = '.lock'
+
+# packages which were used less than this many seconds ago (e.g. by a
+# build which is still running) are not evicted
+MIN_EVICT_SECONDS = 60 * 60
+
+# indexes with unsaved entries, saved at exit
+_dirty_indexes = set()
+
+
+@contextlib.contextmanager
+def locked(cachedir):
+    """exclusive lock of the package cache (a no-op if it is read-only)"""
+    lockfd = None
+    if fcntl is not None:
+        try:
+            # flock does not need write access, so other users of a
+            # shared cache can lock it as well
+            lockfd = os.open(os.path.join(cachedir, LOCK_FILE), os.O_CREAT | os.O_RDONLY, 0o644)
+        except (IOError, OSError):
+            pass
+        else:
+            fcntl.flock(lockfd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        if lockfd is not None:
+            os.close(lockfd)
+
+
+def _read_json(fname):
+    try:
+        with open(fname, 'r') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+
+def _write_json(fname, data):
+    try:
+        fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(fname) + '.',
+                                       dir=os.path.dirname(fname))
+    except (IOError, OSError):
+        # read-only package cache
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, fname)
+    except (IOError, OSError):
+        os.unlink(tmpname)
+
+
+def stat_key(st):
+    """the stat information which is compared with the index entry"""
+    return [st.st_ino, st.st_size, _ns(st, 'st_mtime')]
+
+
+def query_hdrmd5(fullfilename, is_container=False):
+    """returns the hdrmd5 of a package (the md5 of a container)"""
+    if is_container:
+        return dgst(fullfilename)
+    from .util import packagequery
+    return packagequery.PackageQuery.queryhdrmd5(fullfilename)
+
+
+class Hdrmd5Index:
+    """
+    hdrmd5 of the files in cachedir. If verify is True, the entries
+    which were not verified by this process are not used.
+    """
+
+    def __init__(self, cachedir, verify=False):
+        self.cachedir = cachedir
+        self.fname = os.path.join(cachedir, INDEX_FILE)
+        self.verify = verify
+        self.hits = 0
+        self._entries = None
+        # path -> entry (None if the entry was removed) which is merged
+        # into the index on disk
+        self._changed = {}
+        # paths whose hdrmd5 was queried by this process
+        self._verified = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = _read_json(self.fname)
+        return self._entries
+
+    def _path(self, fullfilename):
+        return os.path.relpath(fullfilename, self.cachedir)
+
+    def hdrmd5(self, fullfilename, is_container=False):
+        """
+        Returns the hdrmd5 of the cached file fullfilename (None if it
+        has no rpm header). Only files which are not in the index (or
+        changed) are queried.
+        """
+        path = self._path(fullfilename)
+        key = stat_key(os.stat(fullfilename))
+        with self._lock:
+            entry = self._load().get(path)
+            if entry is not None and entry[:-1] == key and \
+                    (not self.verify or path in self._verified):
+                self.hits += 1
+                return entry[-1]
+        return self.record(fullfilename, is_container)
+
+    def record(self, fullfilename, is_container=False):
+        """queries the hdrmd5 of fullfilename and adds it to the index"""
+        path = self._path(fullfilename)
+        key = stat_key(os.stat(fullfilename))
+        value = query_hdrmd5(fullfilename, is_container)
+        with self._lock:
+            entries = self._load()
+            self._verified.add(path)
+            if value:
+                entries[path] = self._changed[path] = key + [value]
+            elif path in entries:
+                del entries[path]
+                self._changed[path] = None
+            _dirty_indexes.add(self)
+        return value
+
+    def forget(self, fullfilename):
+        """removes the entry of fullfilename (the file was removed)"""
+        path = self._path(fullfilename)
+        with self._lock:
+            self._load().pop(path, None)
+            self._changed[path] = None
+            self._verified.discard(path)
+            _dirty_indexes.add(self)
+
+    def save(self):
+        """
+        Merges the changed entries into the index on disk. Entries of
+        files which do not exist anymore are dropped.
+        """
+        with self._lock:
+            if self not in _dirty_indexes:
+                return
+            _dirty_indexes.discard(self)
+            with locked(self.cachedir):
+                entries = _read_json(self.fname)
+                for path, entry in self._changed.items():
+                    if entry is None:
+                        entries.pop(path, None)
+                    else:
+                        entries[path] = entry
+                self._changed = {}
+                entries = dict((path, entry) for path, entry in entries.items()
+                               if os.path.exists(os.path.join(self.cachedir, path)))
+                _write_json(self.fname, entries)
+
+
+class PackageCache:
+    """
+    Usage log and eviction of the packages in cachedir. max_size is
+    the maximum size of the cache in bytes, max_age the number of
+    seconds after which an unused package is evicted (0: no limit).
+    """
+
+    def __init__(self, cachedir, max_size=0, max_age=0):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.usage_file = os.path.join(cachedir, USAGE_FILE)
+
+    def _path(self, fullfilename):
+        return os.path.relpath(fullfilename, self.cachedir)
+
+    def record_use(self, fullfilenames, hits=0, misses=0):
+        """logs the use of the cached files fullfilenames by a build"""
+        now = int(time.time())
+        with locked(self.cachedir):
+            usage = _read_json(self.usage_file)
+            used = usage.setdefault('used', {})
+            for fullfilename in fullfilenames:
+                used[self._path(fullfilename)] = now
+            usage['hits'] = usage.get('hits', 0) + hits
+            usage['misses'] = usage.get('misses', 0) + misses
+            _write_json(self.usage_file, usage)
+
+    def usage(self):
+        """returns the usage log (see record_use)"""
+        usage = _read_json(self.usage_file)
+        usage.setdefault('used', {})
+        usage.setdefault('hits', 0)
+        usage.setdefault('misses', 0)
+        return usage
+
+    def files(self, used=None):
+        """
+        Returns a list of (path, size, last use) tuples of the packages
+        in the cache (PROJECT/REPOSITORY/ARCH/...). A package which was
+        (re)downloaded after its last logged use counts as used when it
+        was downloaded (its mtime), e.g. while a build which downloads it
+        has not logged its use yet.
+        """
+        if used is None:
+            used = self.usage()['used']
+        result = []
+        for root, dirs, files in os.walk(self.cachedir):
+            dirs.sort()
+            for name in sorted(files):
+                # temporary files of downloads and of the index files
+                if name.startswith('.'):
+                    continue
+                fname = os.path.join(root, name)
+                path = self._path(fname)
+                if len(path.split(os.sep)) < 4:
+                    # e.g. PROJECT/_pubkey
+                    continue
+                try:
+                    st = os.lstat(fname)
+                except OSError:
+                    continue
+                result.append((path, st.st_size, max(used.get(path, 0), int(st.st_mtime))))
+        return result
+
+    def plan(self, files, now=None):
+        """
+        Returns the files (see files) which are evicted: the packages
+        which were not used within max_age seconds and the least
+        recently used packages until the cache fits into max_size.
+        """
+        now = now or time.time()
+        total = sum(size for _, size, _ in files)
+        evict = []
+        for f in sorted(files, key=lambda f: (f[2], f[0])):
+            path, size, last_use = f
+            if now - last_use < MIN_EVICT_SECONDS:
+                break
+            if not (self.max_age and now - last_use > self.max_age) and \
+                    not (self.max_size and total > self.max_size):
+                break
+            evict.append(f)
+            total -= size
+        return evict
+
+    def stats(self):
+        """
+        Returns a dict with the usage counters, the size and number of
+        the files per (project, repository) and the files which are
+        evicted by prune.
+        """
+        usage = self.usage()
+        files = self.files(usage['used'])
+        repos = {}
+        for path, size, _ in files:
+            key = tuple(path.split(os.sep)[:2])
+            repo_size, count = repos.get(key, (0, 0))
+            repos[key] = (repo_size + size, count + 1)
+        return {'hits': usage['hits'], 'misses': usage['misses'],
+                'size': sum(size for _, size, _ in files), 'files': len(files),
+                'repos': repos, 'evict': self.plan(files)}
+
+    def prune(self, dry_run=False):
+        """evicts the packages (see plan) and returns them"""
+        with locked(self.cachedir):
+            usage = self.usage()
+            files = self.files(usage['used'])
+            evict = self.plan(files)
+            if dry_run:
+                return evict
+            for path, _, _ in evict:
+                try:
+                    os.unlink(os.path.join(self.cachedir, path))
+                except OSError:
+                    pass
+            # the log entries of evicted (or otherwise removed) packages
+            # are dropped
+            kept = set(path for path, _, _ in files) - set(path for path, _, _ in evict)
+            usage['used'] = dict((path, last_use) for path, last_use in usage['used'].items()
+                                 if path in kept)
+            _write_json(self.usage_file, usage)
+            if evict:
+                index_file = os.path.join(self.cachedir, INDEX_FILE)
+                index = _read_json(index_file)
+                for path, _, _ in evict:
+                    index.pop(path, None)
+                _write_json(index_file, index)
+        return evict
+
+
+def get_package_cache(cachedir, max_size=None, max_age=None):
+    """
+    Returns the PackageCache of cachedir. max_size (in MiB) and max_age
+    (in days) default to the packagecache_max_size and
+    packagecache_max_age options.
+    """
+    if max_size is None:
+        max_size = conf.config['packagecache_max_size']
+    if max_age is None:
+        max_age = conf.config['packagecache_max_age']
+    return PackageCache(cachedir, int(max_size) * 1024 * 1024, int(max_age) * 24 * 60 * 60)
+
+
+def _save_all():
+    for index in list(_dirty_indexes):
+        index.save()
+
+atexit.register(_save_all)
+
+# vim: sw=4 et
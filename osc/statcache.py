@@ -0,0 +1,140 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+"""Stat cache of the files in a package working copy
+
+Package.status() compares the md5 of a working copy file with the md5
+which is listed in .osc/_files. Like the git index, the stat cache keeps
+the md5 of each file together with its inode, size, mtime and ctime, so
+only files whose stat information changed are hashed again.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import time
+
+from . import wcindex
+
+# name of the cache in the store directory
+STORE_FILE = '_stat_cache'
+
+# files which were modified less than this many seconds before they were
+# hashed are not cached: a modification within the timestamp granularity
+# of the filesystem would not change their stat information
+RACY_SECONDS = 2
+
+# caches with unsaved entries, saved at exit
+_dirty_caches = set()
+
+
+def _ns(st, name):
+    value = getattr(st, name + '_ns', None)
+    if value is None:
+        # python 2.x
+        value = int(getattr(st, name) * 1000000000)
+    return value
+
+
+def stat_key(st):
+    """the stat information which is compared with the cache entry"""
+    return [st.st_ino, st.st_size, _ns(st, 'st_mtime'), _ns(st, 'st_ctime')]
+
+
+class StatCache:
+    """
+    md5 digests of the files in wcdir, stored in storedir. dgst_files
+    calculates the digests of the files which are not cached (it returns
+    a dict which maps each filename to its digest).
+    """
+
+    def __init__(self, storedir, wcdir, dgst_files):
+        self.fname = os.path.join(storedir, STORE_FILE)
+        self.wcdir = wcdir
+        self.dgst_files = dgst_files
+        self.hits = 0
+        self._entries = None
+        # entries which are only kept in memory (see RACY_SECONDS)
+        self._racy = set()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.fname, 'r') as f:
+                    self._entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def dgst(self, name):
+        """returns the md5 of the working copy file name"""
+        return self.dgst_many([name])[name]
+
+    def dgst_many(self, names):
+        """
+        Returns a dict which maps each of the working copy files names
+        to its md5. The files which are not cached are hashed in one
+        batch.
+        """
+        entries = self._load()
+        result = {}
+        todo = {}
+        now = time.time()
+        for name in names:
+            st = os.stat(os.path.join(self.wcdir, name))
+            key = stat_key(st)
+            entry = entries.get(name)
+            if entry is not None and entry[:-1] == key and \
+                not (name in self._racy and now - st.st_mtime < RACY_SECONDS):
+                self.hits += 1
+                result[name] = entry[-1]
+            else:
+                todo[os.path.join(self.wcdir, name)] = (name, key, st.st_mtime)
+        if not todo:
+            return result
+        for filename, md5 in self.dgst_files(todo.keys()).items():
+            name, key, mtime = todo[filename]
+            entries[name] = key + [md5]
+            result[name] = md5
+            if now - mtime < RACY_SECONDS:
+                self._racy.add(name)
+            else:
+                self._racy.discard(name)
+        _dirty_caches.add(self)
+        return result
+
+    def save(self):
+        """
+        Writes the cache if it was changed. Entries of files which do
+        not exist anymore are dropped.
+        """
+        if self not in _dirty_caches:
+            return
+        _dirty_caches.discard(self)
+        entries = dict((name, entry) for name, entry in self._entries.items()
+                       if not name in self._racy and os.path.exists(os.path.join(self.wcdir, name)))
+        # the stat cache is not part of the working copy index
+        with wcindex.unchanged(os.path.dirname(self.fname)):
+            try:
+                fd, tmpname = tempfile.mkstemp(prefix=STORE_FILE + '.', dir=os.path.dirname(self.fname))
+            except (IOError, OSError):
+                # read-only working copy
+                return
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.rename(tmpname, self.fname)
+            except (IOError, OSError):
+                os.unlink(tmpname)
+
+
+def _save_all():
+    for cache in list(_dirty_caches):
+        cache.save()
+
+atexit.register(_save_all)
+
+# vim: sw=4 et
@@ -0,0 +1,283 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+"""Status daemon for package working copies
+
+"osc status --watch DIR..." runs a StatusDaemon: it watches the given
+package working copies (and the packages of the given project working
+copies) and their stores with inotify, keeps the result of
+Package.get_status in memory until an event invalidates it and answers
+the queries of other osc processes over a unix socket (see query). If
+no daemon is running or it does not watch a working copy, osc status
+scans the working copy itself.
+
+The protocol is a single json line per request and response:
+    {"dir": ABSDIR, "excluded": BOOL} -> {"status": [[STATE, FILENAME], ...]}
+"status" is null if the daemon cannot answer the query.
+"""
+
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import sys
+
+from . import core
+from . import oscerr
+from . import statcache
+from . import wcindex
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT = struct.Struct('iIII')
+
+# store files which are written by get_status itself
+IGNORED_STORE_FILES = (statcache.STORE_FILE, wcindex.INDEX_FILE)
+
+# seconds a client waits for the answer of the daemon
+QUERY_TIMEOUT = 10
+
+
+class Inotify:
+    """minimal inotify(7) binding (raises OSError if it is not available)"""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not supported on this platform')
+        self._ctypes = ctypes
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self, filename=None):
+        err = self._ctypes.get_errno()
+        raise OSError(err, os.strerror(err), filename)
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding()) \
+                                          if not isinstance(path, bytes) else path, mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def read(self):
+        """returns a list of (wd, mask, name) tuples"""
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, name.decode(sys.getfilesystemencoding(), 'replace')))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class StatusDaemon:
+    """
+    Answers status queries for the package working copies in dirs
+    (project working copies stand for their packages).
+    """
+
+    def __init__(self, socket_path, dirs):
+        self.socket_path = socket_path
+        self.inotify = Inotify()
+        # wd -> (package absdir, True if it is the store)
+        self.watches = {}
+        self.packages = set()
+        # (package absdir, excluded) -> status
+        self.cache = {}
+        self.hits = 0
+        for d in dirs:
+            if core.is_project_dir(d):
+                for name in sorted(os.listdir(d)):
+                    if core.is_package_dir(os.path.join(d, name)):
+                        self.watch(os.path.join(d, name))
+            elif core.is_package_dir(d):
+                self.watch(d)
+            else:
+                raise oscerr.NoWorkingCopy('\'%s\' is no working copy' % d)
+        self.sock = self._listen()
+
+    def watch(self, pdir):
+        absdir = os.path.abspath(pdir)
+        self.watches[self.inotify.add_watch(absdir)] = (absdir, False)
+        self.watches[self.inotify.add_watch(os.path.join(absdir, core.store))] = (absdir, True)
+        self.packages.add(absdir)
+
+    def _listen(self):
+        sockdir = os.path.dirname(self.socket_path)
+        if sockdir and not os.path.isdir(sockdir):
+            os.makedirs(sockdir, 0o700)
+        if os.path.exists(self.socket_path):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.socket_path)
+                raise oscerr.OscIOError(None, 'a status daemon is already running (%s)' % self.socket_path)
+            except socket.error:
+                # stale socket
+                os.unlink(self.socket_path)
+            finally:
+                s.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        return sock
+
+    def invalidate(self, absdir):
+        for key in [k for k in self.cache if k[0] == absdir]:
+            del self.cache[key]
+
+    def handle_events(self):
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.cache.clear()
+                continue
+            if not wd in self.watches:
+                continue
+            absdir, is_store = self.watches[wd]
+            if is_store and name.startswith(IGNORED_STORE_FILES):
+                continue
+            self.invalidate(absdir)
+            if mask & IN_IGNORED:
+                # the directory was removed
+                del self.watches[wd]
+                self.packages.discard(absdir)
+
+    def status(self, absdir, excluded):
+        """returns the status of the package absdir or None if it is not watched"""
+        if not absdir in self.packages:
+            return None
+        key = (absdir, excluded)
+        if key in self.cache:
+            self.hits += 1
+            return self.cache[key]
+        try:
+            res = core.Package(absdir).get_status(excluded)
+        except (oscerr.OscBaseError, EnvironmentError):
+            # the client reports the error
+            return None
+        self.cache[key] = res
+        return res
+
+    def handle_client(self, conn):
+        conn.settimeout(QUERY_TIMEOUT)
+        try:
+            f = conn.makefile('rwb')
+            try:
+                req = json.loads(f.readline().decode('utf-8'))
+                # events which arrived while the client was waiting
+                if select.select([self.inotify], [], [], 0)[0]:
+                    self.handle_events()
+                absdir = req.get('dir')
+                if not isinstance(absdir, str):
+                    # python 2.x
+                    absdir = absdir.encode('utf-8')
+                res = self.status(absdir, bool(req.get('excluded')))
+                f.write(json.dumps({'status': res}).encode('utf-8') + b'\n')
+                f.flush()
+            finally:
+                f.close()
+        except (socket.error, ValueError, AttributeError, UnicodeError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        try:
+            while True:
+                r, _, _ = select.select([self.inotify, self.sock], [], [])
+                if self.inotify in r:
+                    self.handle_events()
+                if self.sock in r:
+                    conn, _ = self.sock.accept()
+                    self.handle_client(conn)
+        finally:
+            self.close()
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        self.inotify.close()
+
+
+def query(socket_path, pdir, excluded=False):
+    """
+    Returns the status of the package working copy pdir (a list of
+    (state, filename) tuples, like Package.get_status) from the status
+    daemon or None if no daemon answers.
+    """
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(QUERY_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+        f = sock.makefile('rwb')
+        try:
+            req = {'dir': os.path.abspath(pdir), 'excluded': excluded}
+            f.write(json.dumps(req).encode('utf-8') + b'\n')
+            f.flush()
+            res = json.loads(f.readline().decode('utf-8'))['status']
+        finally:
+            f.close()
+    except (socket.error, ValueError, KeyError, TypeError, UnicodeError):
+        return None
+    finally:
+        sock.close()
+    if res is None:
+        return None
+    if sys.version_info[0] == 2:
+        return [(st.encode('utf-8'), fname.encode('utf-8')) for st, fname in res]
+    return [(st, fname) for st, fname in res]
+
+
+def get_status(socket_path, p, excluded=False, *exclude_states):
+    """
+    Package.get_status of p, answered by the status daemon if possible.
+    """
+    if not p.todo:
+        res = query(socket_path, p.absdir, excluded)
+        if res is not None:
+            return [(st, fname) for st, fname in res if not st in exclude_states]
+    return p.get_status(excluded, *exclude_states)
+
+# vim: sw=4 et
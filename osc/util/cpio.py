@@ -206,6 +206,110 @@ class CpioRead:
         for h in self.hdrs:
             self._copyin_file(h, dest, h.filename)
 
+class CpioStreamRead:
+    """
+    Reads a cpio archive sequentially from chunks, an iterable of byte
+    strings (e.g. the data of a http response as it is received).
+    Iterating yields the header of each member; the data of the current
+    member can be read with read or copyin_file before the next header is
+    requested (the data which was not read is skipped).
+    Supported formats:
+    * ascii SVR4 no CRC also called "new_ascii"
+    """
+
+    hdr_fmt = CpioRead.hdr_fmt
+    hdr_len = CpioRead.hdr_len
+    bufsize = 1024 * 1024
+
+    def __init__(self, chunks, name='<stream>'):
+        self.filename = name
+        self.__chunks = iter(chunks)
+        self.__buf = b''
+        self.__remaining = 0
+        self.__padding = 0
+
+    def _read(self, size):
+        """returns at most size bytes (b'' at the end of the archive)"""
+        while not self.__buf:
+            data = next(self.__chunks, None)
+            if data is None:
+                return b''
+            self.__buf = data
+        data, self.__buf = self.__buf[:size], self.__buf[size:]
+        return data
+
+    def _read_exactly(self, size):
+        data = []
+        while size:
+            d = self._read(size)
+            if not d:
+                raise CpioError(self.filename, 'unexpected end of archive')
+            data.append(d)
+            size -= len(d)
+        return b''.join(data)
+
+    def __iter__(self):
+        while True:
+            self._skip()
+            data = self._read_exactly(self.hdr_len)
+            fmt = data[:6].decode('ascii', 'replace')
+            if fmt != CpioRead.sfmt['newascii']:
+                raise CpioError(self.filename, '\'%s\' is not a supported cpio format' % fmt)
+            hdr = CpioHdr(*struct.unpack(self.hdr_fmt, data))
+            filename = self._read_exactly(hdr.namesize)[:-1]
+            if not isinstance(filename, str):
+                # python 3.x
+                filename = filename.decode('utf-8', 'surrogateescape')
+            self._read_exactly((4 - ((self.hdr_len + hdr.namesize) % 4)) % 4)
+            if filename == 'TRAILER!!!':
+                # consume the padding (the end of the response)
+                for data in self.__chunks:
+                    pass
+                return
+            hdr.filename = filename
+            self.__remaining = hdr.filesize
+            self.__padding = (4 - (hdr.filesize % 4)) % 4
+            yield hdr
+
+    def _skip(self):
+        while self.__remaining:
+            self.read(self.bufsize)
+        self._read_exactly(self.__padding)
+        self.__padding = 0
+
+    def read(self, size=-1):
+        """reads at most size bytes of the data of the current member"""
+        if size < 0 or size > self.__remaining:
+            size = self.__remaining
+        if not size:
+            return b''
+        if size == self.__remaining:
+            data = self._read_exactly(size)
+        else:
+            data = self._read(size)
+        if not data:
+            raise CpioError(self.filename, 'unexpected end of archive')
+        self.__remaining -= len(data)
+        return data
+
+    def copyin_file(self, hdr, dest=None, new_fn=None):
+        """
+        stores the data of the current member hdr in dest/new_fn (see
+        CpioRead.copyin_file).
+        """
+        if not stat.S_ISREG(stat.S_IFMT(hdr.mode)):
+            msg = '\'%s\' is no regular file - only regular files are supported atm' % hdr.filename
+            raise NotImplementedError(msg)
+        fn = os.path.join(dest or os.getcwd(), new_fn or hdr.filename)
+        with open(fn, 'wb') as f:
+            while True:
+                data = self.read(self.bufsize)
+                if not data:
+                    break
+                f.write(data)
+        os.chmod(fn, stat.S_IMODE(hdr.mode))
+
+
 class CpioWrite:
     """cpio archive small files in memory, using new style portable header format"""
 
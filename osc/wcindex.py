@@ -0,0 +1,178 @@
+# Copyright (C) 2018 SUSE Linux GmbH.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or version 3 (at your option).
+
+"""Index of the metadata files in the store of a working copy
+
+The metadata of a working copy is kept in many small files in its store
+directory (.osc/_files, .osc/_to_be_added, ...). The index is a single
+binary file in the store which contains a snapshot of these files (and
+data derived from them, e.g. the parsed _files), so loading a working
+copy only needs one read.
+
+The metadata files stay the authoritative copy (they are written as
+before and can be read by older osc versions). Each file which is
+added, replaced or removed in the store changes the mtime of the store
+directory and a file which is modified in place changes its own stat
+information, so the index records the mtime of the directory and the
+stat information of the indexed files and is rebuilt if they do not
+match anymore. Like the stat cache (see statcache.RACY_SECONDS), no
+index is written while a file was modified too recently: a further
+modification within the timestamp granularity of the filesystem would
+not change the stat information.
+"""
+
+import contextlib
+import marshal
+import os
+import struct
+import sys
+import tempfile
+import time
+
+# name of the index in the store directory
+INDEX_FILE = '_index'
+
+# magic, format version, python major version (the marshal format
+# differs), mtime (in ns) of the store directory
+HEADER = struct.Struct('>6sBBq')
+MAGIC = b'OSCIDX'
+VERSION = 2
+
+# no index is written if one of the files was modified less than this
+# many seconds ago (see statcache.RACY_SECONDS)
+RACY_SECONDS = 2
+
+
+def _mtime_ns(st):
+    value = getattr(st, 'st_mtime_ns', None)
+    if value is None:
+        # python 2.x
+        value = int(st.st_mtime * 1000000000)
+    return value
+
+
+def _dir_key(storedir):
+    return _mtime_ns(os.stat(storedir))
+
+
+def _file_keys(storedir, names):
+    """the stat information of the store files names (None if a file does not exist)"""
+    keys = []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(storedir, name))
+        except OSError:
+            keys.append(None)
+            continue
+        keys.append((st.st_ino, st.st_size, _mtime_ns(st)))
+    return tuple(keys)
+
+
+def _header(key):
+    return HEADER.pack(MAGIC, VERSION, sys.version_info[0], key)
+
+
+def _load(storedir, names):
+    try:
+        key = _dir_key(storedir)
+        with open(os.path.join(storedir, INDEX_FILE), 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    if data[:HEADER.size] != _header(key):
+        return None
+    try:
+        index = marshal.loads(data[HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(index, tuple) or len(index) != 4 or index[0] != tuple(names):
+        return None
+    if index[3] != _file_keys(storedir, names):
+        # a file was modified in place
+        return None
+    return index
+
+
+def _read_file(storedir, name):
+    try:
+        with open(os.path.join(storedir, name), 'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read(storedir, names, derive=None):
+    """
+    Returns a tuple: a dict which maps each of the store files names to
+    its content (None if the file does not exist) and the result of
+    derive(contents). If the index is out of date, the files are read
+    and the index is written again.
+    """
+    names = tuple(names)
+    index = _load(storedir, names)
+    if index is not None:
+        return dict(zip(names, index[1])), index[2]
+    file_keys = _file_keys(storedir, names)
+    fd = tmpname = None
+    now = time.time()
+    if not [k for k in file_keys if k is not None and now - k[2] / 1e9 < RACY_SECONDS]:
+        try:
+            fd, tmpname = tempfile.mkstemp(prefix=INDEX_FILE + '.', dir=storedir)
+        except (IOError, OSError):
+            # read-only working copy
+            pass
+    try:
+        key = _dir_key(storedir)
+    except OSError:
+        key = None
+    contents = tuple(_read_file(storedir, name) for name in names)
+    derived = derive(dict(zip(names, contents))) if derive is not None else None
+    if tmpname is not None:
+        _save(storedir, fd, tmpname, key, (names, contents, derived, file_keys))
+    return dict(zip(names, contents)), derived
+
+
+def _save(storedir, fd, tmpname, key, index):
+    fname = os.path.join(storedir, INDEX_FILE)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header(0))
+            f.write(marshal.dumps(index, 2))
+        if key is None or _dir_key(storedir) != key:
+            # the store was changed while its files were read
+            os.unlink(tmpname)
+            return
+        os.rename(tmpname, fname)
+        # the rename changed the mtime of the store directory, so it is
+        # recorded afterwards (overwriting the header does not change it)
+        with open(fname, 'r+b') as f:
+            f.write(_header(_dir_key(storedir)))
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+@contextlib.contextmanager
+def unchanged(storedir):
+    """
+    The store files which are added, replaced or removed within this
+    context are not part of the index, so an index which is up to date
+    is kept.
+    """
+    try:
+        key = _dir_key(storedir)
+    except OSError:
+        key = None
+    yield
+    fname = os.path.join(storedir, INDEX_FILE)
+    try:
+        with open(fname, 'r+b') as f:
+            if f.read(HEADER.size) == _header(key):
+                f.seek(0)
+                f.write(_header(_dir_key(storedir)))
+    except (IOError, OSError, struct.error):
+        pass
+
+# vim: sw=4 et
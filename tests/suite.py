@@ -23,6 +23,16 @@ import test_request
 import test_setlinkrev
 import test_prdiff
 import test_conf
+import test_oschttp
+import test_httpcache
+import test_retry
+import test_httpstats
+import test_results
+import test_objectstore
+import test_wcindex
+import test_statusd
+import test_cpio
+import test_pkgcache
 
 suite = unittest.TestSuite()
 suite.addTests(test_addfiles.suite())
@@ -40,6 +50,16 @@ suite.addTests(test_request.suite())
 suite.addTests(test_setlinkrev.suite())
 suite.addTests(test_prdiff.suite())
 suite.addTests(test_conf.suite())
+suite.addTests(test_oschttp.suite())
+suite.addTests(test_httpcache.suite())
+suite.addTests(test_retry.suite())
+suite.addTests(test_httpstats.suite())
+suite.addTests(test_results.suite())
+suite.addTests(test_objectstore.suite())
+suite.addTests(test_wcindex.suite())
+suite.addTests(test_statusd.suite())
+suite.addTests(test_cpio.suite())
+suite.addTests(test_pkgcache.suite())
 
 if have_xmlrunner:
     result = xmlrunner.XMLTestRunner(output=os.path.join(os.getcwd(), 'junit-xml-results')).run(suite)
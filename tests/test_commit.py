@@ -5,10 +5,10 @@ import sys
 from common import GET, PUT, POST, DELETE, OscTestCase
 from xml.etree import cElementTree as ET
 try:
-    from urllib.error import HTTPError
+    from urllib.error import HTTPError, URLError
 except ImportError:
     #python 2.x
-    from urllib2 import HTTPError
+    from urllib2 import HTTPError, URLError
 
 FIXTURES_DIR = os.path.join(os.getcwd(), 'commit_fixtures')
 
@@ -22,6 +22,11 @@ class TestCommit(OscTestCase):
     def _get_fixtures_dir(self):
         return FIXTURES_DIR
 
+    def setUp(self):
+        OscTestCase.setUp(self)
+        # the mocked requests have to be issued in a fixed order
+        osc.core.conf.config['upload_workers'] = '1'
+
     @GET('http://localhost/source/osctest/simple?rev=latest', file='testSimple_filesremote')
     @POST('http://localhost/source/osctest/simple?cmd=getprojectservices',
           exp='', text='<services />')
@@ -45,6 +50,29 @@ class TestCommit(OscTestCase):
         self._check_status(p, 'foo', ' ')
         self._check_status(p, 'merge', ' ')
 
+    @GET('http://localhost/source/osctest/simple?rev=latest', file='testSimple_filesremote')
+    @POST('http://localhost/source/osctest/simple?cmd=getprojectservices',
+          exp='', text='<services />')
+    @POST('http://localhost/source/osctest/simple?comment=&cmd=commitfilelist&user=Admin',
+          file='testSimple_missingfilelist', expfile='testSimple_lfilelist')
+    @PUT('http://localhost/source/osctest/simple/nochange?rev=repository',
+          exp='This file didn\'t change but\nis modified.\n', exception=URLError('connection dropped'))
+    @POST('http://localhost/source/osctest/simple?comment=&cmd=commitfilelist&user=Admin',
+          file='testSimple_missingfilelist', expfile='testSimple_lfilelist')
+    @PUT('http://localhost/source/osctest/simple/nochange?rev=repository',
+          exp='This file didn\'t change but\nis modified.\n', text=rev_dummy)
+    @POST('http://localhost/source/osctest/simple?comment=&cmd=commitfilelist&user=Admin',
+          file='testSimple_cfilesremote', expfile='testSimple_lfilelist')
+    def test_dropped_connection(self):
+        """a file upload is resumed after the connection dropped"""
+        self._change_to_pkg('simple')
+        p = osc.core.Package('.')
+        p.commit()
+        exp = 'Sending    nochange\nTransmitting file data ..\nCommitted revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self._check_digests('testSimple_cfilesremote')
+        self._check_status(p, 'nochange', ' ')
+
     @GET('http://localhost/source/osctest/add?rev=latest', file='testAddfile_filesremote')
     @POST('http://localhost/source/osctest/add?cmd=getprojectservices',
           exp='', text='<services />')
@@ -242,6 +270,20 @@ class TestCommit(OscTestCase):
         self._check_status(p, 'merge', ' ')
         self._check_status(p, 'nochange', ' ')
 
+    @GET('http://localhost/source/osctest/add?rev=latest', file='testAddfile_filesremote')
+    @POST('http://localhost/source/osctest/add?cmd=getprojectservices',
+          exp='', text='<services />')
+    @POST('http://localhost/source/osctest/add?comment=&cmd=commitfilelist&user=Admin',
+          file='testAddfile_cfilesremote', expfile='testAddfile_lfilelist')
+    def test_remoteexists_verbose(self):
+        """the files which are committed by reference are reported"""
+        self._change_to_pkg('add')
+        p = osc.core.Package('.')
+        p.commit(verbose=True)
+        exp = 'Sending    add\nReusing    add\nTransmitting file data \nCommitted revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self._check_status(p, 'add', ' ')
+
     @GET('http://localhost/source/osctest/branch?rev=latest', file='testExpand_filesremote')
     @POST('http://localhost/source/osctest/branch?cmd=getprojectservices',
           exp='', text='<services />')
@@ -312,6 +354,46 @@ class TestCommit(OscTestCase):
         self.assertEqual(sys.stdout.getvalue(), exp)
         self._check_status(p, 'nochange', 'M')
 
+    def test_put_source_files(self):
+        """the files are uploaded concurrently"""
+        import threading
+        self._change_to_pkg('multiple')
+        osc.core.conf.config['upload_workers'] = '3'
+        p = osc.core.Package('.')
+        threads = set()
+        running = []
+        cond = threading.Condition()
+        def put_source_file(n, tdir, md5=None, progress_obj=None):
+            if n == 'add':
+                raise URLError('connection dropped')
+            with cond:
+                threads.add(threading.current_thread())
+                running.append(n)
+                cond.notify_all()
+                # wait until three uploads run at the same time
+                while len(running) < 3:
+                    cond.wait(10)
+        p.put_source_file = put_source_file
+        md5s = dict.fromkeys(['nochange', 'add', 'add2', 'exists'], 'md5')
+        uploaded, error = p.put_source_files(['nochange', 'add', 'add2', 'exists'], self.tmpdir, md5s)
+        self.assertEqual(sorted(uploaded), ['add2', 'exists', 'nochange'])
+        self.assertTrue(isinstance(error, URLError))
+        self.assertEqual(len(threads), 3)
+        self.assertEqual(sys.stdout.getvalue(), '....')
+
+    def test_put_source_files_error(self):
+        """an http error aborts the uploads"""
+        self._change_to_pkg('multiple')
+        osc.core.conf.config['upload_workers'] = '2'
+        p = osc.core.Package('.')
+        def put_source_file(n, tdir, md5=None, progress_obj=None):
+            raise HTTPError('http://localhost', 403, 'forbidden', {}, None)
+        p.put_source_file = put_source_file
+        md5s = dict.fromkeys(['nochange', 'add', 'add2'], 'md5')
+        self.assertRaises(HTTPError, p.put_source_files, ['nochange', 'add', 'add2'], self.tmpdir, md5s)
+        # no upload is started after the first error
+        self.assertTrue(sys.stdout.getvalue() in ('.', '..'))
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
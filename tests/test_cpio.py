@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from osc.util import cpio
+
+def suite():
+    return unittest.makeSuite(TestCpioStreamRead)
+
+def archive(*files):
+    """returns a cpio archive which contains files (name, content tuples)"""
+    w = cpio.CpioWrite()
+    for name, content in files:
+        w.add(name, content)
+    data = w.get()
+    if not isinstance(data, bytes):
+        # python 3.x
+        data = data.encode('latin-1')
+    return data
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+FILES = (('foo.rpm', 'foo' * 1000), ('bar.rpm', ''), ('baz.rpm', 'baz\n'))
+
+class TestCpioStreamRead(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCopyin(self):
+        """the members are extracted while the chunks are read"""
+        data = archive(*FILES)
+        for size in (1, 7, 512):
+            consumed = []
+            def gen():
+                for c in chunks(data, size):
+                    consumed.append(len(c))
+                    yield c
+            archive_ = cpio.CpioStreamRead(gen())
+            names = []
+            for hdr in archive_:
+                if not names:
+                    # the archive was not read completely yet
+                    self.assertTrue(sum(consumed) < len(data))
+                names.append(hdr.filename)
+                archive_.copyin_file(hdr, self.tmpdir, 'x-' + hdr.filename)
+            self.assertEqual(names, [f[0] for f in FILES])
+            # the padding after the trailer was consumed as well
+            self.assertEqual(sum(consumed), len(data))
+            for name, content in FILES:
+                with open(os.path.join(self.tmpdir, 'x-' + name), 'r') as f:
+                    self.assertEqual(f.read(), content)
+
+    def testSkip(self):
+        """members whose data is not read are skipped"""
+        archive_ = cpio.CpioStreamRead(chunks(archive(*FILES), 100))
+        hdrs = list(archive_)
+        self.assertEqual([h.filename for h in hdrs], [f[0] for f in FILES])
+        self.assertEqual([h.filesize for h in hdrs], [3000, 0, 4])
+
+    def testRead(self):
+        archive_ = cpio.CpioStreamRead(chunks(archive(*FILES), 100))
+        hdr = next(iter(archive_))
+        self.assertEqual(archive_.read(10), b'foofoofoof')
+        self.assertEqual(len(archive_.read()), 2990)
+        self.assertEqual(archive_.read(), b'')
+
+    def testTruncated(self):
+        data = archive(*FILES)
+        archive_ = cpio.CpioStreamRead(chunks(data[:2000], 100))
+        hdr = next(iter(archive_))
+        self.assertRaises(cpio.CpioError, archive_.copyin_file, hdr, self.tmpdir)
+        self.assertRaises(cpio.CpioError, list, cpio.CpioStreamRead([b'invalid' * 20]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from osc.httpcache import MemoCache, ResponseCache, make_response, paths_overlap
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest(unittest.makeSuite(TestResponseCache))
+    s.addTest(unittest.makeSuite(TestMemoCache))
+    return s
+
+URL = 'http://localhost/source/foo/_meta'
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self.cache = ResponseCache(os.path.join(self.tmpdir, 'cache'), 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _store(self, url, path, body, headers={'ETag': '"abc"'}):
+        resp = self.cache.store('user', url, path, make_response(body, headers, url))
+        data = resp.read()
+        resp.close()
+        return data
+
+    def testCacheable(self):
+        for path in ('/source/foo', '/source/foo/_meta', '/source/foo/bar',
+                     '/source/foo/bar/_meta', '/build/foo/_result'):
+            self.assertTrue(self.cache.is_cacheable(path), path)
+        for path in ('/source/foo/bar/baz.spec', '/build/foo/repo/x86_64/bar/_log',
+                     '/request', '/search/request'):
+            self.assertFalse(self.cache.is_cacheable(path), path)
+
+    def testStoreAndRevalidate(self):
+        self.assertEqual(self.cache.lookup('user', URL), {})
+        self.assertEqual(self._store(URL, '/source/foo/_meta', b'<project/>'), b'<project/>')
+        self.assertEqual(self.cache.lookup('user', URL), {'If-None-Match': '"abc"'})
+        # the cache is per user
+        self.assertEqual(self.cache.lookup('other', URL), {})
+        resp = self.cache.response('user', URL)
+        self.assertEqual(resp.read(), b'<project/>')
+        self.assertEqual(resp.info().get('ETag'), '"abc"')
+        self.assertEqual(resp.info().get('Content-Length'), '10')
+        self.assertEqual(self.cache.hits, 1)
+
+    def testLastModified(self):
+        self._store(URL, '/source/foo/_meta', b'<project/>', {'Last-Modified': 'Thu, 01 Jan 2015 00:00:00 GMT'})
+        self.assertEqual(self.cache.lookup('user', URL),
+                         {'If-Modified-Since': 'Thu, 01 Jan 2015 00:00:00 GMT'})
+
+    def testNoValidators(self):
+        """responses without ETag and Last-Modified are not cached"""
+        self._store(URL, '/source/foo/_meta', b'<project/>', {})
+        self.assertEqual(self.cache.lookup('user', URL), {})
+
+    def testIncompleteRead(self):
+        """a partially read body is not cached"""
+        resp = self.cache.store('user', URL, '/source/foo/_meta', make_response(b'<project/>', {'ETag': '"a"'}, URL))
+        resp.read(3)
+        resp.close()
+        self.assertEqual(self.cache.lookup('user', URL), {})
+        self.assertEqual(os.listdir(self.cache.dir), [])
+
+    def testInvalidate(self):
+        pkg_url = 'http://localhost/source/foo/bar'
+        self._store(URL, '/source/foo/_meta', b'<project/>')
+        self._store(pkg_url, '/source/foo/bar', b'<directory/>')
+        self.cache.invalidate('/source/foo/bar/_meta')
+        self.assertEqual(self.cache.lookup('user', pkg_url), {})
+        self.assertNotEqual(self.cache.lookup('user', URL), {})
+
+    def testEvict(self):
+        """least recently used entries are evicted"""
+        urls = ['http://localhost/source/prj%d' % i for i in range(3)]
+        self.cache.maxsize = 4096
+        for i, url in enumerate(urls):
+            self._store(url, '/source/prj%d' % i, b'x' * 400)
+            fname = self.cache._filename('user', url)
+            os.utime(fname, (1000 + i, 1000 + i))
+        # mark the first entry as recently used
+        self.cache.response('user', urls[0])
+        # room for two entries
+        self.cache.maxsize = 1400
+        self.cache.evict()
+        self.assertNotEqual(self.cache.lookup('user', urls[0]), {})
+        self.assertEqual(self.cache.lookup('user', urls[1]), {})
+        self.assertNotEqual(self.cache.lookup('user', urls[2]), {})
+
+    def testPathsOverlap(self):
+        self.assertTrue(paths_overlap('/source/foo', '/source/foo/bar'))
+        self.assertTrue(paths_overlap('/source/foo/bar/_meta', '/source/foo/bar'))
+        self.assertFalse(paths_overlap('/source/foo', '/source/foobar'))
+        self.assertFalse(paths_overlap('/source/foo/_meta', '/source/foo/bar'))
+
+class TestMemoCache(unittest.TestCase):
+    KEY = ('user', URL)
+
+    def setUp(self):
+        self.memo = MemoCache()
+
+    def _store(self, key, path, body):
+        return self.memo.store(key, path, make_response(body, {'ETag': '"abc"'}, key[1])).read()
+
+    def testMemoizable(self):
+        for path in ('/source/foo', '/source/foo/_meta', '/source/foo/bar', '/source/foo/bar/_meta'):
+            self.assertTrue(self.memo.is_memoizable(path), path)
+        for path in ('/build/foo/_result', '/source/foo/bar/baz.spec', '/request'):
+            self.assertFalse(self.memo.is_memoizable(path), path)
+        self.assertTrue(self.memo.is_memoizable('/source/foo/bar', 'rev=3&expand=1'))
+        for query in ('view=info', 'view=info&package=bar', 'package=bar&view=getmultibuild'):
+            self.assertFalse(self.memo.is_memoizable('/source/foo', query), query)
+
+    def testStore(self):
+        self.assertEqual(self.memo.begin(self.KEY), None)
+        self.assertEqual(self._store(self.KEY, '/source/foo/_meta', b'<project/>'), b'<project/>')
+        resp = self.memo.begin(self.KEY)
+        self.assertEqual(resp.read(), b'<project/>')
+        self.assertEqual(resp.info().get('ETag'), '"abc"')
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(self.memo.hits, 1)
+        # the memo is per user
+        self.assertEqual(self.memo.begin(('other', URL)), None)
+
+    def testAbort(self):
+        self.assertEqual(self.memo.begin(self.KEY), None)
+        self.memo.abort(self.KEY)
+        self.assertEqual(self.memo.begin(self.KEY), None)
+
+    def testInvalidate(self):
+        pkg_key = ('user', 'http://localhost/source/foo/bar')
+        self.memo.begin(self.KEY)
+        self._store(self.KEY, '/source/foo/_meta', b'<project/>')
+        self.memo.begin(pkg_key)
+        self._store(pkg_key, '/source/foo/bar', b'<directory/>')
+        self.memo.invalidate('/source/foo/bar/_meta')
+        self.assertEqual(self.memo.begin(pkg_key), None)
+        self.assertNotEqual(self.memo.begin(self.KEY), None)
+
+    def testInvalidateInFlight(self):
+        """a response which was requested before a change is not memoized"""
+        self.memo.begin(self.KEY)
+        self.memo.invalidate('/source/bar')
+        self.assertEqual(self._store(self.KEY, '/source/foo/_meta', b'<project/>'), b'<project/>')
+        self.assertEqual(self.memo.begin(self.KEY), None)
+
+    def testCoalesce(self):
+        """a concurrent request waits for the response of the first one"""
+        self.assertEqual(self.memo.begin(self.KEY), None)
+        result = []
+        t = threading.Thread(target=lambda: result.append(self.memo.begin(self.KEY).read()))
+        t.start()
+        self._store(self.KEY, '/source/foo/_meta', b'<project/>')
+        t.join()
+        self.assertEqual(result, [b'<project/>'])
+
+if __name__ == '__main__':
+    unittest.main()
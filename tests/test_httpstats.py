@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from osc.httpcache import make_response
+from osc.httpstats import RequestStats, percentile, url_template
+
+def suite():
+    return unittest.makeSuite(TestRequestStats)
+
+APIURL = 'http://localhost'
+
+class TestRequestStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = RequestStats()
+
+    def _request(self, method, url, body=b'', data=b''):
+        rec = self.stats.start(method, url, APIURL, len(data))
+        resp = self.stats.response(rec, make_response(body, {}, url))
+        resp.read()
+        resp.close()
+        return rec
+
+    def testUrlTemplate(self):
+        self.assertEqual(url_template('/source/foo/bar'), '/source/{prj}/{pkg}')
+        self.assertEqual(url_template('/source/foo/_meta'), '/source/{prj}/_meta')
+        self.assertEqual(url_template('/source/foo/bar/bar.spec', 'rev=3'), '/source/{prj}/{pkg}/{file}')
+        self.assertEqual(url_template('/source/foo/bar', 'cmd=commit&rev=3'), '/source/{prj}/{pkg}?cmd=commit')
+        self.assertEqual(url_template('/build/foo/_result', 'package=bar'), '/build/{prj}/_result')
+        self.assertEqual(url_template('/build/foo/repo/x86_64/bar/_log'),
+                         '/build/{prj}/{repo}/{arch}/{pkg}/_log')
+        self.assertEqual(url_template('/search/request', 'match=foo'), '/search/request')
+        self.assertEqual(url_template('/request/42', 'cmd=changestate'), '/request/{id}?cmd=changestate')
+        self.assertEqual(url_template(''), '/')
+
+    def testPercentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def testRecord(self):
+        rec = self._request('PUT', APIURL + '/source/foo/bar/bar.spec', b'<status code="ok" />', b'x' * 10)
+        self.assertEqual(rec['endpoint'], '/source/{prj}/{pkg}/{file}')
+        self.assertEqual(rec['status'], 200)
+        self.assertEqual(rec['bytes_in'], 20)
+        self.assertEqual(rec['bytes_out'], 10)
+        self.assertTrue(rec['total'] >= rec['ttfb'] >= 0)
+
+    def testSummary(self):
+        self._request('GET', APIURL + '/source/foo/_meta', b'x' * 5)
+        self._request('GET', APIURL + '/source/bar/_meta', b'x' * 7)
+        self._request('GET', APIURL + '/source/foo/bar')
+        rec = self.stats.start('GET', APIURL + '/source/foo/baz', APIURL)
+        self.stats.error(rec, IOError())
+        rows = dict((row[0], row[1:]) for row in self.stats.summary())
+        self.assertEqual(sorted(rows.keys()), ['GET /source/{prj}/_meta', 'GET /source/{prj}/{pkg}'])
+        count, p50, p95, tmax, bytes_in, bytes_out = rows['GET /source/{prj}/_meta']
+        self.assertEqual((count, bytes_in, bytes_out), (2, 12, 0))
+        self.assertEqual(rows['GET /source/{prj}/{pkg}'][0], 2)
+        self.assertEqual(rec['status'], 'error')
+
+    def testDump(self):
+        tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        try:
+            self._request('GET', APIURL + '/source/foo/_meta', b'x' * 5)
+            self._request('POST', APIURL + '/source/foo/bar?cmd=commit', data=b'<directory />')
+            fname = os.path.join(tmpdir, 'stats.json')
+            self.stats.dump(fname)
+            records = [json.loads(line) for line in open(fname)]
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([(r['method'], r['endpoint'], r['bytes_in'], r['bytes_out']) for r in records],
+                         [('GET', '/source/{prj}/_meta', 5, 0),
+                          ('POST', '/source/{prj}/{pkg}?cmd=commit', 0, 13)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -66,6 +66,17 @@ class TestInitProject(OscTestCase):
         self._check_list(os.path.join(storedir, '_apiurl'), 'http://localhost\n')
         self.assertFalse(os.path.exists(os.path.join(storedir, '_packages')))
 
+    @GET('http://localhost/source/testprj?view=info&nofilename=1',
+         text='<sourceinfolist><sourceinfo package="foo" />'
+              '<sourceinfo package="bar"><linked project="testprj" package="foo" /></sourceinfo>'
+              '<sourceinfo package="baz"><linked project="other" package="foo" /></sourceinfo>'
+              '<sourceinfo package="broken"><error>bad link</error>'
+              '<linked project="testprj" package="foo" /></sourceinfo></sourceinfolist>')
+    def test_local_links(self):
+        """find the packages which link to a package of the same project"""
+        links = osc.core.get_local_links('http://localhost', 'testprj')
+        self.assertEqual(links, {'bar': 'foo'})
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
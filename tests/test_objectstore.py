@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from osc.objectstore import ObjectStore
+
+def suite():
+    return unittest.makeSuite(TestObjectStore)
+
+MD5 = 'd41d8cd98f00b204e9800998ecf8427e'
+
+class TestObjectStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self.objects = ObjectStore(os.path.join(self.tmpdir, 'objects'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, data=''):
+        fname = os.path.join(self.tmpdir, name)
+        with open(fname, 'w') as f:
+            f.write(data)
+        return fname
+
+    def testPath(self):
+        self.assertEqual(self.objects.path(MD5),
+                         os.path.join(self.tmpdir, 'objects', 'd4', MD5[2:]))
+        self.assertEqual(self.objects.path('../../etc/passwd'), None)
+        self.assertEqual(self.objects.path(None), None)
+        self.assertFalse(self.objects.has(None))
+
+    def testAdopt(self):
+        foo = self._write('foo')
+        self.assertFalse(self.objects.has(MD5))
+        self.objects.adopt(foo, MD5)
+        self.assertTrue(self.objects.has(MD5))
+        self.assertTrue(os.path.samefile(foo, self.objects.path(MD5)))
+        self.assertEqual(os.stat(self.objects.path(MD5)).st_mode & 0o777, 0o444)
+        # a second copy is replaced by a link to the object
+        bar = self._write('bar')
+        self.objects.adopt(bar, MD5)
+        self.assertTrue(os.path.samefile(bar, self.objects.path(MD5)))
+        self.assertEqual(os.stat(bar).st_nlink, 3)
+
+    def testLink(self):
+        foo = self._write('foo', 'local data')
+        self.assertFalse(self.objects.link(MD5, foo))
+        self.assertEqual(open(foo).read(), 'local data')
+        self.objects.adopt(self._write('bar'), MD5)
+        self.assertTrue(self.objects.link(MD5, foo))
+        self.assertEqual(open(foo).read(), '')
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['bar', 'foo', 'objects'])
+
+    def testGc(self):
+        foo = self._write('foo')
+        self.objects.adopt(foo, MD5)
+        md5 = '5d41402abc4b2a76b9719d911017c592'
+        self.objects.adopt(self._write('hello', 'hello'), md5)
+        self.assertEqual(self.objects.gc(), [])
+        os.unlink(foo)
+        self.assertEqual(self.objects.gc(dry_run=True), [(self.objects.path(MD5), 0)])
+        self.assertTrue(self.objects.has(MD5))
+        self.assertEqual(self.objects.gc(), [(self.objects.path(MD5), 0)])
+        self.assertFalse(self.objects.has(MD5))
+        self.assertTrue(self.objects.has(md5))
+
+if __name__ == '__main__':
+    unittest.main()
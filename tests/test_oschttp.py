@@ -0,0 +1,525 @@
+import errno
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+import osc.oschttp
+
+try:
+    from http.client import HTTPException
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError, URLError
+    from http.cookiejar import Cookie, CookieJar, LWPCookieJar
+    from urllib.request import build_opener, HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, Request
+except ImportError:
+    #python 2.x
+    from httplib import HTTPException
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from cookielib import Cookie, CookieJar, LWPCookieJar
+    from urllib2 import HTTPError, URLError, build_opener, HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, Request
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.makeSuite(TestKeepAlive))
+    s.addTests(unittest.makeSuite(TestPreemptiveAuth))
+    s.addTests(unittest.makeSuite(TestContentDecoding))
+    s.addTests(unittest.makeSuite(TestRetryPolicy))
+    s.addTests(unittest.makeSuite(TestUpload))
+    s.addTests(unittest.makeSuite(TestCookieJar))
+    return s
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, code=200):
+        body = ('path: %s\n' % self.path).encode('ascii')
+        encoding = None
+        if self.path.startswith('/encoded/'):
+            body *= 1000
+            encoding = self.path.split('/')[2]
+            if encoding == 'gzip':
+                c = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                body = c.compress(body) + c.flush()
+            elif encoding == 'deflate':
+                body = zlib.compress(body)
+            elif encoding == 'rawdeflate':
+                encoding = 'deflate'
+                c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+                body = c.compress(body) + c.flush()
+        self.send_response(code)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if code == 401:
+            self.send_header('WWW-Authenticate', 'Basic realm="osc"')
+        elif self.server.session and self.headers.get('Authorization'):
+            self.send_header('Set-Cookie', 'session=%s; Path=/' % self.server.session)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.close_after_request:
+            self.close_connection = True
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        self.server.requests.append(('GET', self.path))
+        self.server.auth_headers.append((self.headers.get('Authorization'), self.headers.get('Cookie')))
+        self.server.accept_encoding.append(self.headers.get('Accept-Encoding'))
+        if not self._authenticated():
+            self._respond(401)
+        elif self.path.startswith('/missing'):
+            self._respond(404)
+        elif self.path.startswith('/drop'):
+            # the request was processed, but the connection is dropped
+            # before the response is sent
+            self.close_connection = True
+        else:
+            self._respond()
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(('PUT', self.path))
+        self.server.uploads.append((self.headers.get('Content-Length'), body))
+        self._respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.peers.add(self.client_address)
+        self.server.requests.append(('POST', self.path))
+        if self.path.startswith('/drop'):
+            self.close_connection = True
+        else:
+            self._respond()
+
+    def _authenticated(self):
+        if not self.server.auth:
+            return True
+        session = self.server.session
+        if session and self.headers.get('Cookie') == 'session=%s' % session:
+            return True
+        return self.headers.get('Authorization') == self.server.auth
+
+    def log_message(self, *args):
+        pass
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        self.server.peers = set()
+        self.server.requests = []
+        self.server.auth_headers = []
+        self.server.accept_encoding = []
+        self.server.uploads = []
+        self.server.auth = None
+        self.server.session = None
+        self.server.close_after_request = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pool = osc.oschttp.ConnectionPool(maxsize=2, timeout=30)
+        self.opener = build_opener(osc.oschttp.KeepAliveHTTPHandler(self.pool))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path, data=None):
+        f = self.opener.open(self.url + path, data)
+        data = f.read()
+        f.close()
+        return data
+
+class TestKeepAlive(ServerTestCase):
+
+    def testReuse(self):
+        """subsequent requests use the same connection"""
+        for i in range(3):
+            self.assertEqual(self._get('/source/%d' % i), ('path: /source/%d\n' % i).encode('ascii'))
+        self.assertEqual(self.pool.created, 1)
+        self.assertEqual(self.pool.reused, 2)
+        self.assertEqual(len(self.server.peers), 1)
+
+    def testReadline(self):
+        """a response which is read line by line releases the connection"""
+        f = self.opener.open(self.url + '/foo')
+        self.assertEqual(f.readlines(), [b'path: /foo\n'])
+        f.close()
+        self._get('/bar')
+        self.assertEqual(self.pool.reused, 1)
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'python 2 responses are no context managers')
+    def testContextManager(self):
+        """a response can be used in a with statement"""
+        with self.opener.open(self.url + '/foo') as f:
+            self.assertFalse(f.closed)
+            self.assertEqual(f.read(), b'path: /foo\n')
+        self.assertTrue(f.fp.closed)
+        self._get('/bar')
+        self.assertEqual(self.pool.reused, 1)
+
+    def testUnreadResponse(self):
+        """a partially read response is not reused"""
+        f = self.opener.open(self.url + '/foo')
+        f.close()
+        self._get('/bar')
+        self.assertEqual(self.pool.created, 2)
+        self.assertEqual(self.pool.reused, 0)
+
+    def testIgnoredError(self):
+        """the connection of an ignored HTTPError is closed"""
+        self.assertRaises(HTTPError, self._get, '/missing')
+        self._get('/bar')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def testServerClosedConnection(self):
+        """reconnect if the server closed an idle connection"""
+        self.server.close_after_request = True
+        self.assertEqual(self._get('/foo'), b'path: /foo\n')
+        self.assertEqual(self._get('/bar'), b'path: /bar\n')
+        self.assertEqual(len(self.server.peers), 2)
+
+    def testNoResponseGET(self):
+        """a GET without response is resent on a fresh connection"""
+        self._get('/foo')
+        self.assertRaises((HTTPException, URLError), self._get, '/drop')
+        self.assertEqual(self.server.requests, [('GET', '/foo'), ('GET', '/drop'), ('GET', '/drop')])
+
+    def testNoResponsePOST(self):
+        """a POST without response is not replayed"""
+        self._get('/foo')
+        self.assertRaises((HTTPException, URLError), self._get, '/drop?cmd=commit', b'data')
+        self.assertEqual(self.server.requests, [('GET', '/foo'), ('POST', '/drop?cmd=commit')])
+
+    def testIdleTimeout(self):
+        """connections are not reused after the idle timeout"""
+        self.pool.timeout = -1
+        self._get('/foo')
+        self._get('/bar')
+        self.assertEqual(self.pool.created, 2)
+        self.assertEqual(self.pool.reused, 0)
+
+class PreemptiveBasicAuthHandler(osc.oschttp.PreemptiveBasicAuthMixin, HTTPBasicAuthHandler):
+    pass
+
+class TestPreemptiveAuth(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.auth = 'Basic Zm9vOmJhcg=='
+
+    def _build_opener(self, authhandler_class, apiurl=None, *handlers):
+        authhandler = authhandler_class(HTTPPasswordMgrWithDefaultRealm())
+        authhandler.add_password(None, apiurl or self.url, 'foo', 'bar')
+        self.opener = build_opener(authhandler, osc.oschttp.KeepAliveHTTPHandler(self.pool), *handlers)
+        return authhandler
+
+    def testChallenge(self):
+        """without preemptive auth every request is challenged"""
+        self._build_opener(HTTPBasicAuthHandler)
+        self._get('/foo')
+        self._get('/bar')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testPreemptive(self):
+        """credentials are sent with the first request"""
+        authhandler = self._build_opener(PreemptiveBasicAuthHandler)
+        self.assertEqual(self._get('/foo'), b'path: /foo\n')
+        self._get('/bar')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(authhandler.unchallenged_requests, 2)
+
+    def testConcurrentRequests(self):
+        """the requests of concurrent threads are all counted"""
+        authhandler = self._build_opener(PreemptiveBasicAuthHandler)
+        def worker():
+            for i in range(5):
+                self._get('/foo')
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(authhandler.unchallenged_requests, 20)
+
+    def testUnknownUrl(self):
+        """no credentials are sent to unknown urls"""
+        authhandler = self._build_opener(PreemptiveBasicAuthHandler, 'http://example.com')
+        try:
+            self._get('/foo')
+            self.fail('expected HTTPError')
+        except HTTPError as e:
+            self.assertEqual(e.code, 401)
+        self.assertEqual(self.server.auth_headers, [(None, None)])
+        self.assertEqual(authhandler.unchallenged_requests, 0)
+
+    def testSessionCookie(self):
+        """a session cookie is used instead of the credentials"""
+        self.server.session = 'secret'
+        authhandler = self._build_opener(PreemptiveBasicAuthHandler, None, HTTPCookieProcessor(CookieJar()))
+        self._get('/foo')
+        self._get('/bar')
+        self.assertEqual(self.server.auth_headers, [(self.server.auth, None), (None, 'session=secret')])
+        self.assertEqual(authhandler.unchallenged_requests, 2)
+
+    def testExpiredSessionCookie(self):
+        """the challenge is answered if the session expired"""
+        self.server.session = 'secret'
+        self._build_opener(PreemptiveBasicAuthHandler, None, HTTPCookieProcessor(CookieJar()))
+        self._get('/foo')
+        self.server.session = 'new'
+        self._get('/bar')
+        self.assertEqual(self.server.auth_headers, [(self.server.auth, None),
+                                                    (None, 'session=secret'),
+                                                    (self.server.auth, 'session=secret')])
+
+class TestContentDecoding(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.opener = build_opener(osc.oschttp.KeepAliveHTTPHandler(self.pool),
+                                   osc.oschttp.ContentDecodingProcessor())
+
+    def _check(self, path):
+        f = self.opener.open(self.url + path)
+        data = f.read()
+        raw_read = osc.oschttp.raw_bytes_read(f)
+        self.assertEqual(data, ('path: %s\n' % path).encode('ascii') * 1000)
+        self.assertEqual(raw_read, int(f.info().get('Content-Length')))
+        self.assertTrue(raw_read < len(data))
+        f.close()
+
+    def testGzip(self):
+        self._check('/encoded/gzip')
+        self.assertEqual(self.server.accept_encoding, ['gzip, deflate'])
+
+    def testDeflate(self):
+        self._check('/encoded/deflate')
+
+    def testRawDeflate(self):
+        """deflate streams without zlib header are accepted as well"""
+        self._check('/encoded/rawdeflate')
+
+    def testReadline(self):
+        """a decoded response is read line by line and releases the connection"""
+        f = self.opener.open(self.url + '/encoded/gzip')
+        lines = list(f)
+        f.close()
+        self.assertEqual(lines, [b'path: /encoded/gzip\n'] * 1000)
+        self._get('/foo')
+        self.assertEqual(self.pool.reused, 1)
+
+    def testReadlineLarge(self):
+        """a multi-MB body is read line by line in linear time"""
+        lines = [('line %d %s\n' % (i, 'x' * 20)).encode('ascii') for i in range(300000)]
+        comp = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = comp.compress(b''.join(lines)) + comp.flush()
+        f = osc.oschttp.DecodingResponseFile(io.BytesIO(body), 'gzip')
+        start = time.time()
+        self.assertEqual(f.readline(), lines[0])
+        self.assertEqual(f.read(len(lines[1])), lines[1])
+        self.assertEqual(f.readlines(), lines[2:])
+        self.assertEqual(f.readline(), b'')
+        self.assertEqual(f.raw_read, len(body))
+        self.assertTrue(time.time() - start < 5)
+
+    def testNotEncoded(self):
+        f = self.opener.open(self.url + '/foo')
+        self.assertEqual(osc.oschttp.raw_bytes_read(f), None)
+        self.assertEqual(f.read(), b'path: /foo\n')
+        f.close()
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = osc.oschttp.RetryPolicy(retries=3, delay=1, max_delay=5)
+
+    def _http_error(self, code, headers={}):
+        return HTTPError('http://localhost/', code, '', headers, None)
+
+    def testRetryable(self):
+        self.assertTrue(self.policy.is_retryable('POST', self._http_error(503)))
+        self.assertTrue(self.policy.is_retryable('GET', self._http_error(502)))
+        self.assertFalse(self.policy.is_retryable('POST', self._http_error(502)))
+        self.assertFalse(self.policy.is_retryable('GET', self._http_error(500)))
+        self.assertFalse(self.policy.is_retryable('GET', self._http_error(404)))
+        refused = URLError(socket.error(errno.ECONNREFUSED, 'Connection refused'))
+        reset = URLError(socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+        self.assertTrue(self.policy.is_retryable('POST', refused))
+        self.assertTrue(self.policy.is_retryable('GET', reset))
+        self.assertFalse(self.policy.is_retryable('POST', reset))
+        self.assertFalse(self.policy.is_retryable('GET', osc.oschttp.CircuitOpenError('open')))
+
+    def testBackoff(self):
+        """the delay grows exponentially (with jitter) up to max_delay"""
+        for attempt, maximum in ((1, 1), (2, 2), (3, 4)):
+            delay = self.policy.get_delay(attempt)
+            self.assertTrue(maximum / 2.0 <= delay <= maximum, (attempt, delay))
+        self.policy.retries = 10
+        self.assertTrue(self.policy.get_delay(5) <= 5)
+        self.assertEqual(self.policy.get_delay(11), None)
+
+    def testRetryAfter(self):
+        self.assertEqual(self.policy.get_delay(1, self._http_error(503, {'Retry-After': '3'})), 3)
+        # the server wants us to wait too long
+        self.assertEqual(self.policy.get_delay(1, self._http_error(503, {'Retry-After': '60'})), None)
+        self.assertEqual(osc.oschttp.parse_retry_after('Thu, 01 Jan 2015 00:00:10 GMT', now=1420070400), 10)
+        self.assertEqual(osc.oschttp.parse_retry_after('soon'), None)
+
+    def testCircuitBreaker(self):
+        breaker = osc.oschttp.CircuitBreaker(threshold=2, timeout=60)
+        breaker.failure()
+        breaker.check('http://localhost/')
+        breaker.failure()
+        self.assertRaises(osc.oschttp.CircuitOpenError, breaker.check, 'http://localhost/')
+        # after the timeout a single request is let through
+        breaker.opened -= 60
+        breaker.check('http://localhost/')
+        self.assertRaises(osc.oschttp.CircuitOpenError, breaker.check, 'http://localhost/')
+        breaker.success()
+        breaker.check('http://localhost/')
+
+class Meter:
+    """records the calls of a progress meter"""
+    def __init__(self):
+        self.calls = []
+    def start(self, basename=None, size=None, **kwargs):
+        self.calls.append(('start', basename, size))
+    def update(self, amount):
+        self.calls.append(('update', amount))
+    def end(self, amount):
+        self.calls.append(('end', amount))
+
+class TestUpload(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self.filename = os.path.join(self.tmpdir, 'big.tar')
+        self.content = os.urandom(1024 * 1024)
+        with open(self.filename, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def _put(self, data):
+        req = Request(self.url + '/source/prj/pkg/big.tar', data)
+        req.get_method = lambda: 'PUT'
+        req.add_header('Content-Length', str(len(data)))
+        return self.opener.open(req).read()
+
+    def testUpload(self):
+        """the file is streamed and the progress is reported"""
+        meter = Meter()
+        data = osc.oschttp.UploadFile(self.filename, meter)
+        self._put(data)
+        data.close()
+        self.assertEqual(self.server.uploads, [(str(len(self.content)), self.content)])
+        self.assertEqual(meter.calls[0], ('start', 'big.tar', len(self.content)))
+        self.assertEqual(meter.calls[-1], ('end', len(self.content)))
+        updates = [c[1] for c in meter.calls if c[0] == 'update']
+        self.assertTrue(len(updates) > 1)
+        self.assertEqual(updates, sorted(updates))
+
+    def testResend(self):
+        """the file is sent again from the start after seek(0)"""
+        data = osc.oschttp.UploadFile(self.filename)
+        data.read(1000)
+        data.seek(0)
+        self._put(data)
+        data.close()
+        self.assertEqual(self.server.uploads, [(str(len(self.content)), self.content)])
+
+    def testTransferProgress(self):
+        """concurrent uploads are reported as a single transfer"""
+        meter = Meter()
+        progress = osc.oschttp.TransferProgress(meter, 2 * len(self.content), '2 files')
+        f1 = osc.oschttp.UploadFile(self.filename, progress.file())
+        f2 = osc.oschttp.UploadFile(self.filename, progress.file())
+        f1.read(1000)
+        f2.read(500)
+        self.assertEqual(meter.calls, [('start', None, 2 * len(self.content)),
+                                       ('update', 1000), ('update', 1500)])
+        # f1 is sent again
+        f1.seek(0)
+        f1.read(100)
+        self.assertEqual(meter.calls[-2:], [('update', 500), ('update', 600)])
+        f1.read()
+        f2.read()
+        f1.close()
+        f2.close()
+        progress.end()
+        self.assertEqual(meter.calls[-1], ('end', 2 * len(self.content)))
+        updates = [c[1] for c in meter.calls if c[0] == 'update']
+        self.assertTrue(max(updates) < 2 * len(self.content))
+
+def make_cookie(name, value, domain='api.example.com'):
+    return Cookie(0, name, value, None, False, domain, True, False, '/', True,
+                  False, None, False, None, None, {})
+
+class TestCookieJar(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self.fname = os.path.join(self.tmpdir, 'cookiejar')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _load(self):
+        jar = LWPCookieJar(self.fname)
+        jar.load(ignore_discard=True)
+        return dict((c.name, c.value) for c in jar)
+
+    def testFlushInterval(self):
+        """changes are written at most every flush_interval seconds"""
+        jar = osc.oschttp.PersistentCookieJar(self.fname, flush_interval=3600)
+        for i in range(1000):
+            jar.set_cookie(make_cookie('session', str(i)))
+            jar.flush()
+        self.assertEqual(jar.saves, 0)
+        self.assertFalse(os.path.exists(self.fname))
+        jar.flush(force=True)
+        self.assertEqual(jar.saves, 1)
+        self.assertEqual(self._load(), {'session': '999'})
+        self.assertEqual(os.stat(self.fname).st_mode & 0o777, 0o600)
+        # nothing changed
+        jar.flush(force=True)
+        self.assertEqual(jar.saves, 1)
+
+    def testMerge(self):
+        """cookies saved by another process are kept"""
+        jar1 = osc.oschttp.PersistentCookieJar(self.fname)
+        jar2 = osc.oschttp.PersistentCookieJar(self.fname)
+        jar1.set_cookie(make_cookie('a', '1'))
+        jar1.set_cookie(make_cookie('b', '1'))
+        jar1.flush(force=True)
+        jar2.set_cookie(make_cookie('b', '2'))
+        jar2.set_cookie(make_cookie('c', '2'))
+        jar2.flush(force=True)
+        self.assertEqual(self._load(), {'a': '1', 'b': '2', 'c': '2'})
+
+    def testRemoved(self):
+        """removed cookies are not merged back from the file"""
+        jar = osc.oschttp.PersistentCookieJar(self.fname)
+        jar.set_cookie(make_cookie('a', '1'))
+        jar.set_cookie(make_cookie('b', '1'))
+        jar.flush(force=True)
+        jar.clear('api.example.com', '/', 'a')
+        jar.flush(force=True)
+        self.assertEqual(self._load(), {'b': '1'})
+        jar.clear()
+        jar.flush(force=True)
+        self.assertEqual(self._load(), {})
+
+if __name__ == '__main__':
+    unittest.main()
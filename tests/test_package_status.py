@@ -81,6 +81,46 @@ class TestPackageStatus(OscTestCase):
         st = p.get_status(True)
         self.assertEqual(exp_st, st)
 
+    def _record_hashing(self, p):
+        hashed = []
+        def dgst_files(files):
+            hashed.extend(os.path.basename(f) for f in files)
+            return osc.core.dgst_files(files)
+        p.stat_cache.dgst_files = dgst_files
+        return hashed
+
+    def test_stat_cache(self):
+        """unchanged files are not hashed again"""
+        self._change_to_pkg('simple')
+        p = osc.core.Package('.')
+        hashed = self._record_hashing(p)
+        exp_st = p.get_status()
+        self.assertEqual(sorted(hashed), ['nochange', 'test'])
+        self.assertTrue(os.path.isfile(os.path.join('.osc', '_stat_cache')))
+        p = osc.core.Package('.')
+        hashed = self._record_hashing(p)
+        self.assertEqual(exp_st, p.get_status())
+        self.assertEqual(hashed, [])
+
+    def test_stat_cache_modified(self):
+        """a file whose stat information changed is hashed again"""
+        self._change_to_pkg('simple')
+        osc.core.Package('.').get_status()
+        with open('test', 'a') as f:
+            f.write('modified\n')
+        p = osc.core.Package('.')
+        hashed = self._record_hashing(p)
+        self.assertEqual(p.status('test'), 'M')
+        self.assertEqual(hashed, ['test'])
+
+    def test_dgst_files(self):
+        """files are hashed in parallel"""
+        self._change_to_pkg('simple')
+        files = [os.path.abspath(f) for f in ('add', 'exists', 'missing', 'nochange', 'test')]
+        exp = dict((f, osc.core.dgst(f)) for f in files)
+        self.assertEqual(osc.core.dgst_files(files, workers=3), exp)
+        self.assertRaises(IOError, osc.core.dgst_files, files + ['doesnotexist'], workers=3)
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from osc import pkgcache
+
+def suite():
+    return unittest.TestSuite([unittest.makeSuite(TestHdrmd5Index),
+                               unittest.makeSuite(TestPackageCache)])
+
+class TestHdrmd5Index(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        os.makedirs(os.path.join(self.tmpdir, 'prj', 'repo', 'x86_64'))
+        self.queries = []
+        self._query_hdrmd5 = pkgcache.query_hdrmd5
+        pkgcache.query_hdrmd5 = self._query
+
+    def tearDown(self):
+        pkgcache.query_hdrmd5 = self._query_hdrmd5
+        shutil.rmtree(self.tmpdir)
+
+    def _query(self, fullfilename, is_container=False):
+        self.queries.append(os.path.basename(fullfilename))
+        with open(fullfilename, 'r') as f:
+            data = f.read()
+        return data.strip() or None
+
+    def _write(self, name, data):
+        fname = os.path.join(self.tmpdir, 'prj', 'repo', 'x86_64', name)
+        with open(fname + '.new', 'w') as f:
+            f.write(data)
+        os.rename(fname + '.new', fname)
+        return fname
+
+    def _index_file(self):
+        with open(os.path.join(self.tmpdir, pkgcache.INDEX_FILE), 'r') as f:
+            return json.load(f)
+
+    def test_cached(self):
+        """an unchanged package is not queried again"""
+        foo = self._write('foo.rpm', 'abc')
+        index = pkgcache.Hdrmd5Index(self.tmpdir)
+        self.assertEqual(index.record(foo), 'abc')
+        self.assertEqual(index.hdrmd5(foo), 'abc')
+        self.assertEqual(self.queries, ['foo.rpm'])
+        index.save()
+        index = pkgcache.Hdrmd5Index(self.tmpdir)
+        self.assertEqual(index.hdrmd5(foo), 'abc')
+        self.assertEqual(self.queries, ['foo.rpm'])
+        self.assertEqual(index.hits, 1)
+
+    def test_changed(self):
+        """a replaced package is queried again"""
+        foo = self._write('foo.rpm', 'abc')
+        index = pkgcache.Hdrmd5Index(self.tmpdir)
+        index.hdrmd5(foo)
+        self._write('foo.rpm', 'defg')
+        self.assertEqual(index.hdrmd5(foo), 'defg')
+        self.assertEqual(self.queries, ['foo.rpm', 'foo.rpm'])
+
+    def test_no_hdrmd5(self):
+        foo = self._write('foo.rpm', '')
+        index = pkgcache.Hdrmd5Index(self.tmpdir)
+        self.assertIsNone(index.hdrmd5(foo))
+        self.assertIsNone(index.hdrmd5(foo))
+        self.assertEqual(self.queries, ['foo.rpm', 'foo.rpm'])
+
+    def test_verify(self):
+        """with verify, each package is queried once"""
+        foo = self._write('foo.rpm', 'abc')
+        pkgcache.Hdrmd5Index(self.tmpdir).record(foo)
+        index = pkgcache.Hdrmd5Index(self.tmpdir, verify=True)
+        self.assertEqual(index.hdrmd5(foo), 'abc')
+        self.assertEqual(index.hdrmd5(foo), 'abc')
+        self.assertEqual(self.queries, ['foo.rpm', 'foo.rpm'])
+
+    def test_save_merge(self):
+        """entries of other processes are kept, removed packages are dropped"""
+        foo = self._write('foo.rpm', 'abc')
+        bar = self._write('bar.rpm', 'def')
+        baz = self._write('baz.rpm', 'ghi')
+        index1 = pkgcache.Hdrmd5Index(self.tmpdir)
+        index2 = pkgcache.Hdrmd5Index(self.tmpdir)
+        index1.record(foo)
+        index1.record(baz)
+        index2.record(bar)
+        index2.save()
+        os.unlink(baz)
+        index1.save()
+        entries = self._index_file()
+        self.assertEqual(sorted(entries.keys()), ['prj/repo/x86_64/bar.rpm', 'prj/repo/x86_64/foo.rpm'])
+        self.assertEqual(entries['prj/repo/x86_64/foo.rpm'][-1], 'abc')
+
+    def test_forget(self):
+        foo = self._write('foo.rpm', 'abc')
+        index = pkgcache.Hdrmd5Index(self.tmpdir)
+        index.record(foo)
+        index.save()
+        index.forget(foo)
+        index.save()
+        self.assertEqual(self._index_file(), {})
+
+class TestPackageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, size, days=0):
+        """a package of size bytes whose mtime is days days ago"""
+        fname = os.path.join(self.tmpdir, *path.split('/'))
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w') as f:
+            f.write('x' * size)
+        mtime = self.now - days * 24 * 60 * 60
+        os.utime(fname, (mtime, mtime))
+        return fname
+
+    def _paths(self, files):
+        return [path.replace(os.sep, '/') for path, _, _ in files]
+
+    def test_files(self):
+        """temporary files, the index files and public keys are no packages"""
+        self._write('prj/repo/x86_64/foo.rpm', 10)
+        self._write('prj/repo/x86_64/.osc_build_file123', 10)
+        self._write('prj/_pubkey', 10)
+        cache = pkgcache.PackageCache(self.tmpdir)
+        cache.record_use([])
+        self.assertEqual(self._paths(cache.files()), ['prj/repo/x86_64/foo.rpm'])
+
+    def test_lru(self):
+        """packages are evicted by their last use, not by their mtime"""
+        foo = self._write('prj/repo/x86_64/foo.rpm', 100, days=10)
+        self._write('prj/repo/x86_64/bar.rpm', 100, days=5)
+        self._write('prj/repo/x86_64/baz.rpm', 100, days=1)
+        cache = pkgcache.PackageCache(self.tmpdir, max_size=200)
+        cache.record_use([foo], hits=1)
+        # foo is the oldest file, but it was just used
+        self.assertEqual(self._paths(cache.plan(cache.files(), self.now + 2 * 60 * 60)),
+                         ['prj/repo/x86_64/bar.rpm'])
+
+    def test_max_age(self):
+        self._write('prj/repo/x86_64/foo.rpm', 100, days=10)
+        self._write('prj/repo/x86_64/bar.rpm', 100, days=5)
+        self._write('prj/repo/x86_64/baz.rpm', 100, days=1)
+        cache = pkgcache.PackageCache(self.tmpdir, max_age=3 * 24 * 60 * 60)
+        self.assertEqual(self._paths(cache.plan(cache.files())),
+                         ['prj/repo/x86_64/foo.rpm', 'prj/repo/x86_64/bar.rpm'])
+
+    def test_recently_used(self):
+        """packages which were used within the last hour are not evicted"""
+        self._write('prj/repo/x86_64/foo.rpm', 100, days=1)
+        self._write('prj/repo/x86_64/bar.rpm', 100)
+        cache = pkgcache.PackageCache(self.tmpdir, max_size=1)
+        self.assertEqual(self._paths(cache.plan(cache.files())), ['prj/repo/x86_64/foo.rpm'])
+
+    def test_redownloaded(self):
+        """a package which was downloaded again after its last logged use is not evicted"""
+        foo = self._write('prj/repo/x86_64/foo.rpm', 100, days=10)
+        cache = pkgcache.PackageCache(self.tmpdir, max_size=1)
+        cache.record_use([foo])
+        usage = cache.usage()
+        usage['used']['prj/repo/x86_64/foo.rpm'] -= 10 * 24 * 60 * 60
+        pkgcache._write_json(cache.usage_file, usage)
+        self.assertEqual(self._paths(cache.plan(cache.files())), ['prj/repo/x86_64/foo.rpm'])
+        self._write('prj/repo/x86_64/foo.rpm', 100)
+        self.assertEqual(cache.plan(cache.files()), [])
+
+    def test_lock_file(self):
+        """the lock file is not writable for other users"""
+        pkgcache.PackageCache(self.tmpdir).record_use([])
+        mode = os.stat(os.path.join(self.tmpdir, pkgcache.LOCK_FILE)).st_mode
+        self.assertEqual(mode & 0o022, 0)
+
+    def test_prune(self):
+        foo = self._write('prj/repo/x86_64/foo.rpm', 100, days=10)
+        bar = self._write('prj/repo/x86_64/bar.rpm', 100, days=1)
+        pkgcache._write_json(os.path.join(self.tmpdir, pkgcache.INDEX_FILE),
+                             {'prj/repo/x86_64/foo.rpm': [1, 100, 0, 'abc'],
+                              'prj/repo/x86_64/bar.rpm': [2, 100, 0, 'def']})
+        cache = pkgcache.PackageCache(self.tmpdir, max_size=150)
+        self.assertEqual(self._paths(cache.prune(dry_run=True)), ['prj/repo/x86_64/foo.rpm'])
+        self.assertTrue(os.path.exists(foo))
+        self.assertEqual(self._paths(cache.prune()), ['prj/repo/x86_64/foo.rpm'])
+        self.assertFalse(os.path.exists(foo))
+        self.assertTrue(os.path.exists(bar))
+        index = pkgcache._read_json(os.path.join(self.tmpdir, pkgcache.INDEX_FILE))
+        self.assertEqual(list(index.keys()), ['prj/repo/x86_64/bar.rpm'])
+        self.assertEqual(cache.prune(), [])
+
+    def test_stats(self):
+        foo = self._write('prj/repo/x86_64/foo.rpm', 100, days=10)
+        self._write('prj/repo/i586/foo.rpm', 50, days=10)
+        self._write('other/standard/x86_64/bar.rpm', 10, days=1)
+        cache = pkgcache.PackageCache(self.tmpdir, max_age=5 * 24 * 60 * 60)
+        cache.record_use([foo], hits=3, misses=1)
+        cache.record_use([], hits=1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (4, 1))
+        self.assertEqual((stats['size'], stats['files']), (160, 3))
+        self.assertEqual(stats['repos'], {('prj', 'repo'): (150, 2), ('other', 'standard'): (10, 1)})
+        self.assertEqual(self._paths(stats['evict']), ['prj/repo/i586/foo.rpm'])
+
+if __name__ == '__main__':
+    unittest.main()
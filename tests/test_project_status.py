@@ -128,6 +128,23 @@ class TestProjectStatus(OscTestCase):
         self.assertEqual(p.name, 'deleted')
         self.assertEqual(p.progress_obj, {})
 
+    def test_get_pacobj_lazy(self):
+        """the store of the package is read on first access"""
+        self._change_to_pkg('.')
+        prj = osc.core.Project('.', getPackageList=False)
+        p = prj.get_pacobj('simple')
+        self.assertFalse('filelist' in p.__dict__)
+        p.todo = ['foo']
+        self.assertEqual(p.todo, ['foo'])
+        self.assertEqual(p.name, 'simple')
+        self.assertTrue('filelist' in p.__dict__)
+
+    def test_lazy_package_error(self):
+        """errors are raised when the package is read"""
+        p = osc.core.LazyPackage(os.path.join(self.tmpdir, 'nonexistent'))
+        self.assertRaises(osc.oscerr.NoWorkingCopy, getattr, p, 'name')
+        self.assertRaises(osc.oscerr.NoWorkingCopy, getattr, p, 'name')
+
     def test_get_pacobj_missing(self):
         """package is missing"""
         self._change_to_pkg('.')
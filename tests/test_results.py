@@ -0,0 +1,71 @@
+import osc.core
+import os
+from common import GET, OscTestCase
+FIXTURES_DIR = os.path.join(os.getcwd(), 'results_fixtures')
+
+try:
+    from io import BytesIO
+except ImportError:
+    #python 2.x
+    from cStringIO import StringIO as BytesIO
+
+def suite():
+    import unittest
+    return unittest.makeSuite(TestResults)
+
+class TestResults(OscTestCase):
+    def setUp(self):
+        OscTestCase.setUp(self, copytree=False)
+
+    def _get_fixtures_dir(self):
+        return FIXTURES_DIR
+
+    def testIterXmlElements(self):
+        """elements are yielded when they are complete and removed afterwards"""
+        f = BytesIO(b'<a x="1"><b y="2"><c /><c /></b><d /></a>')
+        seen = []
+        for parents, elem in osc.core.iter_xml_elements(f, depth=2):
+            seen.append(([p.tag for p in parents], elem.tag, len(elem)))
+            self.assertEqual(parents[0].get('x'), '1')
+            root = parents[0]
+        self.assertEqual(seen, [(['a', 'b'], 'c', 0), (['a', 'b'], 'c', 0),
+                                (['a'], 'b', 0), (['a'], 'd', 0)])
+        self.assertEqual(len(root), 0)
+
+    @GET('http://localhost/build/osctest/_result', file='result.xml')
+    def testPrjResults(self):
+        res = osc.core.get_prj_results('http://localhost', 'osctest', hide_legend=True, show_excluded=True)
+        self.assertEqual(res, [' bar', ' | baz', ' | | foo',
+                               ' ? U x  SLE_15 x86_64 (published)',
+                               ' s ? %  openSUSE_Tumbleweed i586 (outdated)',
+                               ' . ? F  openSUSE_Tumbleweed x86_64 (published)', ''])
+
+    @GET('http://localhost/build/osctest/_result', file='result.xml')
+    def testPrjResultsFiltered(self):
+        res = osc.core.get_prj_results('http://localhost', 'osctest', hide_legend=True,
+                                       arch=['x86_64'], status_filter='F')
+        self.assertEqual(res, [' foo', ' F  openSUSE_Tumbleweed x86_64 (published)', ''])
+
+    @GET('http://localhost/build/osctest/_result', text='<resultlist state="00" />')
+    def testPrjResultsEmpty(self):
+        self.assertEqual(osc.core.get_prj_results('http://localhost', 'osctest'), [])
+
+    @GET('http://localhost/source/osctest?view=info&package=bar&package=foo', file='sourceinfo.xml')
+    def testProjectSourceinfo(self):
+        res = osc.core.get_project_sourceinfo('http://localhost', 'osctest', False, 'bar', 'foo')
+        self.assertEqual(sorted(res.keys()), ['bar', 'foo'])
+        self.assertEqual(res['foo'].get('rev'), '7')
+        self.assertEqual(res['foo'].find('linked').get('project'), 'other')
+
+    @GET('http://localhost/source/osctest?view=info&package=foo', file='sourceinfo.xml')
+    @GET('http://localhost/source/osctest?view=info&package=foo', file='sourceinfo.xml')
+    def testProjectSourceinfoNotMemoized(self):
+        """the streamed sourceinfo is requested again instead of being kept in memory"""
+        for i in range(2):
+            res = osc.core.get_project_sourceinfo('http://localhost', 'osctest', False, 'foo')
+            self.assertEqual(res['foo'].get('rev'), '7')
+        self.assertEqual(osc.core.conf.get_memo_cache().hits, 0)
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,128 @@
+import osc.core
+import osc.oschttp
+import os
+from common import GET, POST, OscTestCase
+FIXTURES_DIR = os.path.join(os.getcwd(), 'retry_fixtures')
+
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    #python 2.x
+    from urllib2 import HTTPError
+
+RESULT = '<resultlist state="c0ffee"><result project="osctest" repository="standard" arch="x86_64" ' \
+         'code="published" state="published"><status package="foo" code="succeeded" /></result></resultlist>'
+
+def suite():
+    import unittest
+    return unittest.makeSuite(TestRetry)
+
+class TestRetry(OscTestCase):
+    def setUp(self):
+        OscTestCase.setUp(self, copytree=False)
+        osc.core.conf.circuit_breakers.clear()
+
+    def _get_fixtures_dir(self):
+        return FIXTURES_DIR
+
+    @GET('http://localhost/source/osctest', text='', code=502)
+    @GET('http://localhost/source/osctest', text='', code=504)
+    @GET('http://localhost/source/osctest', text='<directory />')
+    def testProxyTimeout(self):
+        """GET requests are retried after a proxy timeout"""
+        f = osc.core.http_GET('http://localhost/source/osctest')
+        self.assertEqual(f.read(), '<directory />')
+
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='', code=503)
+    def testRetryBudget(self):
+        """the error is raised after http_retries retries"""
+        try:
+            osc.core.http_GET('http://localhost/source/osctest')
+            self.fail('expected HTTPError')
+        except HTTPError as e:
+            self.assertEqual(e.code, 503)
+
+    @POST('http://localhost/source/osctest/pkg?cmd=commit', exp='', text='', code=502)
+    def testPOSTNotRetried(self):
+        """a POST is not replayed after a proxy timeout"""
+        self.assertRaises(HTTPError, osc.core.http_POST, 'http://localhost/source/osctest/pkg?cmd=commit')
+
+    @POST('http://localhost/source/osctest/pkg?cmd=commit', exp='', text='', code=503)
+    @POST('http://localhost/source/osctest/pkg?cmd=commit', exp='', text='ok')
+    def testPOSTUnavailable(self):
+        """a POST is retried if the server refused to process it"""
+        self.assertEqual(osc.core.http_POST('http://localhost/source/osctest/pkg?cmd=commit').read(), 'ok')
+
+    @GET('http://localhost/source/osctest', text='', code=404)
+    def testNotFound(self):
+        """client errors are not retried"""
+        self.assertRaises(HTTPError, osc.core.http_GET, 'http://localhost/source/osctest')
+
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest/pkg', text='', code=503)
+    def testCircuitBreaker(self):
+        """requests fail fast once the server failed repeatedly"""
+        self.assertRaises(HTTPError, osc.core.http_GET, 'http://localhost/source/osctest')
+        # the fourth failure opens the circuit
+        self.assertRaises(osc.oschttp.CircuitOpenError, osc.core.http_GET, 'http://localhost/source/osctest/pkg')
+        self.assertRaises(osc.oschttp.CircuitOpenError, osc.core.http_GET, 'http://localhost/source/osctest/pkg')
+
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='<directory />')
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='', code=503)
+    @GET('http://localhost/source/osctest', text='<directory />')
+    def testCircuitBreakerReset(self):
+        """a successful request resets the failure count"""
+        osc.core.http_GET('http://localhost/source/osctest')
+        osc.core.http_GET('http://localhost/source/osctest')
+
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    @GET('http://localhost/build/osctest/_result?package=foo', text=RESULT)
+    def testResultsWatchProxyTimeout(self):
+        """a watch keeps polling the results through proxy timeouts"""
+        res = list(osc.core.get_package_results('http://localhost', 'osctest', 'foo', wait=True))
+        self.assertEqual(res, [RESULT])
+
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='<html>Bad Gateway', code=502)
+    def testResultsProxyTimeout(self):
+        """without a watch, the proxy error is raised (its page is no xml)"""
+        try:
+            list(osc.core.get_package_results('http://localhost', 'osctest', 'foo'))
+            self.fail('expected HTTPError')
+        except HTTPError as e:
+            self.assertEqual(e.code, 502)
+
+    @GET('http://localhost/build/osctest/_result?package=foo', text='', code=504)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='', code=504)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='', code=504)
+    @GET('http://localhost/build/osctest/_result?package=foo', text='', code=504)
+    @GET('http://localhost/build/osctest/_result?package=foo', text=RESULT)
+    def testResultsWatchCircuitOpen(self):
+        """a watch waits for the breaker timeout instead of aborting"""
+        sleeps = []
+        def sleep(delay):
+            sleeps.append(delay)
+            breaker = osc.core.conf.get_circuit_breaker('http://localhost')
+            if breaker.opened is not None:
+                breaker.opened -= delay
+        orig_sleep = osc.core.time.sleep
+        osc.core.time.sleep = sleep
+        try:
+            res = list(osc.core.get_package_results('http://localhost', 'osctest', 'foo', wait=True))
+        finally:
+            osc.core.time.sleep = orig_sleep
+        self.assertEqual(res, [RESULT])
+        self.assertEqual(sleeps[-1], 60.0)
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,77 @@
+import osc.core
+import osc.statusd
+import os
+import socket
+import threading
+import unittest
+from common import OscTestCase
+
+FIXTURES_DIR = os.path.join(os.getcwd(), 'project_package_status_fixtures')
+
+def suite():
+    return unittest.makeSuite(TestStatusDaemon)
+
+def inotify_available():
+    try:
+        osc.statusd.Inotify().close()
+        return True
+    except OSError:
+        return False
+
+@unittest.skipUnless(inotify_available(), 'inotify is not available')
+class TestStatusDaemon(OscTestCase):
+    def _get_fixtures_dir(self):
+        return FIXTURES_DIR
+
+    def setUp(self):
+        OscTestCase.setUp(self)
+        self.pkgdir = os.path.join(self.tmpdir, 'osctest', 'simple')
+        self.socket_path = os.path.join(self.tmpdir, 'status.sock')
+        self.daemon = osc.statusd.StatusDaemon(self.socket_path, [os.path.join(self.tmpdir, 'osctest')])
+
+    def tearDown(self):
+        self.daemon.close()
+        OscTestCase.tearDown(self)
+
+    def _query(self, pdir, excluded=False):
+        """query the daemon (which answers a single request)"""
+        t = threading.Thread(target=lambda: self.daemon.handle_client(self.daemon.sock.accept()[0]))
+        t.start()
+        try:
+            return osc.statusd.query(self.socket_path, pdir, excluded)
+        finally:
+            t.join()
+
+    def test_status(self):
+        """the status is computed once and kept until the working copy changes"""
+        self.assertTrue(self.pkgdir in self.daemon.packages)
+        exp = osc.core.Package(self.pkgdir).get_status()
+        self.assertEqual(self._query(self.pkgdir), exp)
+        self.assertEqual(self._query(self.pkgdir), exp)
+        self.assertEqual(self.daemon.hits, 1)
+        with open(os.path.join(self.pkgdir, 'test'), 'a') as f:
+            f.write('modified\n')
+        self.assertTrue(('M', 'test') in self._query(self.pkgdir))
+        self.assertEqual(self.daemon.hits, 1)
+        os.unlink(os.path.join(self.pkgdir, 'exists'))
+        self.assertFalse(('?', 'exists') in self._query(self.pkgdir))
+
+    def test_store_changed(self):
+        """changes of the store invalidate the status"""
+        self._query(self.pkgdir)
+        p = osc.core.Package(self.pkgdir)
+        p.to_be_added.append('exists')
+        p.write_addlist()
+        self.assertTrue(('A', 'exists') in self._query(self.pkgdir))
+        self.assertEqual(self.daemon.hits, 0)
+
+    def test_not_watched(self):
+        """the client scans working copies which are not watched itself"""
+        self.assertEqual(self._query(self.tmpdir), None)
+        p = osc.core.Package(self.pkgdir)
+        os.unlink(self.socket_path)
+        self.assertEqual(osc.statusd.get_status(self.socket_path, p, False, ' '),
+                         p.get_status(False, ' '))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
+import osc.conf
 import osc.core
 import osc.oscerr
 import os
+import shutil
 import sys
+import tempfile
+import time
 from common import GET, OscTestCase
 FIXTURES_DIR = os.path.join(os.getcwd(), 'update_fixtures')
 
@@ -65,6 +69,61 @@ class TestUpdate(OscTestCase):
         self.assertEqual(sys.stdout.getvalue(), exp)
         self._check_digests('testUpdateUpstreamModifiedFile_files')
 
+    @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateUpstreamModifiedFile_files')
+    @GET('http://localhost/source/osctest/simple/foo?rev=2', file='testUpdateUpstreamModifiedFile_foo')
+    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
+    def testUpdatePrefetched(self):
+        """the modified file was downloaded by a SourcePrefetcher"""
+        self._change_to_pkg('simple')
+        p = osc.core.Package('.')
+        tmpdir = tempfile.mkdtemp(dir=self.tmpdir)
+        prefetcher = osc.core.SourcePrefetcher(tmpdir, 1)
+        prefetcher.add_package(0, p.prefetch_update, 2)
+        # wait until the file was downloaded
+        for i in range(500):
+            if os.path.exists(os.path.join(tmpdir, '0-foo')):
+                break
+            time.sleep(0.01)
+        prefetcher.claim_package(0)
+        p.prefetcher = prefetcher
+        p.update(rev=2)
+        self.assertEqual(os.listdir(tmpdir), [])
+        prefetcher.close()
+        exp = 'U    foo\nAt revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self._check_digests('testUpdateUpstreamModifiedFile_files')
+
+    @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateUpstreamModifiedFile_files')
+    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
+    def testUpdateObjectStore(self):
+        """the modified file is linked from the object store instead of being downloaded"""
+        osc.conf.config['object_store_dir'] = os.path.join(self.tmpdir, 'objects')
+        objects = osc.conf.get_object_store()
+        fname = os.path.join(self.tmpdir, 'foo')
+        shutil.copyfile(os.path.join(FIXTURES_DIR, 'testUpdateUpstreamModifiedFile_foo'), fname)
+        objects.adopt(fname, 'bb3a1efda68dff80ec3a2fb599b97ad8')
+        self._change_to_pkg('simple')
+        osc.core.Package('.').update(rev=2)
+        exp = 'U    foo\nAt revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self._check_digests('testUpdateUpstreamModifiedFile_files')
+        self.assertEqual(os.stat(os.path.join('.osc', 'foo')).st_nlink, 3)
+        self.assertEqual(os.stat('foo').st_nlink, 1)
+
+    @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateUpstreamModifiedFile_files')
+    @GET('http://localhost/source/osctest/simple/foo?rev=2', file='testUpdateUpstreamModifiedFile_foo')
+    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
+    def testUpdateObjectStoreAdopt(self):
+        """a downloaded file is added to the object store"""
+        osc.conf.config['object_store_dir'] = os.path.join(self.tmpdir, 'objects')
+        self._change_to_pkg('simple')
+        osc.core.Package('.').update(rev=2)
+        self._check_digests('testUpdateUpstreamModifiedFile_files')
+        objects = osc.conf.get_object_store()
+        path = objects.path('bb3a1efda68dff80ec3a2fb599b97ad8')
+        self.assertTrue(os.path.samefile(path, os.path.join('.osc', 'foo')))
+        self.assertEqual(objects.gc(), [])
+
     @GET('http://localhost/source/osctest/conflict?rev=2', file='testUpdateConflict_files')
     @GET('http://localhost/source/osctest/conflict/merge?rev=2', file='testUpdateConflict_merge')
     @GET('http://localhost/source/osctest/conflict/_meta', file='meta.xml')
@@ -253,7 +312,6 @@ class TestUpdate(OscTestCase):
     @GET('http://localhost/source/osctest/simple/merge?rev=2', file='testUpdateResume_merge')
     @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
     @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateResume_files')
-    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
     def testUpdateResume(self):
         """resume an aborted update"""
         self._change_to_pkg('resume')
@@ -267,7 +325,6 @@ class TestUpdate(OscTestCase):
     @GET('http://localhost/source/osctest/simple/merge?rev=1', file='testUpdateResumeDeletedFile_merge')
     @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
     @GET('http://localhost/source/osctest/simple?rev=1', file='testUpdateResumeDeletedFile_files')
-    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
     def testUpdateResumeDeletedFile(self):
         """
         resume an aborted update (the file 'added' was already deleted in the first update
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from osc import wcindex
+
+def suite():
+    return unittest.makeSuite(TestWcIndex)
+
+NAMES = ('_project', '_to_be_added', '_in_conflict')
+
+class TestWcIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
+        self._write('_project', 'osctest\n')
+        self._write('_to_be_added', 'foo\nbar\n')
+        self.reads = []
+        self._read_file = wcindex._read_file
+        wcindex._read_file = self._record_read
+
+    def tearDown(self):
+        wcindex._read_file = self._read_file
+        shutil.rmtree(self.tmpdir)
+
+    def _record_read(self, storedir, name):
+        self.reads.append(name)
+        return self._read_file(storedir, name)
+
+    def _write(self, name, data, age=10):
+        tmpname = os.path.join(self.tmpdir, name + '.new')
+        with open(tmpname, 'w') as f:
+            f.write(data)
+        # the file is not racy (see wcindex.RACY_SECONDS)
+        mtime = time.time() - age
+        os.utime(tmpname, (mtime, mtime))
+        os.rename(tmpname, os.path.join(self.tmpdir, name))
+
+    def _derive(self, contents):
+        return contents['_to_be_added'].split()
+
+    def _set_mtime(self, mtime):
+        # the mtime of the store directory is older than the timestamp granularity
+        os.utime(self.tmpdir, (mtime, mtime))
+
+    def testRead(self):
+        exp = {'_project': 'osctest\n', '_to_be_added': 'foo\nbar\n', '_in_conflict': None}
+        self.assertEqual(wcindex.read(self.tmpdir, NAMES, self._derive), (exp, ['foo', 'bar']))
+        self.assertEqual(self.reads, list(NAMES))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, wcindex.INDEX_FILE)))
+        self.reads = []
+        self.assertEqual(wcindex.read(self.tmpdir, NAMES, self._derive), (exp, ['foo', 'bar']))
+        self.assertEqual(self.reads, [])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['_index', '_project', '_to_be_added'])
+
+    def testChanged(self):
+        """a file which is replaced or added invalidates the index"""
+        wcindex.read(self.tmpdir, NAMES)
+        self._set_mtime(time.time() - 10)
+        self._write('_in_conflict', 'foo\n')
+        contents, _ = wcindex.read(self.tmpdir, NAMES)
+        self.assertEqual(contents['_in_conflict'], 'foo\n')
+        self.assertEqual(len(self.reads), 6)
+        self._set_mtime(time.time() - 10)
+        os.unlink(os.path.join(self.tmpdir, '_in_conflict'))
+        contents, _ = wcindex.read(self.tmpdir, NAMES)
+        self.assertEqual(contents['_in_conflict'], None)
+        self.assertEqual(len(self.reads), 9)
+
+    def testOtherNames(self):
+        wcindex.read(self.tmpdir, NAMES)
+        wcindex.read(self.tmpdir, NAMES[:2])
+        self.assertEqual(len(self.reads), 5)
+
+    def testUnchanged(self):
+        """files which are not indexed do not invalidate the index"""
+        wcindex.read(self.tmpdir, NAMES)
+        with wcindex.unchanged(self.tmpdir):
+            self._write('_stat_cache', '{}')
+        wcindex.read(self.tmpdir, NAMES)
+        self.assertEqual(len(self.reads), 3)
+
+    def testModifiedInPlace(self):
+        """a file which is rewritten in place (the directory mtime does not change) invalidates the index"""
+        wcindex.read(self.tmpdir, NAMES)
+        dir_mtime = os.stat(self.tmpdir).st_mtime
+        fname = os.path.join(self.tmpdir, '_to_be_added')
+        with open(fname, 'r+') as f:
+            f.write('baz\nqux\n')
+        mtime = time.time() - 5
+        os.utime(fname, (mtime, mtime))
+        self.assertEqual(os.stat(self.tmpdir).st_mtime, dir_mtime)
+        contents, derived = wcindex.read(self.tmpdir, NAMES, self._derive)
+        self.assertEqual(contents['_to_be_added'], 'baz\nqux\n')
+        self.assertEqual(derived, ['baz', 'qux'])
+
+    def testRacy(self):
+        """no index is written while a file was modified too recently"""
+        self._write('_to_be_added', 'foo\n', age=0)
+        wcindex.read(self.tmpdir, NAMES)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, wcindex.INDEX_FILE)))
+        wcindex.read(self.tmpdir, NAMES)
+        self.assertEqual(len(self.reads), 6)
+        mtime = time.time() - 10
+        os.utime(os.path.join(self.tmpdir, '_to_be_added'), (mtime, mtime))
+        wcindex.read(self.tmpdir, NAMES)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, wcindex.INDEX_FILE)))
+
+    def testCorrupt(self):
+        wcindex.read(self.tmpdir, NAMES)
+        with open(os.path.join(self.tmpdir, wcindex.INDEX_FILE), 'r+b') as f:
+            f.seek(wcindex.HEADER.size)
+            f.write(b'garbage')
+        contents, _ = wcindex.read(self.tmpdir, NAMES)
+        self.assertEqual(contents['_project'], 'osctest\n')
+
+if __name__ == '__main__':
+    unittest.main()